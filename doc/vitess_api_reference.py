@@ -17,197 +17,285 @@
 """
 """
 
+import hashlib
 import json
 import os
 import optparse
 import pprint
 import re
 
-#def print_api_summary(doc, service_summary):
-#  doc.write(service_summary + '\n\n')
-
-def print_method_summary(doc, proto_contents, methods):
-  for method in sorted(methods, key=lambda k: k['name']):
-    method_group_info = method['comment'].split(' API group: ')
-    if len(method_group_info) > 1:
-      method['group'] = method_group_info[1]
-      method['comment'] = method_group_info[0]
+# Bump when parse_proto changes, to invalidate the cached protos.
+CACHE_VERSION = 2
+
+GROUP_ORDERING = ['Range-based Sharding',
+                  'Transactions',
+                  'Custom Sharding',
+                  'Map Reduce',
+                  'Topology',
+                  'v3 API (alpha)']
+
+# The introductions of the documents of services, by default their comment.
+SERVICE_SUMMARIES = {
+    'Vitess': ('This document describes Vitess API methods that enable your ' +
+               'client application to more easily talk to your storage ' +
+               'system to query data.'),
+}
+
+class Document(object):
+  """
+  A document of a service being rendered. The print_* functions describe
+  it through the methods below, which every format implements, and the
+  text is buffered until the document is saved.
+  """
+
+  extension = None
+
+  def __init__(self, title):
+    self.title = title
+    self.chunks = []
+
+  def write(self, text):
+    self.chunks.append(text)
+
+  def header(self):
+    return ''
+
+  def footer(self):
+    return ''
+
+  def save(self, path):
+    with open(path, 'w') as doc:
+      doc.write(self.header() + ''.join(self.chunks) + self.footer())
+
+  def text(self, text):
+    """Return text escaped for the document."""
+    return text
+
+  def type_text(self, prop_type):
+    """Return the text of a property type returned by property_type."""
+    if prop_type['anchor']:
+      text = self.link(prop_type['label'], prop_type['anchor'])
     else:
-      method['group'] = 'Uncategorized'
-
-  doc.write('This document describes Vitess API methods that enable your ' +
-            'client application to more easily talk to your storage system ' +
-            'to query data. API methods are grouped into the following ' +
-            'categories:\n\n')
-  last_group = ''
-  for group in proto_contents['group-ordering']:
-    for method in sorted(methods, key=lambda k: (k['group'], k['name'])):
-      if (group.lower() == method['group'].lower() and
-          not method['group'] == last_group):
-        if not method['group'] == last_group:
-          doc.write('* [' + method['group'] + ']' +
-                    '(#' + method['group'].replace(' ', '-').lower() + ')\n')
-          last_group = method['group']
-  doc.write('\n\n')
-    
-  doc.write('The following table lists the methods in each group and links ' +
-            'to more detail about each method:\n\n')
-  doc.write('<table id="api-method-summary">\n')
-
-  last_group = ''
-  for group in proto_contents['group-ordering']:
-    for method in sorted(methods, key=lambda k: (k['group'], k['name'])):
-      if (group.lower() == method['group'].lower() and
-          not method['group'] == last_group):
-        print_method_summary_group_row(doc, method['group'])
-        last_group = method['group']
-        print_method_summary_row(doc, method)
-      elif group.lower() == method['group'].lower():
-        print_method_summary_row(doc, method)
-  doc.write('</table>\n')
-
-def print_method_summary_group_row(doc, group_name):
-  doc.write('<tr><td class="api-method-summary-group" colspan="2">' +
-            group_name + '</td></tr>\n')
-
-def print_method_summary_row(doc, method):
-  doc.write('<tr>\n')
-  doc.write('<td><code><a href="#' + method['name'].lower() + '">' +
-            method['name'] + '</a></code></td>\n<td>')
-  if 'comment' in method and method['comment']:
-    doc.write(method['comment'])
-  doc.write('</td>\n')
-  doc.write('</tr>\n')
+      text = self.text(prop_type['label'])
+    if prop_type['map']:
+      text = ((prop_type['map'] + ', ').replace('<', '&lt;') + text +
+              '&gt;')
+    if prop_type['repeated']:
+      text = 'list &lt;' + text + '&gt;'
+    return text
+
+  def method_summary(self, groups):
+    self.write('<table id="api-method-summary">\n')
+    for group in groups:
+      self.write('<tr><td class="api-method-summary-group" colspan="2">' +
+                 self.text(group['name']) + '</td></tr>\n')
+      for method in group['methods']:
+        self.write('<tr>\n')
+        self.write('<td><code><a href="#' + method['name'].lower() + '">' +
+                   method['name'] + '</a></code></td>\n<td>')
+        if method['comment']:
+          self.write(self.text(method['comment']))
+        self.write('</td>\n')
+        self.write('</tr>\n')
+    self.write('</table>\n')
+
+class MarkdownDocument(Document):
+
+  extension = 'md'
+
+  def heading(self, level, text):
+    self.write('#' * level + ' ' + text + '\n\n')
+
+  def group_heading(self, text):
+    self.write('##' + text + '\n')
+
+  def paragraph(self, text):
+    self.write(text + '\n\n')
+
+  def label(self, text):
+    self.write('<em>' + text + '</em>\n\n')
+
+  def links(self, items):
+    for text, anchor in items:
+      self.write('* ' + self.link(text, anchor) + '\n')
+    self.write('\n\n')
+
+  def link(self, text, anchor):
+    return '[' + text + '](#' + anchor + ')'
+
+  def table(self, headers, title=None):
+    if title:
+      self.write('##### ' + title + '\n\n')
+    self.write('| ' + ''.join(field + ' |' for field in headers) + '\n')
+    self.write('| :-------- ' * len(headers) + '\n')
+
+  def end_table(self):
+    self.write('\n')
+
+  def property_row(self, name, prop_type, description):
+    if name is not None:
+      self.write('| <code>' + name + '</code> ')
+    if prop_type is not None:
+      self.write('<br>' + self.type_text(prop_type))
+    if description is None:
+      self.write('|')
+    else:
+      self.write('| ' + description)
+    self.write(' |\n')
+
+  def enum_row(self, text, value, comment):
+    for cell in ('<code>' + text + '</code>' if text is not None else None,
+                 '<code>' + value + '</code>' if value is not None else None,
+                 comment):
+      self.write('| ' + cell + ' ' if cell is not None else '| ')
+    self.write(' |\n')
+
+class HTMLDocument(Document):
+
+  extension = 'html'
+
+  def header(self):
+    return ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n' +
+            '<title>' + self.text(self.title) + '</title>\n</head>\n<body>\n' +
+            '<h1>' + self.text(self.title) + '</h1>\n')
+
+  def footer(self):
+    return '</body>\n</html>\n'
+
+  def text(self, text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+  def heading(self, level, text):
+    # The ids are the anchors Markdown processors give the headings.
+    self.write('<h%d id="%s">%s</h%d>\n' % (
+        level, self.text(text.lower().replace(' ', '-')), self.text(text),
+        level))
+
+  def group_heading(self, text):
+    self.heading(2, text)
+
+  def paragraph(self, text):
+    self.write('<p>' + self.text(text) + '</p>\n')
+
+  def label(self, text):
+    self.write('<p><em>' + self.text(text) + '</em></p>\n')
+
+  def links(self, items):
+    self.write('<ul>\n')
+    for text, anchor in items:
+      self.write('<li>' + self.link(text, anchor) + '</li>\n')
+    self.write('</ul>\n')
+
+  def link(self, text, anchor):
+    return '<a href="#' + self.text(anchor) + '">' + self.text(text) + '</a>'
+
+  def table(self, headers, title=None):
+    if title:
+      self.heading(5, title)
+    self.write('<table>\n<tr>' +
+               ''.join('<th>' + field + '</th>' for field in headers) +
+               '</tr>\n')
+
+  def end_table(self):
+    self.write('</table>\n')
+
+  def property_row(self, name, prop_type, description):
+    self.write('<tr><td>')
+    if name is not None:
+      self.write('<code>' + self.text(name) + '</code>')
+    if prop_type is not None:
+      self.write('<br>' + self.type_text(prop_type))
+    self.write('</td><td>' + self.text(description or '') + '</td></tr>\n')
+
+  def enum_row(self, text, value, comment):
+    self.write('<tr>')
+    for cell in (text, value):
+      self.write('<td>')
+      if cell is not None:
+        self.write('<code>' + self.text(cell) + '</code>')
+      self.write('</td>')
+    self.write('<td>' + self.text(comment or '') + '</td></tr>\n')
+
+class Documents(object):
+  """Renders the same document in several formats at once."""
+
+  def __init__(self, documents):
+    self.documents = documents
+
+  def __getattr__(self, name):
+    methods = [getattr(document, name) for document in self.documents]
+    def render(*args):
+      for method in methods:
+        method(*args)
+    setattr(self, name, render)
+    return render
+
+DOCUMENTS = dict((document.extension, document)
+                 for document in (MarkdownDocument, HTMLDocument))
+
+def print_method_summary(doc, service):
+  doc.paragraph(service['summary'] + ' API methods are grouped into the ' +
+                'following categories:')
+  doc.links([(group['name'], group['name'].replace(' ', '-').lower())
+             for group in service['groups']])
+  doc.paragraph('The following table lists the methods in each group and ' +
+                'links to more detail about each method:')
+  doc.method_summary(service['groups'])
 
 def recursively_add_objects(new_objects, method_file, obj,
                             properties, proto_contents):
-  if obj in new_objects:
-    return
-
-  [op_enum_file, op_enum] = get_op_item(proto_contents, obj, 'enums')
-  [op_file, op_method] = get_op_item(proto_contents, obj, 'messages')
-
-  if properties:
-    if method_file not in new_objects:
-      new_objects[method_file] = {'messages': {}}
-    elif 'messages' not in new_objects[method_file]:
-      new_objects[method_file]['messages'] = {}
-    new_objects[method_file]['messages'][obj] = 1
-    for prop in properties:
-      type_list = prop['type'].split('.')
-      if len(type_list) == 1:
-        if (method_file in proto_contents and
-            'messages' in proto_contents[method_file]):
-          lil_pc = proto_contents[method_file]['messages']
-          if type_list[0] in lil_pc and 'properties' in lil_pc[type_list[0]]:
-            new_objects = recursively_add_objects(new_objects, method_file,
-                prop['type'], lil_pc[type_list[0]]['properties'],
-                proto_contents)
-          elif (obj in lil_pc and
-                'messages' in lil_pc[obj] and
-                type_list[0] in lil_pc[obj]['messages'] and
-                'properties' in lil_pc[obj]['messages'][type_list[0]]):
-            new_objects = recursively_add_objects(new_objects, method_file,
-                prop['type'],
-                lil_pc[obj]['messages'][type_list[0]]['properties'],
-                proto_contents)
-      else:
-        [op_file, op_method] = get_op_item(proto_contents, obj, 'messages')
-        [op_enum_file, op_enum] = get_op_item(proto_contents, obj, 'enums')
-
-        if (op_file and 
-            op_file in proto_contents and
-            'messages' in proto_contents[op_file] and
-            type_list[1] in proto_contents[op_file]['messages'] and
-            'properties' in proto_contents[op_file]['messages'][type_list[1]]):
-          new_objects = recursively_add_objects(new_objects, op_file, type_list[1],
-              proto_contents[op_file]['messages'][type_list[1]]['properties'],
-              proto_contents)
-        elif (op_enum_file and 
-              op_enum_file in proto_contents and
-              'enums' in proto_contents[op_enum_file] and
-              type_list[1] in proto_contents[op_enum_file]['enums']):
-          if not op_enum_file in new_objects['enums']:
-            new_objects['enums'][op_enum_file] = {}
-          new_objects['enums'][op_enum_file][type_list[1]] = (
-              proto_contents[op_enum_file]['enums'][type_list[1]])
+  if not properties:
+    return new_objects
+  if method_file not in new_objects:
+    new_objects[method_file] = {'messages': {}}
+  elif 'messages' not in new_objects[method_file]:
+    new_objects[method_file]['messages'] = {}
+  if obj in new_objects[method_file]['messages']:
+    return new_objects
+  new_objects[method_file]['messages'][obj] = 1
+  # Types of other protos are in the type closure collect_objects
+  # walks; only follow the messages of this one.
+  package = method_file.replace('.proto', '')
+  for prop in properties:
+    if '.' in prop['type']:
+      continue
+    symbol = (find_symbol(proto_contents, 'messages', package, prop['type']) or
+              find_symbol(proto_contents, 'messages', package, obj,
+                          prop['type']))
+    if symbol:
+      new_objects = recursively_add_objects(new_objects, method_file,
+          prop['type'], symbol['definition']['properties'], proto_contents)
   return new_objects
 
-def print_method_details(doc, proto_contents, proto, methods, objects):
-
-  last_group = ''
-  for group in proto_contents['group-ordering']:
-    for method in sorted(methods, key=lambda k: (k['group'], k['name'])):
-      if (group.lower() == method['group'].lower() and
-          not method['group'] == last_group):
-        doc.write('##' + method['group'] + '\n')
-        last_group = method['group']
-        print_method_detail_header(doc, method)
-        print_method_detail_request(doc, proto_contents, proto, method)
-        print_method_detail_response(doc, proto_contents, proto, method)
-      elif group.lower() == method['group'].lower():
-        print_method_detail_header(doc, method)
-        print_method_detail_request(doc, proto_contents, proto, method)
-        print_method_detail_response(doc, proto_contents, proto, method)
-  new_objects = {}
-  for obj in sorted(objects):
-    type_list = obj.split('.')
-    if len(type_list) == 1:
-      method_file = objects[obj]['methods'][0]['method_file']
-      if (method_file in proto_contents and
-          'messages' in proto_contents[method_file] and
-          obj in proto_contents[method_file]['messages'] and
-          'properties' in proto_contents[method_file]['messages'][obj]):
-        new_objects = recursively_add_objects(new_objects, method_file, obj,
-            proto_contents[method_file]['messages'][obj]['properties'],
-            proto_contents)
-
-    else:
-      [op_file, op_method] = get_op_item(proto_contents, obj, 'messages')
-      [op_enum_file, op_enum] = get_op_item(proto_contents, obj, 'enums')
-      if (op_file and 
-          op_file in proto_contents and
-          'messages' in proto_contents[op_file] and
-          type_list[1] in proto_contents[op_file]['messages'] and
-          'properties' in proto_contents[op_file]['messages'][type_list[1]]):
-        new_objects = recursively_add_objects(new_objects, op_file, type_list[1],
-            proto_contents[op_file]['messages'][type_list[1]]['properties'],
-            proto_contents)
-      elif (op_enum_file and 
-            op_enum_file in proto_contents and
-            'enums' in proto_contents[op_enum_file] and
-            type_list[1] in proto_contents[op_enum_file]['enums']):
-        if not op_enum_file in new_objects:
-          new_objects[op_enum_file] = {'enums':{}}
-        elif not 'enums' in new_objects[op_enum_file]:
-          new_objects[op_enum_file]['enums'] = {}
-        new_objects[op_enum_file]['enums'][type_list[1]] = (
-            proto_contents[op_enum_file]['enums'][type_list[1]])
-
-  #print json.dumps(new_objects, sort_keys=True, indent=2)
-  print_nested_objects(doc, new_objects, proto_contents)
-
-def print_nested_objects(doc, objects, proto_contents):
-  doc.write('## Enums\n\n')
-  for obj in sorted(objects):
-    if obj == 'vtgate.proto':
-      print_proto_enums(doc, proto_contents, obj, objects,
-                        {'strip-proto-name': 1})
-  for obj in sorted(objects):
-    if not obj == 'vtgate.proto':
-      print_proto_enums(doc, proto_contents, obj, objects, {})
-  doc.write('## Messages\n\n')
-  for obj in sorted(objects):
-    if obj == 'vtgate.proto':
-      print_proto_messages(doc, proto_contents, obj, objects,
-                           {'strip-proto-name': 1})
-  for obj in sorted(objects):
-    if not obj == 'vtgate.proto':
-      print_proto_messages(doc, proto_contents, obj, objects, {})
+def print_method_details(doc, proto_contents, service):
+  for group in service['groups']:
+    doc.group_heading(group['name'])
+    for method in group['methods']:
+      print_method_detail_header(doc, method)
+      print_method_detail_message(doc, proto_contents, service, method,
+                                  'request')
+      print_method_detail_message(doc, proto_contents, service, method,
+                                  'response')
+  print_nested_objects(doc, service['objects'], proto_contents,
+                       service['home'])
+
+def print_nested_objects(doc, objects, proto_contents, home):
+  # The enums and messages of the proto of the service's messages go first,
+  # without the name of their proto.
+  protos = [home] if home in objects else []
+  protos += [proto for proto in sorted(objects) if proto != home]
+  doc.heading(2, 'Enums')
+  for obj in protos:
+    print_proto_enums(doc, proto_contents, obj, objects,
+                      {'strip-proto-name': obj == home})
+  doc.heading(2, 'Messages')
+  for obj in protos:
+    print_proto_messages(doc, proto_contents, obj, objects, home,
+                         {'strip-proto-name': obj == home})
 
 def print_message_detail_header(doc, proto, message_details, message_name,
                                 options):
-  header_size = '###'
+  header_size = 3
   if 'header-size' in options:
     header_size = options['header-size']
 
@@ -219,217 +307,205 @@ def print_message_detail_header(doc, proto, message_details, message_name,
     message = message_name
   elif options and 'add-method-name' in options and 'method-name' in options:
     message = options['method-name'] + '.' + message_name
-  doc.write(header_size + ' ' + message + '\n\n')
+  doc.heading(header_size, message)
 
   if 'comment' in message_details and message_details['comment']:
-    doc.write(message_details['comment'].strip() + '\n\n')
+    doc.paragraph(message_details['comment'].strip())
 
 def print_method_detail_header(doc, method):
-  doc.write('### ' + method['name'] + '\n\n')
+  doc.heading(3, method['name'])
   if 'comment' in method and method['comment']:
-    doc.write(method['comment'] + '\n\n')
-
-def print_properties_header(doc, header, table_headers):
-  if header:
-    doc.write('##### ' + header + '\n\n')
-  if table_headers:
-    doc.write('| ')
-    for field in table_headers:
-      doc.write(field + ' |')
-    doc.write('\n')
-    for field in table_headers:
-      doc.write('| :-------- ')
-    doc.write('\n')
-
-def print_property_row(doc, proto_contents, proto, method_file, method, prop):
-  # Print property/parameter name
-  if 'name' in prop:
-    doc.write('| <code>' + prop['name'] + '</code> ')
-
-  method_in_messages = False
-  enum_in_messages = False
-  for key in proto_contents[proto]['messages']:
-    if key == method:
-      method_in_messages = True
-  for key in proto_contents[proto]['enums']:
-    if key == prop['type']:
-      enum_in_messages = True
-
-  # Print property/parameter type
-  if 'type' in prop and prop['type']:
-    doc.write('<br>')
-    prop_text = ''
-    if prop['type'][0:5] == 'map <':
-      map_value = prop['type'].split(',')[1].split('>')[0].strip()
-      if (map_value and
-          map_value in proto_contents[proto]['messages']):
-        prop_text = (prop['type'].split(',')[0] + ', [' + map_value + ']' +
-                     '(#' + proto.lower().replace('.proto', '') + '.' +
-                     map_value.lower() + ')' + '>')
-        prop_text = prop_text.replace('<', '&lt;').replace('>', '&gt;')
-    else:
-      type_list = prop['type'].split('.')
-      if len(type_list) == 2:
-        prop_text = ('[' + prop['type'] + '](#' + type_list[0] + '.' +
-                     type_list[1].lower() + ')')
-      elif (method_file and
-            prop['type'] in proto_contents[method_file]['messages']):
-        if method_file == 'vtgate.proto':
-          prop_text = '[' + prop['type'] + '](#' + prop['type'].lower() + ')'
-        else:
-          prop_text = ('[' + prop['type'] +
-                       '](#' + proto.lower().replace('.proto', '') + '.' +
-                       prop['type'].lower() + ')')
-      elif enum_in_messages:
-        prop_text = ('[' + prop['type'] + ']' +
-                     '(#' + proto.lower().replace('.proto', '') + '.' +
-                     prop['type'].lower() + ')')
-      elif (method_file and
-            prop['type'] in proto_contents[method_file]['enums']):
-        prop_text = '[' + prop['type'] + '](#' + prop['type'].lower() + ')'
-      elif (method_in_messages and
-            'messages' in proto_contents[proto]['messages'][method]):
-        if prop['type'] in proto_contents[proto]['messages'][method]['messages']:
-          prop_text = '[' + prop['type'] + '](#' + method.lower() + '.' + prop['type'].lower() + ')'
-        elif prop['type'] in proto_contents[proto]['messages'][method]['enums']:
-          prop_text = '[' + prop['type'] + '](#' + method.lower() + '.' + prop['type'].lower() + ')'
-        else:
-          prop_text = prop['type']
+    doc.paragraph(method['comment'])
 
-      else:
-        prop_text = prop['type']
-        bad_text = True
-        for p in proto_contents:
-          if 'messages' in proto_contents[p] and proto_contents[p]['messages']:
-            for m in proto_contents[p]['messages']:
-              if ('messages' in proto_contents[p]['messages'][m] and
-                  proto_contents[p]['messages'][m]['messages'] and
-                  prop['type'] in proto_contents[p]['messages'][m]['messages']):
-                prop_text = ('[' + prop['type'] + ']' +
-                             '(#' + m.lower() + '.' + prop['type'].lower() + ')')
-                bad_text = False
-        if bad_text and isinstance(method, basestring):
-          for p in proto_contents:
-            if ('messages' in proto_contents[p] and
-                proto_contents[p]['messages']):
-              for m in proto_contents[p]['messages']:
-                if ('messages' in proto_contents[p]['messages'][m] and
-                    proto_contents[p]['messages'][m]['messages'] and
-                    method in proto_contents[p]['messages'][m]['messages'] and
-                    'enums' in proto_contents[p]['messages'][m]['messages'][method] and
-                    prop['type'] in proto_contents[p]['messages'][m]['messages'][method]['enums']):
-                  prop_text = ('[' + prop['type'] + ']' +
-                               '(#' + m.lower() + '.' + method.lower() + '.' +
-                               prop['type'].lower() + ')')
-
-    if 'status' in prop and prop['status'] == 'repeated':
-      prop_text = 'list &lt;' + prop_text + '&gt;'
-    doc.write(prop_text)
-
-  # Print property/parameter definition.
+def print_property_row(doc, proto_contents, proto, method_file, method, prop,
+                       home):
+  prop_type = None
+  if 'type' in prop and prop['type']:
+    prop_type = property_type(proto_contents, proto, method_file, method, prop,
+                              home)
+  doc.property_row(prop.get('name'), prop_type,
+                   property_description(proto_contents, method_file, prop))
+
+def property_type(proto_contents, proto, method_file, method, prop, home):
+  """
+  Return how to show the type of prop: the text of the type, the anchor of
+  its definition if it links to one, the type of the keys before it if
+  it's the value of a map, and whether it's repeated.
+  """
+  package = proto.replace('.proto', '')
+  method_package = method_file and method_file.replace('.proto', '')
+  method_in_messages = (isinstance(method, basestring) and
+                        find_symbol(proto_contents, 'messages', package, method))
+
+  def heading_anchor(heading_proto, name):
+    # The headings of the proto of the service's messages are stripped.
+    if heading_proto == home:
+      return name.lower()
+    return heading_proto.replace('.proto', '').lower() + '.' + name.lower()
+
+  label = prop['type']
+  anchor = None
+  map_keys = None
+  if prop['type'][0:5] == 'map <':
+    map_value = prop['type'].split(',')[1].split('>')[0].strip()
+    label = ''
+    if (map_value and
+        find_symbol(proto_contents, 'messages', package, map_value)):
+      label = map_value
+      anchor = heading_anchor(proto, map_value)
+      map_keys = prop['type'].split(',')[0]
+  else:
+    type_list = prop['type'].split('.')
+    if len(type_list) == 2:
+      anchor = heading_anchor(type_list[0] + '.proto', type_list[1])
+    elif (method_file and
+          find_symbol(proto_contents, 'messages', method_package,
+                      prop['type'])):
+      anchor = heading_anchor(method_file, prop['type'])
+    elif find_symbol(proto_contents, 'enums', package, prop['type']):
+      anchor = heading_anchor(proto, prop['type'])
+    elif (method_file and
+          find_symbol(proto_contents, 'enums', method_package,
+                      prop['type'])):
+      anchor = heading_anchor(method_file, prop['type'])
+    elif method_in_messages:
+      if (find_symbol(proto_contents, 'messages', package, method,
+                      prop['type']) or
+          find_symbol(proto_contents, 'enums', package, method,
+                      prop['type'])):
+        anchor = method.lower() + '.' + prop['type'].lower()
 
+    else:
+      # A message nested in a message of any proto, or an enum nested in
+      # a nested message named like the method.
+      for symbol in nested_symbols(proto_contents, prop['type']):
+        if symbol['kind'] == 'messages' and symbol['depth'] == 2:
+          anchor = symbol['parent']['name'].lower() + '.' + prop['type'].lower()
+          break
+      if not anchor and isinstance(method, basestring):
+        for symbol in nested_symbols(proto_contents, prop['type']):
+          if (symbol['kind'] == 'enums' and symbol['depth'] == 3 and
+              symbol['parent']['name'] == method):
+            anchor = (symbol['parent']['parent']['name'].lower() + '.' +
+                      method.lower() + '.' + prop['type'].lower())
+            break
+
+  return {'label': label,
+          'anchor': anchor,
+          'map': map_keys,
+          'repeated': 'status' in prop and prop['status'] == 'repeated'}
+
+def property_description(proto_contents, method_file, prop):
+  """Return the description of prop, or None."""
   if 'type' in prop and prop['type']:
     # If type contains period -- e.g. vtrpc.CallerId -- then it refers to
     # a message in another proto. We want to print the comment identifying
     # that message.  In that case, the link field should also link to a doc
     # for that proto.
-    type_list = prop['type'].split('.')
     [op_file, op_method] = get_op_item(proto_contents, prop['type'],
                                          'messages')
     [op_enum_file, op_enum] = get_op_item(proto_contents, prop['type'], 'enums')
+    message = method_file and find_symbol(proto_contents, 'messages',
+                                          method_file.replace('.proto', ''),
+                                          prop['type'])
     if op_method:
-      doc.write('| ' + op_method['comment'].strip())
+      return op_method['comment'].strip()
     elif op_enum:
-      doc.write('| ' + op_enum['comment'].strip())
-    elif (method_file and
-          prop['type'] in proto_contents[method_file]['messages']):
-      if ('comment' in proto_contents[method_file]['messages'][prop['type']] and
-          proto_contents[method_file]['messages'][prop['type']]['comment']):
-        doc.write('| ' +
-            proto_contents[method_file]['messages'][prop['type']]['comment'].strip())
-      else:
-        doc.write('|')
-    elif 'comment' in prop and prop['comment']:
-      doc.write('| ' + prop['comment'].strip())
-    else:
-      doc.write('|')
-  elif 'comment' in prop and prop['comment']:
-    doc.write('| ' + prop['comment'].strip())
-  else:
-    doc.write('|')
-  doc.write(' |\n')
+      return op_enum['comment'].strip()
+    elif message:
+      if message['definition']['comment']:
+        return message['definition']['comment'].strip()
+      return None
+  if 'comment' in prop and prop['comment']:
+    return prop['comment'].strip()
+  return None
 
 def get_op_item(proto_contents, item, item_type):
   item_list = item.split('.')
   if len(item_list) == 2:
-    item_file = item_list[0] + '.proto'
-    item_enum = item_list[1]
-    if item_file in proto_contents:
-      if item_type in proto_contents[item_file]:
-        if item_enum in proto_contents[item_file][item_type]:
-          return item_file, proto_contents[item_file][item_type][item_enum]
-        else:
-          return [None, None]
-      else:
-        return [None, None]
-    else:
-      return [None, None]
-  else:
-    return [None, None]
-
-def print_method_detail_request(doc, proto_contents, proto, method):
-  if method['request']:
-    [op_file, op_method] = get_op_item(proto_contents, method['request'],
-                                       'messages')
-    if (op_method and
-        'comment' in op_method and
-        op_method['comment']):
-      doc.write('#### Request\n\n')
-      doc.write(op_method['comment'] + '\n\n')
-      print_properties_header(doc, 'Parameters', ['Name', 'Description'])
-      for prop in op_method['properties']:
-        print_property_row(doc, proto_contents, proto, op_file, op_method, prop)
-      doc.write('\n')
-
-      if 'messages' in op_method and op_method['messages']:
-        doc.write('#### Messages\n\n')
-        for message in sorted(op_method['messages']):
-          print_proto_message(doc, proto, proto_contents,
-                              op_method['messages'][message], message,
-                              {'header-size': '#####',
-                               'add-method-name': 1,
-                               'method-name': method['request'].split('.')[1]})
-
-def print_method_detail_response(doc, proto_contents, proto, method):
-  if method['response']:
-    [op_file, op_method] = get_op_item(proto_contents,
-        method['response'].replace('stream ', ''), 'messages')
-    if (op_method and
-        'comment' in op_method and
-        op_method['comment']):
-      doc.write('#### Response\n\n')
-      doc.write(op_method['comment'] + '\n\n')
-      print_properties_header(doc, 'Properties', ['Name', 'Description'])
-      for prop in op_method['properties']:
-        print_property_row(doc, proto_contents, proto, op_file, op_method, prop)
-      doc.write('\n')
-
-      if 'messages' in op_method and op_method['messages']:
-        doc.write('#### Messages\n\n')
-        for message in sorted(op_method['messages']):
-          print_proto_message(doc, proto, proto_contents,
-                              op_method['messages'][message], message,
-                              {'header-size': '#####',
-                               'add-method-name': 1,
-                               'method-name': method['response'].split('.')[1]})
-
-def print_proto_file_definition(doc, proto_contents, proto):
-  if ('file_definition' in proto_contents[proto] and
-      proto_contents[proto]['file_definition']):
-    doc.write(proto_contents[proto]['file_definition'].strip() + '\n\n')
+    symbol = find_symbol(proto_contents, item_type, *item_list)
+    if symbol:
+      return symbol['file'], symbol['definition']
+  return [None, None]
+
+def find_symbol(proto_contents, kind, package, *names):
+  """
+  Return the index entry of the message or enum (kind 'messages' or
+  'enums') names, nested in one another, of the proto of package, or None.
+  """
+  symbol = proto_contents['symbol-index']['symbols'].get(
+      '.'.join((package,) + names))
+  if symbol and symbol['kind'] == kind and symbol['depth'] == len(names):
+    return symbol
+  return None
+
+def nested_symbols(proto_contents, name, proto=None):
+  """Yield the nested messages and enums named name, of proto or of any."""
+  nested = proto_contents['symbol-index']['nested'].get(name, {})
+  for symbol_proto in ([proto] if proto else sorted(nested)):
+    for symbol in nested.get(symbol_proto, []):
+      yield symbol
+
+def build_symbol_index(proto_contents):
+  """
+  Index the messages and enums of the protos, nested ones included, by
+  fully qualified name (e.g. vtgate.Session.ShardSession), and the nested
+  ones by name and proto too.
+  """
+  index = {'symbols': {}, 'nested': {}}
+
+  def add(proto, definitions, kind, parent, prefix, depth):
+    for name in sorted(definitions):
+      symbol = {'file': proto,
+                'kind': kind,
+                'name': name,
+                'parent': parent,
+                'depth': depth,
+                'definition': definitions[name]}
+      index['symbols'][prefix + '.' + name] = symbol
+      if parent:
+        index['nested'].setdefault(name, {}).setdefault(proto, []).append(
+            symbol)
+      if kind == 'messages':
+        add(proto, definitions[name]['enums'], 'enums', symbol,
+            prefix + '.' + name, depth + 1)
+        add(proto, definitions[name]['messages'], 'messages', symbol,
+            prefix + '.' + name, depth + 1)
+
+  for proto in sorted(proto_contents):
+    package = proto.replace('.proto', '')
+    add(proto, proto_contents[proto]['enums'], 'enums', None, package, 1)
+    add(proto, proto_contents[proto]['messages'], 'messages', None, package, 1)
+  return index
+
+def print_method_detail_message(doc, proto_contents, service, method, kind):
+  """Print the request or the response (kind) of method."""
+  message_type = method[kind].replace('stream ', '')
+  [op_file, op_method] = get_op_item(proto_contents, message_type, 'messages')
+  if (op_method and
+      'comment' in op_method and
+      op_method['comment']):
+    doc.heading(4, kind.capitalize())
+    doc.paragraph(op_method['comment'])
+    doc.table(['Name', 'Description'],
+              'Parameters' if kind == 'request' else 'Properties')
+    for prop in op_method['properties']:
+      print_property_row(doc, proto_contents, service['proto'], op_file,
+                         op_method, prop, service['home'])
+    doc.end_table()
+
+    if 'messages' in op_method and op_method['messages']:
+      doc.heading(4, 'Messages')
+      for message in sorted(op_method['messages']):
+        print_proto_message(doc, service['proto'], proto_contents,
+                            op_method['messages'][message], message,
+                            service['home'],
+                            {'header-size': 5,
+                             'add-method-name': 1,
+                             'method-name': message_type.split('.')[1]})
 
 def print_proto_enum(doc, enum_details, enum_name, proto, options):
-  header_size = '###'
+  header_size = 3
   if 'header-size' in options:
     header_size = options['header-size']
   # Print name of enum as header
@@ -441,77 +517,62 @@ def print_proto_enum(doc, enum_details, enum_name, proto, options):
         options['strip-proto-name']):
     enum_header = enum_name
 
-  doc.write(header_size + ' ' + enum_header + '\n\n')
+  doc.heading(header_size, enum_header)
 
   if 'comment' in enum_details and enum_details['comment']:
-    doc.write(enum_details['comment'] + '\n\n')
+    doc.paragraph(enum_details['comment'])
 
-  print_properties_header(doc, None, ['Name', 'Value', 'Description'])
+  doc.table(['Name', 'Value', 'Description'])
   for value in enum_details['values']:
-    # Print enum text
-    if 'text' in value:
-      doc.write('| <code>' + value['text'] + '</code> ')
-    else:
-      doc.write('| ')
-
-    # Print enum value
-    if 'value' in value and value['value']:
-      doc.write('| <code>' + value['value'] + '</code> ')
-    else:
-      doc.write('| ')
-
-    # Print enum value description
-    if 'comment' in value and value['comment']:
-      doc.write('| ' + value['comment'].strip() + ' ')
-    else:
-      doc.write('| ')
-
-    doc.write(' |\n')
-  doc.write('\n')
+    doc.enum_row(value.get('text'),
+                 value.get('value') or None,
+                 value['comment'].strip() if value.get('comment') else None)
+  doc.end_table()
 
 def print_proto_message(doc, proto, proto_contents, message_details, message,
-                        options):
+                        home, options):
 
   print_message_detail_header(doc, proto, message_details, message, options)
 
   if 'header-size' in options:
-    doc.write('<em>Properties</em>\n\n')
+    doc.label('Properties')
   else:
-    doc.write('#### Properties\n\n')
-  print_properties_header(doc, None, ['Name', 'Description'])
+    doc.heading(4, 'Properties')
+  doc.table(['Name', 'Description'])
   for prop in message_details['properties']:
-    print_property_row(doc, proto_contents, proto, proto, message, prop)
-  doc.write('\n')
+    print_property_row(doc, proto_contents, proto, proto, message, prop, home)
+  doc.end_table()
 
   option_method_name = message
   if 'method-name' in options:
     option_method_name = options['method-name'] + '.' + message
   
   if 'enums' in message_details and message_details['enums']:
-    doc.write('#### Enums\n\n')
+    doc.heading(4, 'Enums')
     for enum in sorted(message_details['enums']):
       print_proto_enum(doc, message_details['enums'][enum], enum, proto,
-          {'header-size': '#####',
+          {'header-size': 5,
            'add-method-name': 1,
            'method-name': option_method_name})
 
   if 'messages' in message_details and message_details['messages']:
-    doc.write('#### Messages\n\n')
+    doc.heading(4, 'Messages')
     for child_message in sorted(message_details['messages']):
       print_proto_message(doc, proto, proto_contents,
-          message_details['messages'][child_message], child_message,
-          {'header-size': '#####',
+          message_details['messages'][child_message], child_message, home,
+          {'header-size': 5,
            'add-method-name': 1,
            'method-name': option_method_name})
 
-def print_proto_messages(doc, proto_contents, proto, objects_to_print, options):
+def print_proto_messages(doc, proto_contents, proto, objects_to_print, home,
+                         options):
   if 'messages' in proto_contents[proto] and proto_contents[proto]['messages']:
     for message in sorted(proto_contents[proto]['messages']):
       if ('messages' in objects_to_print[proto] and
           message in objects_to_print[proto]['messages']):
         print_proto_message(doc, proto, proto_contents,
                             proto_contents[proto]['messages'][message],
-                            message, options)
+                            message, home, options)
 
 def print_proto_enums(doc, proto_contents, proto, objects_to_print, options):
   if 'enums' in proto_contents[proto] and proto_contents[proto]['enums']:
@@ -521,34 +582,33 @@ def print_proto_enums(doc, proto_contents, proto, objects_to_print, options):
         print_proto_enum(doc, proto_contents[proto]['enums'][enum], enum,
                          proto, options)
 
-def create_reference_doc(proto_directory, doc_directory, proto_contents,
-                         addl_types):
-  for proto in proto_contents:
-    if 'service' in proto_contents[proto]:
-      if (proto_contents[proto]['service']['name'] and
-          proto_contents[proto]['service']['name'] == 'Vitess'):
-        doc = open(doc_directory + 'VitessApi.md', 'w')
-
-        #if proto_contents[proto]['file_definition']:
-        #  print_api_summary(doc, proto_contents[proto]['file_definition'])
-
-        if proto_contents[proto]['service']['methods']:
-          print_method_summary(doc, proto_contents,
-                               proto_contents[proto]['service']['methods'])
-
-        if proto_contents[proto]['service']['methods']:
-          print_method_details(doc, proto_contents, proto,
-                               proto_contents[proto]['service']['methods'],
-                               addl_types)
-        doc.close()
+def create_reference_doc(doc_directory, proto_contents, services, formats):
+  """
+  Render the documents of services in formats ('md', 'html', 'json'): each
+  service is walked once, into its documents of every format.
+  """
+  for service in services:
+    path = doc_directory + service['name'] + 'Api.'
+    documents = [DOCUMENTS[doc_format](service['name'] + ' API')
+                 for doc_format in formats if doc_format in DOCUMENTS]
+    if documents:
+      doc = documents[0] if len(documents) == 1 else Documents(documents)
+      print_method_summary(doc, service)
+      print_method_details(doc, proto_contents, service)
+      for document in documents:
+        document.save(path + document.extension)
+    if 'json' in formats:
+      with open(path + 'json', 'w') as doc:
+        doc.write(json.dumps(api_schema(proto_contents, service), indent=2,
+                             sort_keys=True, separators=(',', ': ')) + '\n')
   return
 
 def parse_method_details(line):
   details = re.findall(r'rpc ([^\(]+)\(([^\)]+)\) returns \(([^\)]+)', line)
   if details:
-    return {'name': details[0][0],
-            'request': details[0][1],
-            'response': details[0][2]}
+    return {'name': details[0][0].strip(),
+            'request': details[0][1].strip(),
+            'response': details[0][2].strip()}
   return {}
 
 def get_enum_struct(comment):
@@ -585,186 +645,376 @@ def build_property_type_list(types, proto_contents, method):
       elif '.' in prop['type']:
         types.append(prop['type'])
       elif prop['type'][0].isupper():
-        if prop['type'] in proto_contents[op_file]['messages']:
-          types.append(op_file.replace('.proto', '') + '.' + prop['type'])
-        elif prop['type'] in proto_contents[op_file]['enums']:
-          types.append(op_file.replace('.proto', '') + '.' + prop['type'])
+        package = op_file.replace('.proto', '')
+        if (find_symbol(proto_contents, 'messages', package, prop['type']) or
+            find_symbol(proto_contents, 'enums', package, prop['type'])):
+          types.append(package + '.' + prop['type'])
         else:
-          for message in proto_contents[op_file]['messages']:
-            if 'messages' in proto_contents[op_file]['messages'][message]:
-              child_messages = (
-                  proto_contents[op_file]['messages'][message]['messages'])
-              if (prop['type'] in child_messages and
-                  'properties' in child_messages[prop['type']]):
-                for child_prop in child_messages[prop['type']]['properties']:
-                  if '.' in child_prop['type']:
-                    types.append(child_prop['type'])
+          for symbol in nested_symbols(proto_contents, prop['type'], op_file):
+            if symbol['kind'] == 'messages' and symbol['depth'] == 2:
+              for child_prop in symbol['definition']['properties']:
+                if '.' in child_prop['type']:
+                  types.append(child_prop['type'])
   return types
 
-def main(proto_directory, doc_directory):
-  arg_definitions = {}
-  commands = {}
-  command_groups = {}
-  error_counts = {}
-  functions = {}
-
-  # Read the .go files in the /vitess/go/vt/vtctl/ directory
-  api_file_path = proto_directory
-  proto_dirs = next(os.walk(api_file_path))[2]
-  proto_lines = {}
-  proto_contents = {}
-  for path in proto_dirs:
-    if not path.endswith('.proto'):
+def parse_proto(lines):
+  """Parse the lines of a .proto file into its contents."""
+  comment = ''
+  enum_values = []
+  inside_service = ''
+  current_message = {}
+  current_top_level_message = {}
+  current_hierarchy = []
+  current_struct = ''
+  syntax_specified = False
+  contents = {'file_definition': '',
+              'imports': [],
+              'enums': {},
+              'messages': {},
+              'methods': {},
+              'service': {'name': '',
+                          'comment': '',
+                          'methods': []}
+             }
+  for original_line in lines:
+    line = original_line.strip()
+    if line[0:8] == 'syntax =':
+      syntax_specified = True
       continue
-    api_proto_file = open(proto_directory + path, 'rU')
-    proto_lines[path.replace('pb.go', 'proto')] = api_proto_file.readlines()
-    api_proto_file.close()
+    if line[0:2] == '//' and not syntax_specified:
+      contents['file_definition'] += (' ' + line[2:].strip())
+      continue
+    elif line[0:2] == '//':
+      if 'TODO' not in line:
+        comment += ' ' + line[2:].strip()
+    elif line[0:6] == 'import':
+      import_file = line[6:].strip().rstrip(';').strip('"').split('/').pop()
+      contents['imports'].append(import_file)
+    elif line[0:8] == 'service ':
+      service = line[8:].strip().rstrip('{').strip()
+      contents['service']['name'] = service
+      contents['service']['comment'] = comment.strip()
+      inside_service = service
+      comment = ''
+    elif inside_service:
+      if line[0:4] == 'rpc ':
+        method_details = parse_method_details(line)
+        if method_details:
+          if comment:
+            method_details['comment'] = comment.strip()
+          contents['service']['methods'].append(method_details)
+          comment = ''
 
-  # parse .proto files
-  for path in proto_lines:
-    comment = ''
-    enum_values = []
-    inside_service = ''
-    current_message = {}
-    current_top_level_message = {}
-    current_hierarchy = []
-    current_struct = ''
-    syntax_specified = False
-    proto_contents[path] = {'file_definition': '',
-                            'imports': [],
-                            'enums': {},
-                            'messages': {},
-                            'methods': {},
-                            'service': {'name': '',
-                                        'methods': []}
-                           }
-    for original_line in proto_lines[path]:
-      line = original_line.strip()
-      if line[0:8] == 'syntax =':
-        syntax_specified = True
-        continue
-      if line[0:2] == '//' and not syntax_specified:
-        proto_contents[path]['file_definition'] += (' ' + line[2:].strip())
-        continue
-      elif line[0:2] == '//':
-        if 'TODO' not in line:
-          comment += ' ' + line[2:].strip()
-      elif line[0:6] == 'import':
-        import_file = line[6:].strip().rstrip(';').strip('"').split('/').pop()
-        proto_contents[path]['imports'].append(import_file)
-      elif line[0:8] == 'service ':
-        service = line[8:].strip().rstrip('{').strip()
-        proto_contents[path]['service']['name'] = service
-        inside_service = service
-        comment = ''
-      elif inside_service:
-        if line[0:4] == 'rpc ':
-          method_details = parse_method_details(line)
-          if method_details:
-            if comment:
-              method_details['comment'] = comment.strip()
-            proto_contents[path]['service']['methods'].append(method_details)
-            comment = ''
-
-      elif line == '}':
-        item_to_add = current_hierarchy.pop().split('-')
-        if item_to_add[0] == 'enum':
-          current_enum['values'] = enum_values
-          enum_values = []
-          if len(current_hierarchy) > 0:
-            go_back_to_struct = current_hierarchy[-1].split('-')[0]
-            if go_back_to_struct == 'topLevelMessage':
-              current_top_level_message['enums'][item_to_add[1]] = current_enum
-            elif go_back_to_struct == 'message':
-              current_message['enums'][item_to_add[1]] = current_enum
-            current_struct = go_back_to_struct
-          else:
-            if current_struct == 'enum':
-              proto_contents[path]['enums'][item_to_add[1]] = current_enum
-              current_struct = ''
-        elif item_to_add[0] == 'message':
-          current_top_level_message['messages'][item_to_add[1]] = (
-              current_message)
-          current_struct = current_hierarchy[-1].split('-')[0]
-        elif item_to_add[0] == 'topLevelMessage':
-          proto_contents[path]['messages'][item_to_add[1]] = (
-              current_top_level_message)
-          current_struct = ''
-      elif original_line[0:8] == 'message ':
-        message = line[8:].strip().rstrip('{').strip()
-        current_top_level_message = get_message_struct(comment)
+    elif line == '}':
+      item_to_add = current_hierarchy.pop().split('-')
+      if item_to_add[0] == 'enum':
+        current_enum['values'] = enum_values
+        enum_values = []
+        if len(current_hierarchy) > 0:
+          go_back_to_struct = current_hierarchy[-1].split('-')[0]
+          if go_back_to_struct == 'topLevelMessage':
+            current_top_level_message['enums'][item_to_add[1]] = current_enum
+          elif go_back_to_struct == 'message':
+            current_message['enums'][item_to_add[1]] = current_enum
+          current_struct = go_back_to_struct
+        else:
+          if current_struct == 'enum':
+            contents['enums'][item_to_add[1]] = current_enum
+            current_struct = ''
+      elif item_to_add[0] == 'message':
+        current_top_level_message['messages'][item_to_add[1]] = (
+            current_message)
+        current_struct = current_hierarchy[-1].split('-')[0]
+      elif item_to_add[0] == 'topLevelMessage':
+        contents['messages'][item_to_add[1]] = (
+            current_top_level_message)
+        current_struct = ''
+    elif original_line[0:8] == 'message ':
+      message = line[8:].strip().rstrip('{').strip()
+      current_top_level_message = get_message_struct(comment)
+      comment = ''
+      current_hierarchy.append('topLevelMessage-' + message)
+      current_struct = 'topLevelMessage'
+    elif line[0:8] == 'message ':
+      message = line[8:].strip().rstrip('{').strip()
+      current_message = get_message_struct(comment)
+      current_hierarchy.append('message-' + message)
+      current_struct = 'message'
+    elif line[0:5] == 'enum ':
+      enum = line[5:].strip().rstrip('{').strip()
+      current_enum = get_enum_struct(comment)
+      current_hierarchy.append('enum-' + enum)
+      current_struct = 'enum'
+      comment = ''
+    elif current_struct == 'enum':
+      enum_value_data = re.findall(r'([a-zA-Z0-9_]+)\s*=\s*(\d+)', line)
+      if enum_value_data:
+        enum_values.append({'comment': comment,
+                            'text': enum_value_data[0][0],
+                            'value': enum_value_data[0][1]})
         comment = ''
-        current_hierarchy.append('topLevelMessage-' + message)
-        current_struct = 'topLevelMessage'
-      elif line[0:8] == 'message ':
-        message = line[8:].strip().rstrip('{').strip()
-        current_message = get_message_struct(comment)
-        current_hierarchy.append('message-' + message)
-        current_struct = 'message'
-      elif line[0:5] == 'enum ':
-        enum = line[5:].strip().rstrip('{').strip()
-        current_enum = get_enum_struct(comment)
-        current_hierarchy.append('enum-' + enum)
-        current_struct = 'enum'
+      
+    else:
+      prop_data = re.findall(r'(optional|repeated|required)?\s*([\w\.\_]+)\s+([\w\.\_]+)\s*=\s*(\d+)', line)
+      if prop_data:
+        if current_struct == 'topLevelMessage':
+          current_top_level_message = add_property(current_top_level_message,
+                                                   prop_data, prop_data[0][1],
+                                                   comment)
+        elif current_struct == 'message':
+          current_message = add_property(current_message, prop_data,
+                                         prop_data[0][1], comment)
         comment = ''
-      elif current_struct == 'enum':
-        enum_value_data = re.findall(r'([a-zA-Z0-9_]+)\s*=\s*(\d+)', line)
-        if enum_value_data:
-          enum_values.append({'comment': comment,
-                              'text': enum_value_data[0][0],
-                              'value': enum_value_data[0][1]})
-          comment = ''
-        
       else:
-        prop_data = re.findall(r'(optional|repeated|required)?\s*([\w\.\_]+)\s+([\w\.\_]+)\s*=\s*(\d+)', line)
+        prop_data = re.findall(r'(optional|repeated|required)?\s*map\s*\<([^\>]+)\>\s+([\w\.\_]+)\s*=\s*(\d+)', line)
         if prop_data:
+          prop_type = 'map <' + prop_data[0][1] + '>' 
           if current_struct == 'topLevelMessage':
-            current_top_level_message = add_property(current_top_level_message,
-                                                     prop_data, prop_data[0][1],
-                                                     comment)
+            current_top_level_message = add_property(
+                current_top_level_message, prop_data, prop_type, comment)
           elif current_struct == 'message':
             current_message = add_property(current_message, prop_data,
-                                           prop_data[0][1], comment)
+                prop_type, comment)
           comment = ''
+  return contents
+
+def load_cache(cache_file):
+  """Return the parsed protos of the cache file, by content hash."""
+  try:
+    with open(cache_file) as f:
+      cache = json.load(f)
+  except (IOError, ValueError):
+    return {}
+  if cache.get('version') != CACHE_VERSION:
+    return {}
+  return cache['protos']
+
+def save_cache(cache_file, protos):
+  with open(cache_file + '.tmp', 'w') as f:
+    f.write(json.dumps({'version': CACHE_VERSION, 'protos': protos}))
+  os.rename(cache_file + '.tmp', cache_file)
+
+def parse_protos(proto_directory, cache_file=None):
+  """
+  Parse the .proto files of proto_directory. With a cache file, only the
+  files whose contents changed since the last run are parsed again.
+  """
+  cache = load_cache(cache_file) if cache_file else {}
+  protos = {}
+  proto_contents = {}
+  for path in sorted(next(os.walk(proto_directory))[2]):
+    if not path.endswith('.proto'):
+      continue
+    api_proto_file = open(proto_directory + path, 'rU')
+    data = api_proto_file.read()
+    api_proto_file.close()
+    digest = hashlib.sha1(data).hexdigest()
+    cached = cache.get(path)
+    if cached and cached['hash'] == digest:
+      contents = cached['contents']
+    else:
+      contents = parse_proto(data.splitlines(True))
+    protos[path] = {'hash': digest, 'contents': contents}
+    proto_contents[path] = contents
+  if cache_file and protos != cache:
+    save_cache(cache_file, protos)
+  return proto_contents
+
+def type_closure(proto_contents, methods):
+  """
+  Return the types the requests and responses of methods refer to,
+  directly or through the properties of other types.
+  """
+  types = set()
+  for method in methods:
+    types.update(build_property_type_list([], proto_contents, method))
+  pending = list(types)
+  while pending:
+    for prop_type in build_property_type_list([], proto_contents,
+                                              pending.pop()):
+      if prop_type not in types:
+        types.add(prop_type)
+        pending.append(prop_type)
+  return list(types)
+
+def collect_objects(proto_contents, types):
+  """
+  Return the enums and messages of types to print, by proto: the messages
+  with properties, and the messages of their proto they refer to.
+  """
+  new_objects = {}
+  for obj in sorted(types):
+    [op_file, op_method] = get_op_item(proto_contents, obj, 'messages')
+    [op_enum_file, op_enum] = get_op_item(proto_contents, obj, 'enums')
+    if op_method:
+      new_objects = recursively_add_objects(new_objects, op_file,
+          obj.split('.')[1], op_method['properties'], proto_contents)
+    elif op_enum:
+      if not op_enum_file in new_objects:
+        new_objects[op_enum_file] = {'enums':{}}
+      elif not 'enums' in new_objects[op_enum_file]:
+        new_objects[op_enum_file]['enums'] = {}
+      new_objects[op_enum_file]['enums'][obj.split('.')[1]] = op_enum
+  return new_objects
+
+def build_service(proto_contents, proto):
+  """
+  Return the service of proto, as the documents are rendered from it: its
+  methods sorted in their groups (see GROUP_ORDERING, then the other
+  groups), the proto holding most of their messages, and the enums and
+  messages they refer to.
+  """
+  service = proto_contents[proto]['service']
+  groups = {}
+  message_types = []
+  for method in sorted(service['methods'], key=lambda k: k['name']):
+    comment = method.get('comment', '')
+    method_group_info = comment.split(' API group: ')
+    group = 'Uncategorized'
+    if len(method_group_info) > 1:
+      comment, group = method_group_info
+    groups.setdefault(group.lower(), []).append(
+        dict(method, comment=comment, group=group))
+    for kind in ('request', 'response'):
+      message_types.append(method[kind].replace('stream ', ''))
+
+  ordering = [group.lower() for group in GROUP_ORDERING]
+  def group_order(group):
+    if group in ordering:
+      return (0, ordering.index(group))
+    return (2 if group == 'uncategorized' else 1, group)
+
+  packages = [message_type.split('.')[0] for message_type in message_types
+              if '.' in message_type]
+  home = proto
+  if packages:
+    home = max(sorted(set(packages)), key=packages.count) + '.proto'
+  types = type_closure(proto_contents, message_types)
+  return {'proto': proto,
+          'name': service['name'],
+          'summary': SERVICE_SUMMARIES.get(service['name'],
+                                           service.get('comment', '')),
+          'home': home,
+          'groups': [{'name': min(method['group'] for method in groups[group]),
+                      'methods': groups[group]}
+                     for group in sorted(groups, key=group_order)],
+          'types': types,
+          'objects': collect_objects(proto_contents, types)}
+
+# The JSON schemas of the scalar types, after the proto3 JSON mapping.
+SCALAR_SCHEMAS = {
+    'double': {'type': 'number'},
+    'float': {'type': 'number'},
+    'int32': {'type': 'integer'},
+    'uint32': {'type': 'integer'},
+    'sint32': {'type': 'integer'},
+    'fixed32': {'type': 'integer'},
+    'sfixed32': {'type': 'integer'},
+    'int64': {'type': 'string', 'format': 'int64'},
+    'uint64': {'type': 'string', 'format': 'uint64'},
+    'sint64': {'type': 'string', 'format': 'int64'},
+    'fixed64': {'type': 'string', 'format': 'uint64'},
+    'sfixed64': {'type': 'string', 'format': 'int64'},
+    'bool': {'type': 'boolean'},
+    'string': {'type': 'string'},
+    'bytes': {'type': 'string', 'contentEncoding': 'base64'},
+}
+
+def resolve_symbol(proto_contents, scope, name):
+  """
+  Return the fully qualified name of the enum or message name refers to
+  in scope (e.g. vtgate.Session), looking in the innermost scope first
+  like protoc, or None.
+  """
+  symbols = proto_contents['symbol-index']['symbols']
+  scope = scope.split('.')
+  while scope:
+    candidate = '.'.join(scope + [name])
+    if candidate in symbols:
+      return candidate
+    scope.pop()
+  if name in symbols:
+    return name
+  return None
+
+def api_schema(proto_contents, service):
+  """
+  Return a JSON schema of the API of service: the definitions of the
+  messages and enums of its methods, and its methods and their groups.
+  """
+  symbols = proto_contents['symbol-index']['symbols']
+  definitions = {}
+  pending = []
+
+  def type_schema(scope, type_name):
+    if type_name in SCALAR_SCHEMAS:
+      return dict(SCALAR_SCHEMAS[type_name])
+    name = resolve_symbol(proto_contents, scope, type_name)
+    if not name:
+      return {'$comment': 'unknown type ' + type_name}
+    pending.append(name)
+    return {'$ref': '#/definitions/' + name}
+
+  package = service['proto'].replace('.proto', '')
+  methods = {}
+  for group in service['groups']:
+    for method in group['methods']:
+      methods[method['name']] = {
+          'description': method['comment'],
+          'group': group['name'],
+          'request': type_schema(package,
+                                 method['request'].replace('stream ', '')),
+          'response': type_schema(package,
+                                  method['response'].replace('stream ', '')),
+          'streaming': method['response'].startswith('stream '),
+      }
+
+  while pending:
+    name = pending.pop()
+    if name in definitions:
+      continue
+    symbol = symbols[name]
+    definition = symbol['definition']
+    schema = {'description': definition['comment'].strip()}
+    if symbol['kind'] == 'enums':
+      schema['type'] = 'string'
+      schema['enum'] = [value['text'] for value in definition['values']]
+    else:
+      schema['type'] = 'object'
+      schema['properties'] = {}
+      for prop in definition['properties']:
+        map_fields = re.findall(r'map\s*<([^\,]+)\,\s*([^\>]+)', prop['type'])
+        if map_fields:
+          prop_schema = {'type': 'object',
+                         'additionalProperties': type_schema(
+                             name, map_fields[0][1].strip())}
         else:
-          prop_data = re.findall(r'(optional|repeated|required)?\s*map\s*\<([^\>]+)\>\s+([\w\.\_]+)\s*=\s*(\d+)', line)
-          if prop_data:
-            prop_type = 'map <' + prop_data[0][1] + '>' 
-            if current_struct == 'topLevelMessage':
-              current_top_level_message = add_property(
-                  current_top_level_message, prop_data, prop_type, comment)
-            elif current_struct == 'message':
-              current_message = add_property(current_message, prop_data,
-                  prop_type, comment)
-            comment = ''
+          prop_schema = type_schema(name, prop['type'])
+        if prop['status'] == 'repeated':
+          prop_schema = {'type': 'array', 'items': prop_schema}
+        if prop['comment'].strip():
+          prop_schema['description'] = prop['comment'].strip()
+        schema['properties'][prop['name']] = prop_schema
+    definitions[name] = schema
+
+  return {'$schema': 'http://json-schema.org/draft-07/schema#',
+          'title': service['name'] + ' API',
+          'description': service['summary'],
+          'definitions': definitions,
+          'methods': methods}
+
+def main(proto_directory, doc_directory, cache_file=None, formats=('md',)):
+  proto_contents = parse_protos(proto_directory, cache_file)
+  proto_contents['symbol-index'] = build_symbol_index(proto_contents)
 
   #print json.dumps(proto_contents, sort_keys=True, indent=2)
-  methods = []
-  types = []
-  for method in proto_contents['vtgateservice.proto']['service']['methods']:
-    methods.append(method['request'])
-    methods.append(method['response'].replace('stream ', ''))
-  for method in methods:
-    types = build_property_type_list(types, proto_contents, method)
-  types = list(set(types))
-
-  type_length = len(types)
-  new_type_length = 100
-  for x in range(0, 10):
-  #while type_length < new_type_length:
-    for prop_type in types:
-      types = build_property_type_list(types, proto_contents, prop_type)
-      types = list(set(types))
-    new_type_length = len(types)
-    
-  proto_contents['group-ordering'] = ['Range-based Sharding',
-                                      'Transactions',
-                                      'Custom Sharding',
-                                      'Map Reduce',
-                                      'Topology',
-                                      'v3 API (alpha)']
-
-  create_reference_doc(proto_directory, doc_directory, proto_contents, types)
+  services = []
+  for proto in sorted(proto_contents):
+    if (proto.endswith('service.proto') and
+        proto_contents[proto]['service']['methods']):
+      services.append(build_service(proto_contents, proto))
+
+  create_reference_doc(doc_directory, proto_contents, services, formats)
 
   return
 
@@ -774,5 +1024,16 @@ if __name__ == '__main__':
                     help='The root directory for the Vitess GitHub tree')
   parser.add_option('-d', '--doc-directory', default='',
                     help='The directory where the documentation resides.')
+  parser.add_option('-c', '--cache-file', default='',
+                    help='A file caching the parsed protos between runs, '
+                         'so that only the changed ones are parsed again.')
+  parser.add_option('-f', '--formats', default='md',
+                    help='Comma separated formats of the documents of the '
+                         'services: md, html and json (a JSON schema).')
   (options,args) = parser.parse_args()
-  main(options.proto_directory, options.doc_directory)
+  formats = options.formats.split(',')
+  for doc_format in formats:
+    if doc_format not in DOCUMENTS and doc_format != 'json':
+      parser.error('unknown format: ' + doc_format)
+  main(options.proto_directory, options.doc_directory, options.cache_file,
+       formats)
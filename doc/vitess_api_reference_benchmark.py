@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+# Copyright 2019 The Vitess Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time the stages of vitess_api_reference.py on synthesized proto sets of
+growing size, e.g.:
+
+  python vitess_api_reference_benchmark.py --files 10 --scales 1,2,4,8
+
+Every scale writes scale * files protos of --messages messages each. The
+messages refer to messages of their own proto and of the next one, and
+hold nested messages and enums, and a vtgateservice.proto has an rpc per
+proto for the Vitess service.
+"""
+
+from __future__ import print_function
+
+import optparse
+import os
+import shutil
+import tempfile
+import time
+
+import vitess_api_reference as api
+
+MESSAGE = '''// Msg%(message)d is message %(message)d of pkg%(proto)d.
+message Msg%(message)d {
+  // Entry is a nested message.
+  message Entry {
+    // The peer of the entry.
+    pkg%(next_proto)d.Msg%(message)d peer = 1;
+    string name = 2;
+  }
+  // Kind is a nested enum.
+  enum Kind {
+    // The kind is unknown.
+    UNKNOWN = 0;
+    OTHER = 1;
+  }
+  // The id.
+  int64 id = 1;
+  %(next_message)s
+  // The same message of the next proto.
+  pkg%(next_proto)d.Msg%(message)d peer = 3;
+  State state = 4;
+  repeated Entry entries = 5;
+  map<string, Msg%(message)d> by_name = 6;
+  Kind kind = 7;
+}
+
+'''
+
+
+def write_proto(directory, proto, protos, messages):
+  lines = ['// pkg%d is a synthesized proto.\n' % proto,
+           '\n',
+           'syntax = "proto3";\n',
+           '\n',
+           'package pkg%d;\n' % proto,
+           '\n',
+           'import "pkg%d.proto";\n' % ((proto + 1) % protos),
+           '\n',
+           '// State is a top-level enum.\n',
+           'enum State {\n',
+           '  STATE_UNKNOWN = 0;\n',
+           '  STATE_READY = 1;\n',
+           '}\n',
+           '\n']
+  for message in range(messages):
+    next_message = ''
+    if message + 1 < messages:
+      next_message = 'Msg%d next = 2;' % (message + 1)
+    lines.append(MESSAGE % {'proto': proto,
+                            'next_proto': (proto + 1) % protos,
+                            'message': message,
+                            'next_message': next_message})
+  with open(os.path.join(directory, 'pkg%d.proto' % proto), 'w') as f:
+    f.writelines(lines)
+
+
+def write_service(directory, protos):
+  lines = ['// A synthesized service.\n',
+           '\n',
+           'syntax = "proto3";\n',
+           '\n',
+           'package vtgateservice;\n',
+           '\n']
+  for proto in range(protos):
+    lines.append('import "pkg%d.proto";\n' % proto)
+  lines.append('\n// Vitess is the synthesized service.\nservice Vitess {\n')
+  for proto in range(protos):
+    group = api.GROUP_ORDERING[proto % len(api.GROUP_ORDERING)]
+    lines.append('  // Call%d calls pkg%d. API group: %s\n' % (proto, proto, group))
+    lines.append('  rpc Call%d(pkg%d.Msg0) returns (stream pkg%d.Msg1) {};\n' %
+                 (proto, proto, proto))
+  lines.append('}\n')
+  with open(os.path.join(directory, 'vtgateservice.proto'), 'w') as f:
+    f.writelines(lines)
+
+
+def synthesize(directory, protos, messages):
+  for proto in range(protos):
+    write_proto(directory, proto, protos, messages)
+  write_service(directory, protos)
+
+
+def timed(function, *args):
+  start = time.time()
+  result = function(*args)
+  return result, time.time() - start
+
+
+def run(directory, protos, messages, formats):
+  """Return the size of the proto set and the seconds of each stage."""
+  proto_directory = os.path.join(directory, 'proto') + os.sep
+  doc_directory = os.path.join(directory, 'doc') + os.sep
+  os.makedirs(proto_directory)
+  os.makedirs(doc_directory)
+  synthesize(proto_directory, protos, messages)
+  lines = 0
+  for path in os.listdir(proto_directory):
+    with open(proto_directory + path) as f:
+      lines += sum(1 for _ in f)
+
+  cache_file = os.path.join(directory, 'cache.json')
+  proto_contents, parse = timed(api.parse_protos, proto_directory, cache_file)
+  proto_contents, cached = timed(api.parse_protos, proto_directory, cache_file)
+  index, index_time = timed(api.build_symbol_index, proto_contents)
+  proto_contents['symbol-index'] = index
+  service, model = timed(api.build_service, proto_contents,
+                         'vtgateservice.proto')
+  _, render = timed(api.create_reference_doc, doc_directory, proto_contents,
+                    [service], formats)
+  return {'protos': protos + 1, 'lines': lines, 'types': len(service['types']),
+          'parse': parse, 'cached': cached, 'index': index_time,
+          'model': model, 'render': render}
+
+
+def main():
+  parser = optparse.OptionParser(usage='usage: %prog [options]')
+  parser.add_option('-f', '--files', type='int', default=10,
+                    help='number of protos at scale 1')
+  parser.add_option('-m', '--messages', type='int', default=20,
+                    help='number of messages per proto')
+  parser.add_option('-s', '--scales', default='1,2,4,8',
+                    help='comma separated multiples of --files to run')
+  parser.add_option('--formats', default='md,html,json',
+                    help='comma separated formats of the documents')
+  options, _ = parser.parse_args()
+
+  print('%6s %8s %6s %8s %8s %8s %8s %8s' % (
+      'protos', 'lines', 'types', 'parse', 'cached', 'index', 'model',
+      'render'))
+  for scale in options.scales.split(','):
+    directory = tempfile.mkdtemp(prefix='vitess_api_reference')
+    try:
+      result = run(directory, int(scale) * options.files, options.messages,
+                   options.formats.split(','))
+    finally:
+      shutil.rmtree(directory)
+    print('%(protos)6d %(lines)8d %(types)6d %(parse)8.3f %(cached)8.3f '
+          '%(index)8.3f %(model)8.3f %(render)8.3f' % result)
+
+
+if __name__ == '__main__':
+  main()
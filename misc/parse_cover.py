@@ -1,13 +1,13 @@
 #!/usr/bin/python
 
 # Copyright 2019 The Vitess Authors.
-# 
+#
 # Licensed under the Apache License, Version 2.0 (the "License");
 # you may not use this file except in compliance with the License.
 # You may obtain a copy of the License at
-# 
+#
 #     http://www.apache.org/licenses/LICENSE-2.0
-# 
+#
 # Unless required by applicable law or agreed to in writing, software
 # distributed under the License is distributed on an "AS IS" BASIS,
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
@@ -15,31 +15,256 @@
 # limitations under the License.
 
 # this is a small helper script to parse test coverage and display stats.
+#
+# Without arguments it filters the output of `go test -cover` on stdin,
+# echoing it, and prints the share of directories with tests and their
+# average coverage:
+#
+#   go test -cover ./go/... | misc/parse_cover.py
+#
+# It also reads files, or the files of directories, of `go test -cover`
+# output or `go test -coverprofile` profiles, in parallel with --jobs, and
+# computes the statement coverage of each package and directory from the
+# profiles (blocks covered by any of them count as covered), e.g.:
+#
+#   misc/parse_cover.py --jobs 8 --json coverage/ > coverage.json
+from __future__ import print_function
+
+import fnmatch
+import json
+import multiprocessing
+import optparse
+import os
 import re
 import sys
 
 coverage_pattern = re.compile(r"coverage: (\d+).(\d+)% of statements")
+package_pattern = re.compile(r"^(?:ok|FAIL|\?)?\s+(\S+)\s")
+# A block of a coverprofile: file:startLine.startCol,endLine.endCol statements count
+block_pattern = re.compile(r"^(.+):(\d+\.\d+,\d+\.\d+) (\d+) (\d+)$")
+
+
+class TestOutput(object):
+  """The coverage of the packages in `go test -cover` output."""
+
+  def __init__(self):
+    self.no_test_file_count = 0
+    self.coverage_count = 0
+    self.coverage_sum = 0.0
+    self.packages = {}
+
+  def add_line(self, line):
+    if line.find('[no test files]') != -1:
+      self.no_test_file_count += 1
+      return
+    m = coverage_pattern.search(line)
+    if m != None:
+      coverage = float(m.group(1) + "." + m.group(2))
+      self.coverage_count += 1
+      self.coverage_sum += coverage
+      p = package_pattern.match(line)
+      if p != None:
+        self.packages[p.group(1)] = coverage
+
+  def merge(self, other):
+    self.no_test_file_count += other.no_test_file_count
+    self.coverage_count += other.coverage_count
+    self.coverage_sum += other.coverage_sum
+    self.packages.update(other.packages)
+
+  def directories_covered(self):
+    directories = self.no_test_file_count + self.coverage_count
+    if directories == 0:
+      return 0.0
+    return self.coverage_count * 100.0 / directories
+
+  def average_coverage(self):
+    if self.coverage_count == 0:
+      return 0.0
+    return self.coverage_sum / self.coverage_count
+
+
+class Profile(object):
+  """
+  The blocks of coverprofiles, by source file: {position: [statements,
+  covered]}. Memory grows with the number of distinct blocks, not with the
+  size or number of the profiles.
+  """
+
+  def __init__(self):
+    self.files = {}
+    self.mode = None
+
+  def add_line(self, line):
+    if line.startswith('mode:'):
+      self.mode = line.split(':', 1)[1].strip()
+      return
+    m = block_pattern.match(line.rstrip())
+    if m == None:
+      return
+    blocks = self.files.setdefault(m.group(1), {})
+    block = blocks.get(m.group(2))
+    covered = m.group(4) != '0'
+    if block == None:
+      blocks[m.group(2)] = [int(m.group(3)), covered]
+    elif covered:
+      block[1] = True
+
+  def merge(self, other):
+    self.mode = self.mode or other.mode
+    for name, other_blocks in other.files.items():
+      blocks = self.files.get(name)
+      if blocks == None:
+        self.files[name] = other_blocks
+        continue
+      for position, (statements, covered) in other_blocks.items():
+        block = blocks.get(position)
+        if block == None:
+          blocks[position] = [statements, covered]
+        elif covered:
+          block[1] = True
+
+  def packages(self):
+    """Return {package: [statements, covered statements]}."""
+    packages = {}
+    for name, blocks in self.files.items():
+      package = packages.setdefault(os.path.dirname(name), [0, 0])
+      for statements, covered in blocks.values():
+        package[0] += statements
+        if covered:
+          package[1] += statements
+    return packages
+
+
+def directories(packages):
+  """Sum up {package: [statements, covered]} into every parent directory."""
+  result = {}
+  for package, (statements, covered) in packages.items():
+    directory = package
+    while directory:
+      total = result.setdefault(directory, [0, 0])
+      total[0] += statements
+      total[1] += covered
+      parent = os.path.dirname(directory)
+      if parent == directory:
+        break
+      directory = parent
+  return result
+
+
+def percent(statements, covered):
+  if statements == 0:
+    return 0.0
+  return covered * 100.0 / statements
+
+
+def parse_file(path):
+  """Parse a coverprofile or a go test output file; runs in the pool."""
+  output = TestOutput()
+  profile = Profile()
+  with open(path) as f:
+    first = f.readline()
+    parser = profile if first.startswith('mode:') else output
+    parser.add_line(first)
+    for line in f:
+      parser.add_line(line)
+  return output, profile
+
+
+def input_files(args, pattern):
+  for arg in args:
+    if not os.path.isdir(arg):
+      yield arg
+      continue
+    for root, dirs, files in os.walk(arg):
+      dirs.sort()
+      for name in sorted(files):
+        if fnmatch.fnmatch(name, pattern):
+          yield os.path.join(root, name)
+
+
+def report(output, profile):
+  packages = profile.packages()
+  statements = sum(total[0] for total in packages.values())
+  covered = sum(total[1] for total in packages.values())
+
+  def stats(totals):
+    return dict((name, {'statements': total[0], 'covered': total[1],
+                        'percent': round(percent(total[0], total[1]), 1)})
+                for name, total in totals.items())
+  return {
+      'directories_covered': round(output.directories_covered(), 1),
+      'average_coverage': round(output.average_coverage(), 1),
+      'test_packages': output.packages,
+      'mode': profile.mode,
+      'statements': statements,
+      'covered': covered,
+      'percent': round(percent(statements, covered), 1),
+      'packages': stats(packages),
+      'directories': stats(directories(packages)),
+  }
+
 
-no_test_file_count = 0
-coverage_count = 0
-coverage_sum = 0.0
+def main():
+  parser = optparse.OptionParser(usage='usage: %prog [options] [file or directory ...]')
+  parser.add_option('-j', '--jobs', type='int', default=1,
+                    help='number of files parsed in parallel')
+  parser.add_option('-p', '--pattern', default='*',
+                    help='files of the directories to read (default: all)')
+  parser.add_option('--json', action='store_true',
+                    help='print the coverage as JSON')
+  parser.add_option('-q', '--quiet', action='store_true',
+                    help="don't echo the standard input")
+  options, args = parser.parse_args()
 
-for line in sys.stdin:
-  print line,
-  sys.stdout.flush
+  output = TestOutput()
+  profile = Profile()
+  if not args:
+    for line in iter(sys.stdin.readline, ''):
+      if not options.quiet and not options.json:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+      if line.startswith('mode:') or profile.mode != None:
+        profile.add_line(line)
+      else:
+        output.add_line(line)
+  else:
+    paths = list(input_files(args, options.pattern))
+    if options.jobs > 1 and len(paths) > 1:
+      pool = multiprocessing.Pool(min(options.jobs, len(paths)))
+      try:
+        # Merge the results as they come, rather than keeping them all.
+        for file_output, file_profile in pool.imap_unordered(parse_file, paths):
+          output.merge(file_output)
+          profile.merge(file_profile)
+        pool.close()
+      except:
+        pool.terminate()
+        raise
+      finally:
+        pool.join()
+    else:
+      for path in paths:
+        file_output, file_profile = parse_file(path)
+        output.merge(file_output)
+        profile.merge(file_profile)
 
-  if line.find('[no test files]') != -1:
-    no_test_file_count += 1
-    continue
+  result = report(output, profile)
+  if options.json:
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    print()
+    return
 
-  m = coverage_pattern.search(line)
-  if m != None:
-    coverage_count += 1
-    coverage_sum += float(m.group(1) + "." + m.group(2))
-    continue
+  print("Directory test coverage: %u%%" % output.directories_covered())
+  print("Average test coverage: %u%%" % int(output.average_coverage()))
+  if profile.files:
+    print("Statement coverage: %.1f%% of %d statements" % (
+        result['percent'], result['statements']))
+    for package in sorted(result['packages']):
+      package_stats = result['packages'][package]
+      print("  %5.1f%% %7d %s" % (package_stats['percent'],
+                                  package_stats['statements'], package))
 
-directories_covered = coverage_count * 100 / (no_test_file_count + coverage_count)
-average_coverage = coverage_sum / coverage_count
 
-print "Directory test coverage: %u%%" % directories_covered
-print "Average test coverage: %u%%" % int(average_coverage)
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,359 @@
+#!/usr/bin/python
+
+# Copyright 2019 The Vitess Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# this is a small helper script to aggregate vtgate query logs and display
+# the top queries.
+#
+# It reads the records of go/vt/vtgate/logstats.go, in the text or JSON
+# format of -querylog-format, from stdin or files, e.g.:
+#
+#   curl -s http://vtgate:15001/debug/querylog | misc/parse_querylog.py -i 60
+#   misc/parse_querylog.py --top 20 --sort p99 vtgate_queries.log
+#
+# Queries are grouped by fingerprint (the SQL with literals, bind variables
+# and IN lists collapsed), each keeping a latency sketch for quantiles, the
+# number of shards queried and the plan / execute / commit time, so memory
+# stays constant however long the log. A report of the top fingerprints is
+# printed every --interval seconds and at the end.
+import json
+import math
+import optparse
+import re
+import sys
+import time
+
+# The tab separated fields of the text format, see LogStats.Logf.
+TEXT_FIELDS = ['Method', 'RemoteAddr', 'Username', 'ImmediateCaller',
+               'EffectiveCaller', 'Start', 'End', 'TotalTime', 'PlanTime',
+               'ExecuteTime', 'CommitTime', 'StmtType', 'SQL', 'BindVars']
+TEXT_TRAILING_FIELDS = ['ShardQueries', 'RowsAffected', 'Error', 'Keyspace',
+                        'Table', 'TabletType']
+
+go_escape_pattern = re.compile(
+    r'\\(x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)')
+go_escapes = {'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+              'v': '\v', '\\': '\\', "'": "'", '"': '"'}
+
+token_pattern = re.compile(r"""
+    (?P<comment>/\*.*?\*/|--[^\n]*|\#[^\n]*)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<ident>`(?:[^`]|``)*`)
+  | (?P<bindvar>:[A-Za-z_][\w.]*|\?)
+  | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_$][\w$]*)
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+# The characters of operators, written with or without spaces around them.
+# '*' isn't one: it's more often `select *` than a product.
+operator_chars = frozenset('=<>!+-/%&|^~')
+value_list_pattern = re.compile(r'\(\?(?:, \?)+\)')
+values_rows_pattern = re.compile(r'values \(\?\+\)(?:, \(\?\+\))+')
+
+
+try:
+  unichr
+except NameError:
+  unichr = chr
+
+
+def go_unquote(value):
+  """Decode a string formatted by Go's %q."""
+  if len(value) < 2 or value[0] != '"' or value[-1] != '"':
+    return value
+
+  def replace(match):
+    escape = match.group(1)
+    if escape[0] == 'x':
+      return chr(int(escape[1:], 16))
+    if escape[0] in 'uU':
+      return unichr(int(escape[1:], 16))
+    return go_escapes.get(escape, escape)
+  return go_escape_pattern.sub(replace, value[1:-1])
+
+
+def fingerprint(sql):
+  """
+  Normalize sql: literals and bind variables become ?, IN lists (?+), and
+  spaces around operators are dropped.
+  """
+  out = []
+  for match in token_pattern.finditer(sql):
+    kind = match.lastgroup
+    if kind == 'comment':
+      continue
+    if kind == 'space':
+      if out and out[-1] != ' ' and out[-1] not in operator_chars:
+        out.append(' ')
+    elif kind in ('string', 'number', 'bindvar'):
+      # A negative number is a single value, unless the - subtracts.
+      if out and out[-1] == '-':
+        before = [token for token in out[-3:-1] if token != ' ']
+        if not before or before[-1] in operator_chars or before[-1] in '(,':
+          out.pop()
+      out.append('?')
+    elif kind == 'word':
+      out.append(match.group().lower())
+    elif kind == 'other' and match.group() == ',':
+      if out and out[-1] == ' ':
+        out.pop()
+      out.append(',')
+      out.append(' ')
+    elif kind == 'other' and match.group() in operator_chars:
+      if out and out[-1] == ' ' and out[-2] != ',':
+        out.pop()
+      out.append(match.group())
+    else:
+      if match.group() == ')' and out and out[-1] == ' ':
+        out.pop()
+      out.append(match.group())
+  text = ''.join(out).strip()
+  text = value_list_pattern.sub('(?+)', text)
+  return values_rows_pattern.sub('values (?+)...', text)
+
+
+def parse_record(line):
+  """Return the dict of fields of a query log line, or None."""
+  line = line.rstrip('\r\n')
+  if not line:
+    return None
+  if line.startswith('{'):
+    try:
+      return json.loads(line)
+    except ValueError:
+      # A truncated record.
+      return None
+  fields = line.split('\t')
+  if fields and fields[-1] == '':
+    fields.pop()
+  if len(fields) < len(TEXT_FIELDS) + len(TEXT_TRAILING_FIELDS):
+    return None
+  # BindVars, in Go's %v format, is the only field that may hold tabs.
+  record = dict(zip(TEXT_FIELDS[:-1], fields))
+  record.update(zip(TEXT_TRAILING_FIELDS, fields[-len(TEXT_TRAILING_FIELDS):]))
+  for name in ('ImmediateCaller', 'EffectiveCaller'):
+    record[name] = record[name].strip("'")
+  for name in ('SQL', 'Error', 'Keyspace', 'Table', 'TabletType'):
+    record[name] = go_unquote(record[name])
+  return record
+
+
+class Sketch(object):
+  """
+  A latency histogram with logarithmic buckets, giving quantiles within a
+  relative error of `accuracy` in constant memory.
+  """
+
+  def __init__(self, accuracy=0.01):
+    self.gamma = (1 + accuracy) / (1 - accuracy)
+    self.log_gamma = math.log(self.gamma)
+    self.buckets = {}
+    self.zeros = 0
+    self.count = 0
+
+  def add(self, value):
+    self.count += 1
+    if value <= 0:
+      self.zeros += 1
+      return
+    index = int(math.ceil(math.log(value) / self.log_gamma))
+    self.buckets[index] = self.buckets.get(index, 0) + 1
+
+  def quantile(self, q):
+    if self.count == 0:
+      return 0.0
+    rank = q * (self.count - 1)
+    seen = self.zeros
+    if rank < seen:
+      return 0.0
+    for index in sorted(self.buckets):
+      seen += self.buckets[index]
+      if rank < seen:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+    return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class QueryStats(object):
+  """The aggregated records of one fingerprint."""
+
+  def __init__(self, fingerprint, accuracy):
+    self.fingerprint = fingerprint
+    self.count = 0
+    self.errors = 0
+    self.rows = 0
+    self.total_time = 0.0
+    self.plan_time = 0.0
+    self.execute_time = 0.0
+    self.commit_time = 0.0
+    self.latency = Sketch(accuracy)
+    # Number of records by the number of shards they queried.
+    self.fanout = {}
+    self.tables = set()
+
+  def add(self, record):
+    total_time = float(record.get('TotalTime') or 0)
+    self.count += 1
+    self.total_time += total_time
+    self.plan_time += float(record.get('PlanTime') or 0)
+    self.execute_time += float(record.get('ExecuteTime') or 0)
+    self.commit_time += float(record.get('CommitTime') or 0)
+    self.rows += int(record.get('RowsAffected') or 0)
+    if record.get('Error'):
+      self.errors += 1
+    shards = int(record.get('ShardQueries') or 0)
+    self.fanout[shards] = self.fanout.get(shards, 0) + 1
+    if record.get('Table') and len(self.tables) < 8:
+      self.tables.add('%s.%s' % (record.get('Keyspace'), record['Table']))
+    self.latency.add(total_time)
+
+  def summary(self):
+    return {
+        'fingerprint': self.fingerprint,
+        'count': self.count,
+        'errors': self.errors,
+        'rows_affected': self.rows,
+        'total_time': self.total_time,
+        'plan_time': self.plan_time,
+        'execute_time': self.execute_time,
+        'commit_time': self.commit_time,
+        'p50': self.latency.quantile(0.5),
+        'p90': self.latency.quantile(0.9),
+        'p99': self.latency.quantile(0.99),
+        'shards': dict((str(shards), count) for shards, count in sorted(self.fanout.items())),
+        'scatter': sum(count for shards, count in self.fanout.items() if shards > 1),
+        'tables': sorted(self.tables),
+    }
+
+
+class Aggregator(object):
+  """Per fingerprint stats of at most max_fingerprints fingerprints."""
+
+  def __init__(self, max_fingerprints=10000, accuracy=0.01):
+    self.max_fingerprints = max_fingerprints
+    self.accuracy = accuracy
+    self.stats = {}
+    self.records = 0
+    self.skipped = 0
+    self.evicted = 0
+
+  def add(self, record):
+    if record is None or 'SQL' not in record:
+      self.skipped += 1
+      return
+    self.records += 1
+    key = fingerprint(record['SQL'])
+    stats = self.stats.get(key)
+    if stats is None:
+      if len(self.stats) >= self.max_fingerprints:
+        self.evict()
+      stats = self.stats[key] = QueryStats(key, self.accuracy)
+    stats.add(record)
+
+  def evict(self):
+    # Drop the tenth of the fingerprints that took the least time, at once
+    # so the scan is amortized.
+    ranked = sorted(self.stats.values(), key=lambda stats: stats.total_time)
+    for stats in ranked[:max(1, len(ranked) // 10)]:
+      del self.stats[stats.fingerprint]
+      self.evicted += 1
+
+  def report(self, top, sort):
+    summaries = [stats.summary() for stats in self.stats.values()]
+    summaries.sort(key=lambda summary: summary[sort], reverse=True)
+    return {
+        'records': self.records,
+        'skipped': self.skipped,
+        'fingerprints': len(self.stats),
+        'evicted': self.evicted,
+        'top': summaries[:top],
+    }
+
+
+def print_report(report, as_json, out):
+  if as_json:
+    out.write(json.dumps(report, sort_keys=True) + '\n')
+    out.flush()
+    return
+  out.write('%d records, %d fingerprints (%d evicted), %d unparsable lines\n' % (
+      report['records'], report['fingerprints'], report['evicted'], report['skipped']))
+  out.write('%8s %10s %9s %9s %9s %6s %6s %6s %6s %s\n' % (
+      'count', 'total(s)', 'p50(ms)', 'p99(ms)', 'scatter', 'plan%', 'exec%',
+      'commit%', 'errors', 'fingerprint'))
+  for summary in report['top']:
+    total_time = summary['total_time'] or 1.0
+    out.write('%8d %10.3f %9.3f %9.3f %9d %6.1f %6.1f %6.1f %6d %s\n' % (
+        summary['count'], summary['total_time'], summary['p50'] * 1000,
+        summary['p99'] * 1000, summary['scatter'],
+        100 * summary['plan_time'] / total_time,
+        100 * summary['execute_time'] / total_time,
+        100 * summary['commit_time'] / total_time,
+        summary['errors'], summary['fingerprint'][:120]))
+  out.write('\n')
+  out.flush()
+
+
+def input_lines(paths):
+  if not paths or paths == ['-']:
+    # readline, unlike iterating over the file, doesn't read ahead, so
+    # reports of a live log aren't delayed.
+    for line in iter(sys.stdin.readline, ''):
+      yield line
+    return
+  for path in paths:
+    with open(path) as f:
+      for line in f:
+        yield line
+
+
+def main():
+  parser = optparse.OptionParser(usage='usage: %prog [options] [querylog ...]')
+  parser.add_option('-n', '--top', type='int', default=10,
+                    help='number of fingerprints to report')
+  parser.add_option('-s', '--sort', default='total_time',
+                    choices=['total_time', 'count', 'p50', 'p99', 'scatter', 'errors'],
+                    help='order of the report: total_time, count, p50, p99, scatter or errors')
+  parser.add_option('-i', '--interval', type='float', default=0,
+                    help='print a report every INTERVAL seconds')
+  parser.add_option('-w', '--window', action='store_true',
+                    help='reset the stats after each periodic report')
+  parser.add_option('-m', '--max-fingerprints', type='int', default=10000,
+                    help='fingerprints kept in memory')
+  parser.add_option('-a', '--accuracy', type='float', default=0.01,
+                    help='relative accuracy of the latency quantiles')
+  parser.add_option('-j', '--json', action='store_true',
+                    help='print the reports as JSON lines')
+  options, args = parser.parse_args()
+
+  def new_aggregator():
+    return Aggregator(options.max_fingerprints, options.accuracy)
+
+  aggregator = new_aggregator()
+  next_report = time.time() + options.interval if options.interval else None
+  try:
+    for line in input_lines(args):
+      aggregator.add(parse_record(line))
+      if next_report is not None and time.time() >= next_report:
+        print_report(aggregator.report(options.top, options.sort), options.json, sys.stdout)
+        next_report = time.time() + options.interval
+        if options.window:
+          aggregator = new_aggregator()
+  except KeyboardInterrupt:
+    pass
+  print_report(aggregator.report(options.top, options.sort), options.json, sys.stdout)
+
+
+if __name__ == '__main__':
+  main()
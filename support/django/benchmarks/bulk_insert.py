@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Compare bulk insert throughput of the stock bulk_create() path against the
+shard-aware custom_db_backends.vitess.bulk.bulk_create(), using the customer
+table of the examples/local sharded tutorial (run 301_customer_sharded.sh
+and 302_new_shards.sh first, then point --port at vtgate's MySQL port).
+
+    python benchmarks/bulk_insert.py --port 15306 --rows 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', '..', '..', 'examples', 'local')
+
+
+def configure(args):
+    import django
+    from django.conf import settings
+    settings.configure(
+        DATABASES={'default': {
+            'ENGINE': 'custom_db_backends.vitess',
+            'NAME': args.keyspace,
+            'HOST': args.host,
+            'PORT': args.port,
+            'USER': args.user,
+            'VITESS': {
+                'POOL': {'MAX_SIZE': args.concurrency},
+                'VSCHEMA': args.vschema,
+                'SHARDS': args.shards.split(','),
+                'BULK': {'MAX_ROWS': args.max_rows, 'MAX_BYTES': args.max_bytes,
+                         'CONCURRENCY': args.concurrency},
+            },
+        }},
+        INSTALLED_APPS=[],
+    )
+    django.setup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=15306)
+    parser.add_argument('--user', default='')
+    parser.add_argument('--keyspace', default='customer')
+    parser.add_argument('--vschema', default=os.path.join(
+        EXAMPLES_DIR, 'vschema_customer_sharded.json'))
+    parser.add_argument('--shards', default='-80,80-')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--max-rows', type=int, default=500)
+    parser.add_argument('--max-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+    configure(args)
+
+    from django.db import connection, models
+    from custom_db_backends.vitess import bulk
+
+    class Customer(models.Model):
+        customer_id = models.BigIntegerField(primary_key=True)
+        email = models.CharField(max_length=128)
+
+        class Meta:
+            app_label = 'benchmarks'
+            db_table = 'customer'
+            managed = False
+
+    base = random.randint(1 << 40, 1 << 50)
+
+    def make_objs(offset):
+        return [Customer(customer_id=base + offset + i, email='user%d@example.com' % i)
+                for i in range(args.rows)]
+
+    def run(name, insert, offset):
+        objs = make_objs(offset)
+        started = time.monotonic()
+        insert(objs)
+        elapsed = time.monotonic() - started
+        print('%-32s %8d rows %8.2fs %10.0f rows/s' % (
+            name, len(objs), elapsed, len(objs) / elapsed))
+
+    try:
+        run('bulk_create (one statement)',
+            lambda objs: Customer.objects.bulk_create(objs, batch_size=len(objs)), 0)
+        run('bulk_create (per-row)',
+            lambda objs: [Customer.objects.bulk_create([obj]) for obj in objs],
+            args.rows)
+        run('bulk_create (vitess batch size)',
+            lambda objs: Customer.objects.bulk_create(objs), 2 * args.rows)
+        run('vitess bulk.bulk_create',
+            lambda objs: bulk.bulk_create(Customer, objs), 3 * args.rows)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM customer WHERE customer_id >= %s AND customer_id < %s',
+                           [base, base + 4 * args.rows])
+
+
+if __name__ == '__main__':
+    main()
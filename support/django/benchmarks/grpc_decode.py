@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Measure the row decoding throughput of the gRPC transport of the vitess
+backend against a fake vtgate served in-process, and, given --mysql-port,
+of the MySQL protocol path (mysqlclient with Django's conversions) reading
+rows of the same types from a real vtgate or MySQL server.
+
+    make py_proto
+    PYTHONPATH=vtproto python benchmarks/grpc_decode.py --rows 200000
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+from concurrent import futures
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def configure():
+    import django
+    from django.conf import settings
+    settings.configure(INSTALLED_APPS=[])
+    django.setup()
+
+
+def make_result(rows):
+    """A QueryResult of `rows` rows of (id, email, balance, created, payload)."""
+    import query_pb2
+    fields = [
+        query_pb2.Field(name='id', type=query_pb2.INT64),
+        query_pb2.Field(name='email', type=query_pb2.VARCHAR),
+        query_pb2.Field(name='balance', type=query_pb2.DECIMAL),
+        query_pb2.Field(name='created', type=query_pb2.DATETIME),
+        query_pb2.Field(name='payload', type=query_pb2.VARBINARY),
+    ]
+    created = datetime.datetime(2020, 1, 1, 12, 30, 45, 123456)
+    result = query_pb2.QueryResult(fields=fields)
+    for i in range(rows):
+        values = [str(i).encode(), b'user%d@example.com' % i,
+                  str(Decimal(i) / 100).encode(),
+                  (created + datetime.timedelta(seconds=i)).isoformat(' ').encode(),
+                  b'\x00\x01' * 8]
+        result.rows.add(lengths=[len(value) for value in values], values=b''.join(values))
+    return result
+
+
+def serve(result, chunk_rows):
+    """Start a fake vtgate answering every query with `result`."""
+    import grpc
+    import query_pb2
+    import vtgate_pb2
+    import vtgateservice_pb2_grpc
+
+    class FakeVitess(vtgateservice_pb2_grpc.VitessServicer):
+        def Execute(self, request, context):
+            return vtgate_pb2.ExecuteResponse(session=request.session, result=result)
+
+        def StreamExecute(self, request, context):
+            yield vtgate_pb2.StreamExecuteResponse(
+                result=query_pb2.QueryResult(fields=result.fields))
+            for start in range(0, len(result.rows), chunk_rows):
+                yield vtgate_pb2.StreamExecuteResponse(
+                    result=query_pb2.QueryResult(rows=result.rows[start:start + chunk_rows]))
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4),
+                         options=[('grpc.max_send_message_length', -1)])
+    vtgateservice_pb2_grpc.add_VitessServicer_to_server(FakeVitess(), server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    return server, '127.0.0.1:%d' % port
+
+
+def report(name, rows, elapsed):
+    print('%-36s %8d rows %8.3fs %12.0f rows/s' % (name, rows, elapsed, rows / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk-rows', type=int, default=1000)
+    parser.add_argument('--mysql-host', default='127.0.0.1')
+    parser.add_argument('--mysql-port', type=int,
+                        help='vtgate (or MySQL) port to measure the MySQL protocol path')
+    parser.add_argument('--mysql-user', default='root')
+    args = parser.parse_args()
+    configure()
+
+    from custom_db_backends.vitess import columnar, vtgate_grpc
+
+    result = make_result(args.rows)
+    started = time.monotonic()
+    vtgate_grpc.decode_rows(result.fields, result.rows)
+    report('decode only', args.rows, time.monotonic() - started)
+    started = time.monotonic()
+    columnar.decode_columns(result.fields, result.rows)
+    report('columnar decode only%s' % ('' if columnar.numpy else ' (no numpy)'),
+           args.rows, time.monotonic() - started)
+
+    server, address = serve(result, args.chunk_rows)
+    try:
+        for decoder in (vtgate_grpc.decode_rows, columnar.decode_lazy):
+            # The canned result is far larger than gRPC's default 4MB message limit.
+            connection = vtgate_grpc.connect(
+                address, 'commerce', options=[('grpc.max_receive_message_length', -1)],
+                decoder=decoder)
+            try:
+                for name, stream in (('Execute', False), ('StreamExecute', True)):
+                    cursor = connection.cursor(stream=stream)
+                    started = time.monotonic()
+                    cursor.execute('select * from customer')
+                    if decoder is columnar.decode_lazy:
+                        name += ' fetch_columns'
+                        rows = cursor.fetch_columns()[0]
+                    else:
+                        rows = cursor.fetchall()
+                    report('grpc ' + name, len(rows), time.monotonic() - started)
+            finally:
+                connection.close()
+    finally:
+        server.stop(None)
+
+    if args.mysql_port is None:
+        print('mysql protocol: skipped, pass --mysql-port to measure it')
+        return
+    import MySQLdb
+    from django.db.backends.mysql.base import DatabaseWrapper
+    conv = DatabaseWrapper({'NAME': '', 'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '',
+                            'OPTIONS': {}}).get_connection_params()['conv']
+    db = MySQLdb.connect(host=args.mysql_host, port=args.mysql_port, user=args.mysql_user,
+                         conv=conv)
+    cursor = db.cursor()
+    cursor.execute('SET SESSION cte_max_recursion_depth = %s', [args.rows + 1])
+    started = time.monotonic()
+    cursor.execute("""
+        WITH RECURSIVE seq (n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n + 1 < %s)
+        SELECT n, CONCAT('user', n, '@example.com'), CAST(n / 100 AS DECIMAL(20, 2)),
+               TIMESTAMP('2020-01-01 12:30:45.123456') + INTERVAL n SECOND,
+               REPEAT(x'0001', 8)
+        FROM seq""", [args.rows])
+    rows = cursor.fetchall()
+    report('mysql protocol (incl. query time)', len(rows), time.monotonic() - started)
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Count the statements vtgate sends to the tablets per inserted row for a
+table owning a lookup vindex, with the batches of the stock bulk_create(),
+of custom_db_backends.vitess.bulk.bulk_create() grouping rows by shard
+(LOOKUP_BATCHING off) and of its lookup-aware batches.
+
+Without --port the counts are estimated from the vschema. With --port and
+--vars-url, the rows are inserted into a running cluster and the counts
+read from vtgate's QueriesRouted counters; the vschema (by default the
+sharded customer keyspace of examples/local with a consistent lookup on
+customer.email, stored in customer_email_idx) and its tables must exist.
+
+    python benchmarks/lookup_writes.py --rows 10000
+    python benchmarks/lookup_writes.py --port 15306 --vars-url http://localhost:15001/debug/vars
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', '..', '..', 'examples', 'local')
+
+
+def default_vschema():
+    with open(os.path.join(EXAMPLES_DIR, 'vschema_customer_sharded.json')) as f:
+        vschema = json.load(f)
+    vschema['vindexes']['customer_email_idx'] = {
+        'type': 'consistent_lookup_unique',
+        'params': {'table': 'customer.customer_email_idx', 'from': 'email', 'to': 'keyspace_id'},
+        'owner': 'customer',
+    }
+    vschema['tables']['customer']['column_vindexes'].append(
+        {'column': 'email', 'name': 'customer_email_idx'})
+    vschema['tables']['customer_email_idx'] = {
+        'column_vindexes': [{'column': 'email', 'name': 'unicode_loose_md5'}]}
+    vschema['vindexes']['unicode_loose_md5'] = {'type': 'unicode_loose_md5'}
+    return vschema
+
+
+def configure(args, vschema):
+    import django
+    from django.conf import settings
+    settings.configure(
+        DATABASES={'default': {
+            'ENGINE': 'custom_db_backends.vitess',
+            'NAME': args.keyspace,
+            'HOST': args.host,
+            'PORT': args.port or 15306,
+            'USER': args.user,
+            'VITESS': {
+                'VSCHEMA': vschema,
+                'SHARDS': args.shards.split(','),
+                'SEQUENCES': False,
+                'BULK': {'MAX_ROWS': args.max_rows, 'CONCURRENCY': 1},
+            },
+        }},
+        INSTALLED_APPS=[],
+    )
+    django.setup()
+
+
+def queries_routed(vars_url):
+    with urlopen(vars_url) as response:
+        return sum(json.load(response).get('QueriesRouted', {}).values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int,
+                        help="vtgate's MySQL port, to measure instead of estimating")
+    parser.add_argument('--vars-url', help="vtgate's /debug/vars URL")
+    parser.add_argument('--user', default='')
+    parser.add_argument('--keyspace', default='customer')
+    parser.add_argument('--vschema', help='vschema JSON file (default: see above)')
+    parser.add_argument('--shards', default='-80,80-')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--max-rows', type=int, default=500)
+    args = parser.parse_args()
+    if args.port and not args.vars_url:
+        parser.error('--port needs --vars-url')
+    if args.vschema:
+        with open(args.vschema) as f:
+            vschema = json.load(f)
+    else:
+        vschema = default_vschema()
+    configure(args, vschema)
+
+    from django.db import connection, models
+    from custom_db_backends.vitess import bulk
+
+    class Customer(models.Model):
+        customer_id = models.BigIntegerField(primary_key=True)
+        email = models.CharField(max_length=128)
+
+        class Meta:
+            app_label = 'benchmarks'
+            db_table = 'customer'
+            managed = False
+
+    base = random.randint(1 << 40, 1 << 50)
+    objs = [Customer(customer_id=base + i, email='user%d-%d@example.com' % (base, i))
+            for i in range(args.rows)]
+
+    def split(rows):
+        return [objs[i:i + rows] for i in range(0, len(objs), rows)]
+
+    def shard_grouped():
+        connection.bulk_settings()['LOOKUP_BATCHING'] = False
+        try:
+            return bulk.plan_batches(connection, Customer, objs, args.max_rows, 1 << 30)
+        finally:
+            connection.bulk_settings()['LOOKUP_BATCHING'] = True
+
+    plans = [
+        ('per-row save()', split(1)),
+        ('bulk_create (batch_size=max-rows)', split(args.max_rows)),
+        ('bulk.bulk_create by shard', shard_grouped()),
+        ('bulk.bulk_create lookup-aware',
+         bulk.plan_batches(connection, Customer, objs, args.max_rows, 1 << 30)),
+    ]
+    print('%-36s %8s %10s %10s %10s' % ('', 'inserts', 'statements', 'lookups', 'per row'))
+    for name, batches in plans:
+        estimate = bulk.estimate_writes(connection, Customer, batches)
+        if args.port:
+            before = queries_routed(args.vars_url)
+            for batch in batches:
+                Customer.objects.bulk_create(batch, batch_size=len(batch))
+            estimate['statements'] = queries_routed(args.vars_url) - before
+            estimate['lookup_statements'] = float('nan')
+            estimate['statements_per_row'] = estimate['statements'] / estimate['rows']
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM customer WHERE customer_id >= %s AND customer_id < %s',
+                               [base, base + args.rows])
+        print('%-36s %8d %10d %10s %10.3f' % (
+            name, estimate['inserts'], estimate['statements'],
+            estimate['lookup_statements'], estimate['statements_per_row']))
+
+
+if __name__ == '__main__':
+    main()
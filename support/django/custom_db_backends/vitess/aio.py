@@ -0,0 +1,236 @@
+"""
+Asyncio access to vtgate for async views.
+
+Django's async ORM methods still run the sync backend in a thread per query.
+This module talks to vtgate natively from the event loop instead, on top of
+aiomysql, using the settings of a vitess database alias:
+
+    from custom_db_backends.vitess import aio
+
+    customers = await aio.fetch(Customer.objects.filter(email__endswith='@x.com'))
+    rows = await aio.fetchall('SELECT COUNT(*) FROM corder', using='default')
+    results = await asyncio.gather(*(aio.fetch(qs) for qs in querysets))
+
+Each event loop gets its own connection pool per alias, sized by
+VITESS['POOL'], so a worker can have many queries in flight without a thread
+per query. Only plain model querysets (no select_related() or prefetching)
+can be fetched; anything else can be sent as SQL.
+"""
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router
+from django.db import utils
+
+try:
+    import aiomysql
+    import pymysql
+except ImportError as err:
+    raise ImproperlyConfigured(
+        'Error loading aiomysql module.\n'
+        'Did you install aiomysql?'
+    ) from err
+
+from .pool import PoolTimeout
+from .session import SessionState
+
+# Django exceptions, most specific first, with their PEP 249 counterparts.
+_DJANGO_ERRORS = (
+    utils.DataError, utils.OperationalError, utils.IntegrityError,
+    utils.InternalError, utils.ProgrammingError, utils.NotSupportedError,
+    utils.DatabaseError, utils.InterfaceError, utils.Error,
+)
+
+
+@asynccontextmanager
+async def _wrap_database_errors():
+    """Raise driver errors as the matching django.db.utils exceptions."""
+    try:
+        yield
+    except pymysql.Error as exc:
+        for dj_exc_type in _DJANGO_ERRORS:
+            if isinstance(exc, getattr(pymysql.err, dj_exc_type.__name__)):
+                raise dj_exc_type(*exc.args) from exc
+        raise
+
+
+def connect_kwargs(wrapper):
+    """
+    Translate the mysqlclient parameters of `wrapper`, including the
+    init_command of its OPTIONS, for aiomysql.
+    """
+    params = wrapper.get_connection_params()
+    kwargs = {'autocommit': True}
+    for param, kwarg in (('host', 'host'), ('port', 'port'), ('user', 'user'),
+                         ('passwd', 'password'), ('password', 'password'),
+                         ('unix_socket', 'unix_socket'), ('charset', 'charset'),
+                         ('client_flag', 'client_flag'), ('ssl', 'ssl'),
+                         ('init_command', 'init_command')):
+        if param in params:
+            kwargs[kwarg] = params[param]
+    kwargs['db'] = wrapper.settings_dict['NAME']
+    return kwargs
+
+
+def session_setup(wrapper):
+    """
+    Return the statements the sync backend runs on a new connection of
+    `wrapper`: the isolation level, USE of its target and the SET of
+    VITESS['SESSION_VARIABLES'] and the transaction mode.
+    """
+    statements = []
+    if wrapper.isolation_level:
+        statements.append('SET SESSION TRANSACTION ISOLATION LEVEL %s' %
+                          wrapper.isolation_level.upper())
+    state = SessionState(wrapper.settings_dict['NAME'])
+    statements.extend(state.delta(wrapper.get_target(), wrapper.session_values()))
+    return statements
+
+
+class AsyncConnectionPool(object):
+    """
+    An aiomysql pool bound to one event loop, with an acquire timeout. The
+    `setup` statements run once on each new connection.
+    """
+
+    def __init__(self, connect_kwargs, setup=(), max_size=10, timeout=30,
+                 max_lifetime=3600):
+        self.connect_kwargs = connect_kwargs
+        self.setup = list(setup)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self._pool = None
+        self._lock = asyncio.Lock()
+
+    async def _get_pool(self):
+        async with self._lock:
+            if self._pool is None:
+                self._pool = await aiomysql.create_pool(
+                    minsize=0, maxsize=self.max_size, pool_recycle=self.max_lifetime,
+                    **self.connect_kwargs)
+            return self._pool
+
+    @asynccontextmanager
+    async def acquire(self):
+        pool = await self._get_pool()
+        try:
+            connection = await asyncio.wait_for(pool.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(
+                'Timed out after %ss waiting for one of %d connections.' %
+                (self.timeout, self.max_size))
+        try:
+            if not getattr(connection, 'vitess_setup_done', False):
+                async with connection.cursor() as cursor:
+                    for statement in self.setup:
+                        await cursor.execute(statement)
+                connection.vitess_setup_done = True
+            yield connection
+        except BaseException:
+            if not getattr(connection, 'vitess_setup_done', False):
+                # Never hand out a connection whose session isn't set up.
+                connection.close()
+            raise
+        finally:
+            pool.release(connection)
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_async_pool(using='default'):
+    """Return the AsyncConnectionPool of `using` for the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        pool = _pools.get((using, loop))
+        if pool is None:
+            wrapper = connections[using]
+            options = wrapper.get_pool_options() or {}
+            options.pop('health_check_interval', None)
+            pool = _pools[using, loop] = AsyncConnectionPool(
+                connect_kwargs(wrapper), session_setup(wrapper), **options)
+        return pool
+
+
+async def close_async_pools():
+    """Close the pools of the running event loop, e.g. on ASGI shutdown."""
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        keys = [key for key in _pools if key[1] is loop]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        await pool.close()
+
+
+def _normalize(using, sql, params):
+    normalizer = connections[using].normalizer
+    if normalizer is None:
+        return sql, params
+    return normalizer.normalize(sql, params)
+
+
+async def execute(sql, params=None, using='default'):
+    """Execute `sql` and return its row count."""
+    sql, params = _normalize(using, sql, params)
+    async with _wrap_database_errors(), get_async_pool(using).acquire() as connection:
+        async with connection.cursor() as cursor:
+            return await cursor.execute(sql, params)
+
+
+async def fetchall(sql, params=None, using='default'):
+    """Execute `sql` and return all its rows as tuples."""
+    sql, params = _normalize(using, sql, params)
+    async with _wrap_database_errors(), get_async_pool(using).acquire() as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(sql, params)
+            return await cursor.fetchall()
+
+
+async def fetchone(sql, params=None, using='default'):
+    """Execute `sql` and return its first row, or None."""
+    rows = await fetchall(sql, params, using)
+    return rows[0] if rows else None
+
+
+async def fetch(queryset):
+    """Evaluate a model `queryset` and return the list of its instances."""
+    if queryset.query.select_related or queryset._prefetch_related_lookups:
+        raise ValueError('aio.fetch() does not support select_related() or '
+                         'prefetch_related().')
+    using = queryset._db or router.db_for_read(queryset.model)
+    compiler = queryset.query.get_compiler(using=using)
+    sql, params = compiler.as_sql()
+    rows = await fetchall(sql, params, using)
+    select, klass_info = compiler.select, compiler.klass_info
+    annotation_col_map = compiler.annotation_col_map
+    start = klass_info['select_fields'][0]
+    end = klass_info['select_fields'][-1] + 1
+    init_list = [column[0].target.attname for column in select[start:end]]
+    model = klass_info['model']
+    objs = []
+    for row in compiler.results_iter([rows]):
+        obj = model.from_db(using, init_list, row[start:end])
+        for attr_name, col_pos in annotation_col_map.items():
+            setattr(obj, attr_name, row[col_pos])
+        objs.append(obj)
+    return objs
+
+
+async def count(queryset):
+    """Return queryset.count() without blocking the event loop."""
+    using = queryset._db or router.db_for_read(queryset.model)
+    query = queryset.query.chain()
+    query.clear_ordering(True)
+    sql, params = query.get_compiler(using=using).as_sql()
+    row = await fetchone('SELECT COUNT(*) FROM (%s) subquery' % sql, params, using)
+    return row[0]
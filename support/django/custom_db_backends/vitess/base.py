@@ -1,9 +1,457 @@
-from django.db.backends.mysql.base import DatabaseWrapper as MysqlDatabaseWrapper
+import json
+import os
+from contextlib import contextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.transaction import TransactionManagementError
+from django.db.backends.mysql.base import CursorWrapper, DatabaseWrapper as MysqlDatabaseWrapper
+from django.utils.functional import cached_property
+
+from .cache import CachingCursor, get_cache
 from .features import DatabaseFeatures
+from .instrumentation import QueryInstrumentation, get_collector
+from .operations import DatabaseOperations
+from .keyrange import ShardResolver
+from .normalize import get_normalizer
+from .pipeline import Pipeline
+from .planner import Planner, ScatterQueryError
+from .pool import get_pool
+from .session import SessionState, SessionTracker, literal
+from .streaming import StreamingCursor
+from .vschema import load_keyspace
+
+TRANSACTION_MODES = ('SINGLE', 'MULTI', 'TWOPC')
+
 
 class DatabaseWrapper(MysqlDatabaseWrapper):
     vendor = 'vitess'
 
     def __init__(self, *args, **kwargs):
         super(DatabaseWrapper, self).__init__(*args, **kwargs)
-        self.features = DatabaseFeatures(self)
\ No newline at end of file
+        self.features = DatabaseFeatures(self)
+        self.ops = DatabaseOperations(self)
+        self.vitess_settings = self.settings_dict.get('VITESS') or {}
+        self.pool = None
+        self.pooled_connection = None
+        self.session_state = None
+        self.current_transaction_mode = self.validate_transaction_mode(
+            self.vitess_settings.get('TRANSACTION_MODE', 'SINGLE'))
+        self.query_collector = None
+        self.normalizer = None
+        self.result_cache = None
+        self.execute_wrappers.append(SessionTracker(self))
+        normalize = self.vitess_settings.get('NORMALIZE')
+        if normalize:
+            self.install_normalizer({} if normalize is True else normalize)
+        instrument = self.vitess_settings.get('INSTRUMENT')
+        if instrument:
+            self.install_instrumentation({} if instrument is True else instrument)
+        cache = self.vitess_settings.get('CACHE')
+        if cache:
+            self.install_result_cache(cache)
+
+    def install_normalizer(self, normalize_settings):
+        """
+        Rewrite the statements of this connection through the process-wide
+        Normalizer of its alias; see normalize.py and VITESS['NORMALIZE'].
+        """
+        self.normalizer = get_normalizer(
+            self.alias,
+            bind_literals=normalize_settings.get('BIND_LITERALS', True),
+            pad_in_lists=normalize_settings.get('PAD_IN_LISTS', True),
+            max_templates=normalize_settings.get('CACHE_SIZE', 1000))
+        self.execute_wrappers.append(self.normalizer)
+
+    def install_instrumentation(self, instrument_settings):
+        """
+        Record every query of this connection in the process-wide collector of
+        its alias; see instrumentation.py and VITESS['INSTRUMENT'].
+        """
+        self.query_collector = get_collector(
+            self.alias, explain=instrument_settings.get('EXPLAIN', True))
+        shard_count = None
+        if 'SHARDS' in self.vitess_settings or 'SRV_KEYSPACE' in self.vitess_settings:
+            shard_count = len(self.shard_resolver.shards)
+        self.execute_wrappers.append(
+            QueryInstrumentation(self.query_collector, shard_count))
+
+    def install_result_cache(self, cache_settings):
+        """
+        Cache the results of queries reading only the tables allow-listed in
+        VITESS['CACHE'], in the process-wide ResultCache of this alias; see
+        cache.py.
+        """
+        tables = set(cache_settings.get('TABLES', ()))
+        if cache_settings.get('REFERENCE_TABLES', True) and 'VSCHEMA' in self.vitess_settings:
+            tables.update(name for name, table in self.vschema.tables.items()
+                          if table.type == 'reference')
+        self.result_cache = get_cache(
+            self.alias, tables=tables, ttl=cache_settings.get('TTL', 60),
+            max_entries=cache_settings.get('MAX_ENTRIES', 1000))
+
+    def bulk_settings(self):
+        return self.vitess_settings.get('BULK') or {}
+
+    def bulk_limits(self):
+        """Return the (rows, bytes) caps of a single bulk INSERT."""
+        bulk_settings = self.bulk_settings()
+        return (bulk_settings.get('MAX_ROWS', 500),
+                bulk_settings.get('MAX_BYTES', 1024 * 1024))
+
+    def get_pool_options(self):
+        """
+        Translate the VITESS['POOL'] settings into ConnectionPool arguments,
+        or return None if pooling is disabled.
+        """
+        pool_settings = self.vitess_settings.get('POOL')
+        if not pool_settings:
+            return None
+        if pool_settings is True:
+            pool_settings = {}
+        options = {}
+        for setting, option in (('MAX_SIZE', 'max_size'),
+                                ('TIMEOUT', 'timeout'),
+                                ('MAX_LIFETIME', 'max_lifetime'),
+                                ('HEALTH_CHECK_INTERVAL', 'health_check_interval')):
+            if setting in pool_settings:
+                options[option] = pool_settings[setting]
+        return options
+
+    @property
+    def transport(self):
+        """'mysql' (the default) or 'grpc', see VITESS['TRANSPORT']."""
+        return self.vitess_settings.get('TRANSPORT', 'mysql')
+
+    def get_new_connection(self, conn_params):
+        pool_options = self.get_pool_options()
+        if pool_options is None:
+            connection = self.connect_unpooled(conn_params)
+            self.session_state = self.new_session_state()
+            return connection
+        # A forked process must not share the pool of its parent.
+        if (self.pool is None or self.pool.pid != os.getpid() or
+                self.pool.params != conn_params):
+            connect = self.connect_unpooled
+            self.pool = get_pool(self.alias, lambda: connect(conn_params),
+                                 params=conn_params, **pool_options)
+        self.pooled_connection = self.acquire_pooled()
+        self.session_state = self.pooled_connection.session
+        return self.pooled_connection.connection
+
+    def acquire_pooled(self, values=None):
+        """
+        Acquire a connection from the pool whose session can be taken back
+        to get_target() and `values` (by default session_values()),
+        discarding those whose session state is unknown.
+        """
+        if values is None:
+            values = self.session_values()
+        while True:
+            entry = self.pool.acquire()
+            if entry.session is None:
+                entry.session = self.new_session_state()
+            if entry.session.delta(self.get_target(), values) is not None:
+                return entry
+            self.pool.release(entry, discard=True)
+
+    def new_session_state(self):
+        """The SessionState of a connection that was just opened."""
+        if self.transport == 'grpc':
+            return SessionState(self.get_target())
+        return SessionState(self.settings_dict['NAME'])
+
+    def session_values(self):
+        """
+        The session variables the connection should have, from
+        VITESS['SESSION_VARIABLES'] and the current transaction mode, as SQL
+        literals.
+        """
+        variables = self.vitess_settings.get('SESSION_VARIABLES') or {}
+        values = {name.lower(): literal(value) for name, value in variables.items()}
+        if self.current_transaction_mode is not None:
+            values['transaction_mode'] = literal(self.current_transaction_mode)
+        return values
+
+    def sync_session_values(self):
+        """Send the SET statements bringing the session to session_values()."""
+        if self.connection is None:
+            # init_connection_state() will.
+            return
+        statements = self.session_state.delta(None, self.session_values())
+        if statements is None:
+            raise self.Database.InterfaceError(
+                0, 'The session state of the connection is unknown.')
+        if statements:
+            with self.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+
+    def validate_transaction_mode(self, mode):
+        if mode is None:
+            return None
+        if mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                "Unknown vtgate transaction mode %r, use one of %s." %
+                (mode, ', '.join(TRANSACTION_MODES)))
+        return mode.upper()
+
+    @contextmanager
+    def transaction_mode(self, mode):
+        """
+        Run the transactions of the block in vtgate transaction mode `mode`:
+        'SINGLE' (the default of VITESS['TRANSACTION_MODE']) fails
+        transactions writing to more than one shard, 'MULTI' commits the
+        shards one after the other, 'TWOPC' uses two-phase commit.
+        """
+        mode = self.validate_transaction_mode(mode)
+        if self.in_atomic_block and mode != self.current_transaction_mode:
+            raise TransactionManagementError(
+                "The transaction mode can't change inside atomic().")
+        previous, self.current_transaction_mode = self.current_transaction_mode, mode
+        try:
+            self.sync_session_values()
+            yield
+        finally:
+            self.current_transaction_mode = previous
+            if not self.in_atomic_block:
+                self.sync_session_values()
+
+    def connect_grpc(self):
+        """
+        Open a vtgate_grpc.Connection to VITESS['GRPC']['ADDRESS'], or to
+        HOST:PORT.
+        """
+        # Imported here since grpcio and the generated modules are optional.
+        from . import vtgate_grpc
+        grpc_settings = self.vitess_settings.get('GRPC') or {}
+        decoder = vtgate_grpc.decode_rows
+        if grpc_settings.get('DECODER') == 'columnar':
+            from .columnar import decode_lazy as decoder
+        address = grpc_settings.get('ADDRESS') or '%s:%s' % (
+            self.settings_dict['HOST'] or 'localhost', self.settings_dict['PORT'] or 15991)
+        return vtgate_grpc.connect(address, self.get_target(),
+                                   user=self.settings_dict['USER'],
+                                   timeout=grpc_settings.get('TIMEOUT'),
+                                   credentials=grpc_settings.get('CREDENTIALS'),
+                                   options=grpc_settings.get('OPTIONS'),
+                                   decoder=decoder)
+
+    def create_cursor(self, name=None):
+        cursor = super(DatabaseWrapper, self).create_cursor(name)
+        if self.result_cache is not None:
+            cursor = CachingCursor(self, cursor, self.result_cache)
+        return cursor
+
+    def connect_unpooled(self, conn_params=None):
+        """Open a new connection that is neither pooled nor self.connection."""
+        if self.transport == 'grpc':
+            return self.connect_grpc()
+        if conn_params is None:
+            conn_params = self.get_connection_params()
+        return super(DatabaseWrapper, self).get_new_connection(conn_params)
+
+    def chunked_cursor(self):
+        """
+        Return a StreamingCursor for QuerySet.iterator() if VITESS['STREAMING']
+        is set. Inside a transaction the regular cursor is used, so that the
+        scan sees the transaction's writes.
+        """
+        if not self.vitess_settings.get('STREAMING') or not self.get_autocommit():
+            return super(DatabaseWrapper, self).chunked_cursor()
+        self.ensure_connection()
+        with self.wrap_database_errors:
+            if self.transport == 'grpc':
+                # StreamExecute streams without tying up the session.
+                return self._prepare_cursor(CursorWrapper(self.connection.cursor(stream=True)))
+            return self._prepare_cursor(StreamingCursor(self))
+
+    @property
+    def tablet_type(self):
+        """The tablet type this alias reads from, or None for the primary."""
+        return self.vitess_settings.get('TABLET_TYPE')
+
+    def get_target(self, shard=None):
+        """
+        Return the vtgate target string of this alias, e.g. 'commerce@replica',
+        or of one of its shards, e.g. 'customer:-80@replica'.
+        """
+        target = self.settings_dict['NAME']
+        if shard:
+            target = '%s:%s' % (target, shard)
+        if self.tablet_type:
+            target = '%s@%s' % (target, self.tablet_type)
+        return target
+
+    @contextmanager
+    def use_target(self, target):
+        """Run the block against `target`, then switch back to get_target()."""
+        with self.cursor() as cursor:
+            cursor.execute('USE `%s`' % target)
+        try:
+            yield
+        finally:
+            with self.cursor() as cursor:
+                cursor.execute('USE `%s`' % self.get_target())
+
+    @cached_property
+    def vschema(self):
+        """The vschema.Keyspace loaded from VITESS['VSCHEMA']."""
+        vschema = self.vitess_settings.get('VSCHEMA')
+        if vschema is None:
+            raise ImproperlyConfigured(
+                "Set VITESS['VSCHEMA'] of database '%s' to the keyspace's "
+                "vschema (a dict or the path of a JSON file)." % self.alias)
+        return load_keyspace(self.settings_dict['NAME'], vschema)
+
+    @cached_property
+    def shard_resolver(self):
+        """
+        The ShardResolver built from VITESS['SHARDS'], a list of shard names,
+        or from VITESS['SRV_KEYSPACE'], a SrvKeyspace dict or JSON file.
+        """
+        shards = self.vitess_settings.get('SHARDS')
+        if shards:
+            return ShardResolver(shards)
+        srv_keyspace = self.vitess_settings.get('SRV_KEYSPACE')
+        if srv_keyspace is None:
+            raise ImproperlyConfigured(
+                "Set VITESS['SHARDS'] or VITESS['SRV_KEYSPACE'] of database "
+                "'%s' to resolve shards." % self.alias)
+        if not isinstance(srv_keyspace, dict):
+            with open(srv_keyspace) as f:
+                srv_keyspace = json.load(f)
+        return ShardResolver.from_srv_keyspace(srv_keyspace,
+                                               self.tablet_type or 'master')
+
+    @cached_property
+    def planner(self):
+        """
+        The Planner predicting the routes of statements from VITESS['VSCHEMA']
+        and, if configured, the shards of the keyspace.
+        """
+        keyspace = self.settings_dict['NAME']
+        shards = {}
+        if self.vitess_settings.get('SHARDS') or self.vitess_settings.get('SRV_KEYSPACE'):
+            shards[keyspace] = self.shard_resolver
+        return Planner({keyspace: self.vschema}, shards)
+
+    def route(self, sql, params=None):
+        """
+        Return the planner.Route vtgate is expected to take for `sql`, or
+        None if it can't be predicted.
+        """
+        return self.planner.route(sql, params)
+
+    @contextmanager
+    def forbid_scatter(self):
+        """
+        Raise ScatterQueryError instead of running the statements of the
+        block predicted to scatter, e.g. around the code of a test.
+        """
+        def check(execute, sql, params, many, context):
+            route = self.route(sql, None if many else params)
+            if route is not None and route.scatter:
+                raise ScatterQueryError(
+                    'Statement scatters over table %s.%s: %s' %
+                    (route.keyspace, route.table, sql))
+            return execute(sql, params, many, context)
+
+        with self.execute_wrapper(check):
+            yield
+
+    def keyspace_ids(self, table, values):
+        """
+        Return the keyspace ids of `values` of the primary vindex column of
+        `table`. Vindexes that can't be computed client-side are resolved
+        through vtgate's vindex functions.
+        """
+        column_vindex = self.vschema.table(table).primary_vindex
+        if column_vindex is None:
+            raise ValueError("Table '%s' has no primary vindex." % table)
+        vindex = column_vindex.vindex
+        if vindex.client_side:
+            return vindex.map(values)
+        keyspace_ids = []
+        with self.cursor() as cursor:
+            for value in values:
+                cursor.execute(
+                    'SELECT keyspace_id FROM `%s` WHERE id = %%s' % vindex.name,
+                    [value])
+                rows = cursor.fetchall()
+                keyspace_ids.append(rows[0][0] if len(rows) == 1 else None)
+        return keyspace_ids
+
+    def shard_for(self, table, value):
+        """
+        Return the shard holding the rows of `table` whose primary vindex
+        column is `value`.
+        """
+        if not self.vschema.sharded:
+            return self.shard_resolver.shards[0]
+        keyspace_id = self.keyspace_ids(table, [value])[0]
+        if keyspace_id is None:
+            raise ValueError("%r doesn't map to a single keyspace id of table '%s'." %
+                             (value, table))
+        return self.shard_resolver.shard_for_keyspace_id(keyspace_id)
+
+    @contextmanager
+    def pinned_to(self, table, value):
+        """
+        Send the queries of the block straight to the shard holding `value`,
+        e.g. `with connection.pinned_to('customer', 42):`, so vtgate doesn't
+        have to plan a scatter.
+        """
+        with self.use_target(self.get_target(self.shard_for(table, value))):
+            yield
+
+    @contextmanager
+    def pipeline(self, as_transaction=False):
+        """
+        Buffer the writes added to the yielded Pipeline and send them when
+        the block exits, in one ExecuteBatch round-trip with the gRPC
+        transport; see pipeline.py.
+        """
+        if as_transaction and self.in_atomic_block:
+            raise TransactionManagementError(
+                "A pipeline can't run as its own transaction inside atomic().")
+        pipe = Pipeline(self, as_transaction)
+        yield pipe
+        pipe.flush()
+
+    def init_connection_state(self):
+        state = self.session_state
+        if not state.initialized:
+            before = dict(state.values)
+            super(DatabaseWrapper, self).init_connection_state()
+            state.mark_initialized(before)
+        # Only what the previous user of a pooled connection changed is
+        # reset, which usually takes no statement at all.
+        statements = state.delta(self.get_target(), self.session_values())
+        if statements is None:
+            raise self.Database.InterfaceError(
+                0, 'The session state of the connection is unknown.')
+        if statements:
+            with self.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+
+    def _close(self):
+        self.session_state = None
+        if self.pooled_connection is None:
+            return super(DatabaseWrapper, self)._close()
+        entry, self.pooled_connection = self.pooled_connection, None
+        discard = self.errors_occurred and not self.is_usable()
+        if not discard and not self.autocommit:
+            # Never hand a connection with an open transaction to the next
+            # request.
+            try:
+                entry.connection.rollback()
+            except self.Database.Error:
+                discard = True
+        self.pool.release(entry, discard=discard)
+
+    def pool_stats(self):
+        """Return the stats of this alias' connection pool, if any."""
+        if self.pool is None:
+            return None
+        return self.pool.stats()
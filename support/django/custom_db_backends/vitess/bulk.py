@@ -0,0 +1,306 @@
+"""
+Shard-aware bulk inserts.
+
+bulk_create() here groups the objects by the shard their primary vindex
+column maps to, so every INSERT vtgate receives targets a single shard and
+doesn't have to be split, caps each statement by rows and estimated bytes,
+and sends the batches of different shards concurrently from a thread pool
+(each thread using its own, ideally pooled, connection). Ids backed by a
+vitess sequence are assigned beforehand from blocks reserved client-side,
+see sequences.py.
+
+Tables owning lookup vindexes are the exception: vtgate writes the lookup
+rows of an INSERT with one multi-row statement per lookup vindex, split
+between the shards of the lookup table. When the rows of each shard are
+fewer than a batch, grouping by shard multiplies those writes, so for such
+tables the batches may span all shards instead, whichever takes fewer
+statements according to estimate_writes().
+
+Each INSERT runs in a transaction, which vtgate's SINGLE transaction mode
+(the default of VITESS['TRANSACTION_MODE']) rejects once it writes to more
+than one shard: batches spanning shards, or whose shards are unknown, and
+the INSERTs of tables owning lookup vindexes that aren't consistent ones
+(their lookup rows are written in the same transaction) run in MULTI mode.
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.db import connections, router
+
+from .sequences import assign_sequence_values
+
+# Per-value overhead of the INSERT syntax: quotes, comma and space.
+VALUE_OVERHEAD_BYTES = 4
+
+
+def estimate_row_bytes(obj, fields):
+    """Estimate the size of the VALUES tuple of `obj` in an INSERT."""
+    size = 2
+    for field in fields:
+        value = getattr(obj, field.attname, None)
+        if value is None:
+            size += 4 + VALUE_OVERHEAD_BYTES
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            # Binary values are sent hex-encoded.
+            size += 2 * len(value) + VALUE_OVERHEAD_BYTES
+        else:
+            size += len(str(value)) + VALUE_OVERHEAD_BYTES
+    return size
+
+
+def split_batches(objs, fields, max_rows, max_bytes):
+    """Split `objs` into lists of at most `max_rows` rows and ~`max_bytes`."""
+    batch = []
+    batch_bytes = 0
+    for obj in objs:
+        row_bytes = estimate_row_bytes(obj, fields)
+        if batch and (len(batch) >= max_rows or batch_bytes + row_bytes > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(obj)
+        batch_bytes += row_bytes
+    if batch:
+        yield batch
+
+
+def vindex_field(connection, model):
+    """
+    Return the model field stored in the primary vindex column of the
+    model's table, or None if the vschema doesn't let us compute it.
+    """
+    if not connection.vitess_settings.get('VSCHEMA') or not connection.vschema.sharded:
+        return None
+    table = connection.vschema.tables.get(model._meta.db_table)
+    if table is None or table.primary_vindex is None:
+        return None
+    if not table.primary_vindex.vindex.client_side:
+        return None
+    for field in model._meta.concrete_fields:
+        if field.column == table.primary_vindex.column:
+            return field
+    return None
+
+
+def group_by_shard(connection, model, objs):
+    """
+    Return an OrderedDict of shard name to objects. Objects whose shard can't
+    be computed client-side are grouped under None and left to vtgate.
+    """
+    groups = OrderedDict()
+    field = vindex_field(connection, model)
+    if field is None:
+        groups[None] = list(objs)
+        return groups
+    values = [getattr(obj, field.attname) for obj in objs]
+    keyspace_ids = connection.keyspace_ids(model._meta.db_table, values)
+    resolver = connection.shard_resolver
+    for obj, keyspace_id in zip(objs, keyspace_ids):
+        shard = None
+        if keyspace_id is not None:
+            shard = resolver.shard_for_keyspace_id(keyspace_id)
+        groups.setdefault(shard, []).append(obj)
+    return groups
+
+
+def lookup_aware(connection, model):
+    """
+    Whether inserts into the model's table write to lookup vindexes it
+    owns, unless VITESS['BULK']['LOOKUP_BATCHING'] is False.
+    """
+    if not connection.bulk_settings().get('LOOKUP_BATCHING', True):
+        return False
+    if not connection.vitess_settings.get('VSCHEMA'):
+        return False
+    table = connection.vschema.tables.get(model._meta.db_table)
+    return table is not None and bool(table.owned_vindexes)
+
+
+def _single_transaction_mode(connection):
+    """
+    Whether the INSERTs of `connection` must stay on one shard: in SINGLE
+    mode inside atomic(), where the mode can't be switched to MULTI.
+    """
+    return connection.in_atomic_block and connection.current_transaction_mode == 'SINGLE'
+
+
+def _plan(connection, model, objs, max_rows, max_bytes):
+    """Return the batches of plan_batches() and the shard of each object by id()."""
+    fields = model._meta.concrete_fields
+    groups = group_by_shard(connection, model, objs)
+    shards = {id(obj): shard for shard, group in groups.items() for obj in group}
+    batches = _interleave(split_batches(group, fields, max_rows, max_bytes)
+                          for group in groups.values())
+    if (len(groups) == 1 or not lookup_aware(connection, model) or
+            _single_transaction_mode(connection)):
+        return batches, shards
+    spanning = list(split_batches(objs, fields, max_rows, max_bytes))
+    if (estimate_writes(connection, model, spanning, shards)['statements'] <
+            estimate_writes(connection, model, batches, shards)['statements']):
+        return spanning, shards
+    return batches, shards
+
+
+def plan_batches(connection, model, objs, max_rows, max_bytes):
+    """
+    Return the batches, one INSERT each, bulk_create() sends for `objs`:
+    per shard, or for lookup-aware tables whichever of per shard and
+    spanning all shards takes vtgate fewer statements. Inside
+    atomic() in SINGLE transaction mode the batches never span shards.
+    """
+    return _plan(connection, model, objs, max_rows, max_bytes)[0]
+
+
+def _lookup_shards(connection, vindex, rows, shard_count):
+    """
+    Estimate the shards vtgate writes `rows` rows of the lookup `vindex`
+    to: those of this keyspace if the lookup table is one of its sharded
+    tables, else a single one.
+    """
+    keyspace, _, table = vindex.params.get('table', '').rpartition('.')
+    if (shard_count is None or not connection.vschema.sharded or
+            keyspace not in ('', connection.vschema.name) or
+            table not in connection.vschema.tables):
+        return 1
+    return min(rows, shard_count)
+
+
+def _consistent(vindex):
+    """Whether vtgate writes the rows of the lookup `vindex` in transactions of their own."""
+    return (vindex.vindex_type or '').startswith('consistent_lookup')
+
+
+class _WriteModel(object):
+    """What estimate_writes() and bulk_create() need to know of a table's INSERTs."""
+
+    def __init__(self, connection, model):
+        self.connection = connection
+        table = None
+        self.sharded = None
+        if connection.vitess_settings.get('VSCHEMA'):
+            table = connection.vschema.tables.get(model._meta.db_table)
+            self.sharded = connection.vschema.sharded
+        self.lookups = ([column_vindex.vindex for column_vindex in table.owned_vindexes]
+                        if table else [])
+        self.shard_count = None
+        if 'SHARDS' in connection.vitess_settings or 'SRV_KEYSPACE' in connection.vitess_settings:
+            self.shard_count = len(connection.shard_resolver.shards)
+
+    def batch_shards(self, batch, shards):
+        """Return the number of shards of `batch`, and whether it is a guess."""
+        batch_shards = {shards.get(id(obj)) for obj in batch} if shards else {None}
+        if None in batch_shards:
+            return min(len(batch), self.shard_count or 1), True
+        return len(batch_shards), False
+
+    def lookup_shards(self, batch):
+        """Return the (vindex, shards written) of the lookups of `batch`."""
+        return [(vindex, _lookup_shards(self.connection, vindex, len(batch), self.shard_count))
+                for vindex in self.lookups]
+
+    def spans_shards(self, batch, shards):
+        """
+        Whether the transaction of the INSERT of `batch` may write to more
+        than one shard: its rows, or the rows of lookups that aren't
+        consistent ones, which are written in the same transaction.
+        """
+        batch_shards, guessed = self.batch_shards(batch, shards)
+        if guessed and len(batch) > 1 and self.sharded is not False:
+            return True
+        return batch_shards + sum(count for vindex, count in self.lookup_shards(batch)
+                                  if not _consistent(vindex)) > 1
+
+
+def estimate_writes(connection, model, batches, shards=None):
+    """
+    Return the number of rows, of INSERTs, of statements vtgate sends to
+    the tablets for them (one per shard an INSERT or its lookup writes
+    touch), of those, lookup vindex writes, and of INSERTs whose
+    transaction may span shards, which bulk_create() runs in MULTI
+    transaction mode. `shards` maps the id() of objects to their shard, if
+    known.
+    """
+    writes = _WriteModel(connection, model)
+    estimate = {'rows': 0, 'inserts': 0, 'statements': 0, 'lookup_statements': 0,
+                'multi_shard_inserts': 0}
+    for batch in batches:
+        batch_shards, _ = writes.batch_shards(batch, shards)
+        lookup_statements = sum(count for _, count in writes.lookup_shards(batch))
+        estimate['rows'] += len(batch)
+        estimate['inserts'] += 1
+        estimate['statements'] += batch_shards + lookup_statements
+        estimate['lookup_statements'] += lookup_statements
+        estimate['multi_shard_inserts'] += writes.spans_shards(batch, shards)
+    if estimate['rows']:
+        estimate['statements_per_row'] = estimate['statements'] / estimate['rows']
+    return estimate
+
+
+def _interleave(groups):
+    """Order batches round-robin across shards so they run concurrently."""
+    pending = deque(deque(batches) for batches in groups)
+    result = []
+    while pending:
+        batches = pending.popleft()
+        if batches:
+            result.append(batches.popleft())
+            pending.append(batches)
+    return result
+
+
+def bulk_create(model, objs, using=None, max_rows=None, max_bytes=None,
+                concurrency=None, **kwargs):
+    """
+    Insert `objs` like model.objects.bulk_create(), with one INSERT per
+    batch of plan_batches() and up to `concurrency` INSERTs in flight. The
+    limits default to VITESS['BULK'] of the database. Unlike bulk_create(),
+    the batches don't share a transaction; those spanning shards run in
+    MULTI transaction mode. In an atomic() block, the batches run one after
+    the other in the caller's transaction (and mode), since the connections
+    of other threads aren't part of it.
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    default_rows, default_bytes = connection.bulk_limits()
+    max_rows = max_rows or default_rows
+    max_bytes = max_bytes or default_bytes
+    if concurrency is None:
+        concurrency = connection.bulk_settings().get('CONCURRENCY', 4)
+    # With the ids known up front, rows whose primary vindex column is the
+    # id can be grouped by shard too.
+    assign_sequence_values(model, objs, using)
+    batches, shards = _plan(connection, model, objs, max_rows, max_bytes)
+    writes = _WriteModel(connection, model)
+    spanning = {id(batch) for batch in batches if writes.spans_shards(batch, shards)}
+    in_atomic_block = connection.in_atomic_block
+
+    def insert(batch):
+        batch_connection = connections[using]
+        mode = nullcontext()
+        if (id(batch) in spanning and batch_connection.current_transaction_mode == 'SINGLE' and
+                not in_atomic_block):
+            mode = batch_connection.transaction_mode('MULTI')
+        with mode:
+            model._default_manager.using(using).bulk_create(
+                batch, batch_size=len(batch), **kwargs)
+
+    if concurrency <= 1 or len(batches) == 1 or in_atomic_block:
+        for batch in batches:
+            insert(batch)
+        return objs
+
+    def insert_in_thread(batch):
+        try:
+            insert(batch)
+        finally:
+            # Hand the thread's connection back (to the pool, if enabled).
+            connections[using].close()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(insert_in_thread, batch) for batch in batches]:
+            future.result()
+    return objs
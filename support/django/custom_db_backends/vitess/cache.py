@@ -0,0 +1,253 @@
+"""
+Opt-in read-through cache of query results.
+
+Only SELECTs reading nothing but allow-listed tables (typically the
+reference and lookup tables of the vschema, which rarely change) are cached,
+keyed by the session target (e.g. keyspace@replica or keyspace:shard),
+their SQL and parameters, for at most TTL seconds and in an LRU of
+at most MAX_ENTRIES results per process. Any other statement touching a
+cached table through the vitess backend of this process invalidates the
+results read from that table; writes by other processes are only picked up
+once the TTL expires.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .sqlutil import referenced_tables, statement_type
+
+# Statements that can't modify tables.
+READ_STATEMENTS = frozenset(('SELECT', 'SHOW', 'EXPLAIN', 'DESCRIBE', 'DESC', 'USE', 'SET'))
+
+
+class CachedResult(object):
+    __slots__ = ('tables', 'description', 'rows', 'rowcount', 'expires_at')
+
+    def __init__(self, tables, description, rows, rowcount, expires_at):
+        self.tables = tables
+        self.description = description
+        self.rows = rows
+        self.rowcount = rowcount
+        self.expires_at = expires_at
+
+
+class ResultCache(object):
+    """Thread-safe TTL + LRU cache of the results of allow-listed tables."""
+
+    def __init__(self, tables=(), ttl=60, max_entries=1000):
+        self.tables = frozenset(table.lower() for table in tables)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_table = {}
+        # Bumped on every invalidation of a table, so that a result read
+        # while a write was going on isn't cached.
+        self._generations = {}
+        self._counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def cacheable_tables(self, sql):
+        """
+        Return the tables read by `sql` if its result may be cached, else
+        None.
+        """
+        if statement_type(sql) != 'SELECT' or 'FOR UPDATE' in sql.upper():
+            return None
+        tables = referenced_tables(sql)
+        if not tables or not tables <= self.tables:
+            return None
+        return frozenset(tables)
+
+    def generation(self, tables):
+        with self._lock:
+            return tuple(self._generations.get(table, 0) for table in sorted(tables))
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry
+
+    def set(self, key, tables, generation, description, rows, rowcount):
+        """
+        Cache a result, unless its tables changed since `generation`, and
+        return it as a CachedResult.
+        """
+        result = CachedResult(tables, description, rows, rowcount,
+                              time.monotonic() + self.ttl)
+        with self._lock:
+            if generation != tuple(self._generations.get(table, 0)
+                                   for table in sorted(tables)):
+                return result
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = result
+            for table in tables:
+                self._keys_by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        return result
+
+    def invalidate(self, tables):
+        """Drop the cached results read from any of `tables`."""
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+                for key in list(self._keys_by_table.get(table, ())):
+                    self._remove(key)
+                    self._counters['invalidations'] += 1
+
+    def invalidate_statement(self, sql, connection=None):
+        """
+        Drop the cached results of the tables `sql` may modify. When `sql`
+        runs in an atomic() block of `connection`, they are dropped again
+        once it commits: until then, other connections still read the rows
+        it replaces, and may cache them.
+        """
+        if statement_type(sql) not in READ_STATEMENTS:
+            tables = referenced_tables(sql) & self.tables
+            if tables:
+                self.invalidate(tables)
+                if connection is not None and connection.in_atomic_block:
+                    connection.on_commit(lambda: self.invalidate(tables))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for table in entry.tables:
+            keys = self._keys_by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_table[table]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_table.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            return stats
+
+
+class CachingCursor(object):
+    """
+    Wrap a backend cursor so that cacheable SELECTs are answered from, or
+    stored in, a ResultCache, and writes invalidate it.
+    """
+
+    def __init__(self, wrapper, cursor, cache):
+        self.wrapper = wrapper
+        self.cursor = cursor
+        self.cache = cache
+        self._result = None
+        self._position = 0
+
+    def execute(self, query, args=None):
+        self._result = None
+        if self.wrapper.in_atomic_block:
+            # Transactions may read their own, uncommitted writes.
+            return self._execute_uncached(query, args)
+        tables = self.cache.cacheable_tables(query)
+        if tables is None:
+            return self._execute_uncached(query, args)
+        # The same statement reads other rows on another keyspace, shard or
+        # tablet type.
+        state = self.wrapper.session_state
+        target = state.target if state is not None else self.wrapper.get_target()
+        try:
+            key = (target, query, tuple(args) if isinstance(args, list) else args)
+            hash(key)
+        except TypeError:
+            return self.cursor.execute(query, args)
+        result = self.cache.get(key)
+        if result is None:
+            generation = self.cache.generation(tables)
+            self.cursor.execute(query, args)
+            # The result is buffered client-side already, so reading it all
+            # costs no extra round-trip.
+            rows = tuple(self.cursor.fetchall())
+            result = self.cache.set(key, tables, generation, self.cursor.description,
+                                    rows, self.cursor.rowcount)
+        self._result = result
+        self._position = 0
+        return result.rowcount
+
+    def _execute_uncached(self, query, args):
+        try:
+            return self.cursor.execute(query, args)
+        finally:
+            self.cache.invalidate_statement(query, self.wrapper)
+
+    def executemany(self, query, args):
+        self._result = None
+        try:
+            return self.cursor.executemany(query, args)
+        finally:
+            self.cache.invalidate_statement(query, self.wrapper)
+
+    @property
+    def description(self):
+        if self._result is None:
+            return self.cursor.description
+        return self._result.description
+
+    @property
+    def rowcount(self):
+        if self._result is None:
+            return self.cursor.rowcount
+        return self._result.rowcount
+
+    def fetchone(self):
+        if self._result is None:
+            return self.cursor.fetchone()
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size=None):
+        size = size or self.cursor.arraysize
+        if self._result is None:
+            return self.cursor.fetchmany(size)
+        rows = self._result.rows[self._position:self._position + size]
+        self._position += len(rows)
+        return list(rows)
+
+    def fetchall(self):
+        if self._result is None:
+            return self.cursor.fetchall()
+        rows = self._result.rows[self._position:]
+        self._position += len(rows)
+        return list(rows)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def close(self):
+        self._result = None
+        self.cursor.close()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(alias, **options):
+    """Return the process-wide ResultCache of the database `alias`."""
+    with _caches_lock:
+        cache = _caches.get(alias)
+        if cache is None:
+            cache = _caches[alias] = ResultCache(**options)
+        return cache
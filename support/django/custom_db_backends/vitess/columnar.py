@@ -0,0 +1,203 @@
+"""
+Columnar decoding of query.proto rows.
+
+A QueryResult row is the concatenation of its values plus their lengths (-1
+for NULL). decode_columns() lays the rows of a result over one buffer and,
+with NumPy installed, cuts whole columns out of it at once: integer, float,
+date and time and text columns become typed arrays (int64, uint64, float64,
+datetime64, unicode) without creating a Python object per cell. Other
+columns (DECIMAL, TIME, binary) and the pure Python fallback use one object
+per cell.
+
+LazyRows adapts the columns to the sequence of tuples the DB-API cursor
+returns, building each tuple only when it is read, so that a cursor of the
+gRPC transport can use decode_lazy() as its decoder:
+
+    "GRPC": {"DECODER": "columnar"}
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .vtgate_grpc import CONVERTERS, _bytes, query_pb2
+
+_INT_TYPES = frozenset((
+    query_pb2.INT8, query_pb2.UINT8, query_pb2.INT16, query_pb2.UINT16,
+    query_pb2.INT24, query_pb2.UINT24, query_pb2.INT32, query_pb2.UINT32,
+    query_pb2.INT64, query_pb2.YEAR,
+))
+_FLOAT_TYPES = frozenset((query_pb2.FLOAT32, query_pb2.FLOAT64))
+_DATETIME_TYPES = frozenset((query_pb2.DATETIME, query_pb2.TIMESTAMP))
+_TEXT_TYPES = frozenset((
+    query_pb2.TEXT, query_pb2.VARCHAR, query_pb2.CHAR, query_pb2.ENUM,
+    query_pb2.SET, query_pb2.JSON,
+))
+
+# _cells() pads every cell of a column to its widest one, so text columns
+# are only gathered that way while their widest cell is at most _MAX_WIDTH
+# bytes and the padding takes at most _MAX_PADDING times their bytes; wider
+# or more ragged ones are sliced cell by cell. Number and date columns are
+# at most a few dozen bytes wide.
+_MAX_WIDTH = 256
+_MAX_PADDING = 4
+
+
+class Column(object):
+    """
+    The values of one result column: a NumPy array (or a list) with a
+    boolean `nulls` array (or list) marking the NULL cells.
+    """
+
+    __slots__ = ('name', 'type', 'values', 'nulls', '_python')
+
+    def __init__(self, name, field_type, values, nulls, python=None):
+        self.name = name
+        self.type = field_type
+        self.values = values
+        self.nulls = nulls
+        self._python = python
+
+    def __len__(self):
+        return len(self.values)
+
+    def python(self, index):
+        """Return the value at `index` as the Python object mysqlclient returns."""
+        if self.nulls[index]:
+            return None
+        value = self.values[index]
+        return self._python(value) if self._python is not None else value
+
+
+def _numpy_item(value):
+    return value.item()
+
+
+def _layout(fields, rows):
+    """
+    Return the concatenated values of `rows` as a uint8 array, and the
+    (rows, columns) arrays of their offsets and lengths.
+    """
+    # Reading the protobuf fields dominates, so it's done in a single pass.
+    values, lengths = [], []
+    for row in rows:
+        values.append(row.values)
+        lengths.extend(row.lengths)
+    buf = numpy.frombuffer(b''.join(values), dtype=numpy.uint8)
+    lengths = numpy.array(lengths, dtype=numpy.int64).reshape(len(rows), len(fields))
+    sizes = numpy.maximum(lengths, 0)
+    flat = sizes.ravel()
+    offsets = (numpy.cumsum(flat) - flat).reshape(lengths.shape)
+    return buf, offsets, lengths
+
+
+def _cells(buf, starts, sizes):
+    """Gather the cells of a column into a fixed width bytes ('S') array."""
+    width = int(sizes.max()) if len(sizes) else 0
+    if width == 0:
+        return numpy.zeros(len(sizes), dtype='S1')
+    positions = numpy.arange(width)
+    inside = positions < sizes[:, None]
+    index = numpy.where(inside, starts[:, None] + positions, 0)
+    cells = numpy.where(inside, buf[index], 0).astype(numpy.uint8)
+    return numpy.ascontiguousarray(cells).view('S%d' % width).ravel()
+
+
+def _fixed_width(sizes):
+    """Whether gathering cells of `sizes` into an 'S' array takes little memory."""
+    width = int(sizes.max()) if len(sizes) else 0
+    return width <= _MAX_WIDTH and width * len(sizes) <= _MAX_PADDING * int(sizes.sum())
+
+
+def _sliced(buf, starts, lengths, convert):
+    """Return the list of the cells of a column converted one by one."""
+    data = buf.tobytes()
+    return [None if length < 0 else convert(data[start:start + length])
+            for start, length in zip(starts.tolist(), lengths.tolist())]
+
+
+def _numpy_column(field, buf, starts, lengths):
+    nulls = lengths < 0
+    sizes = numpy.maximum(lengths, 0)
+    if field.type in _INT_TYPES or field.type == query_pb2.UINT64:
+        cells = numpy.where(nulls, b'0', _cells(buf, starts, sizes))
+        dtype = numpy.uint64 if field.type == query_pb2.UINT64 else numpy.int64
+        return Column(field.name, field.type, cells.astype(dtype), nulls, int)
+    if field.type in _FLOAT_TYPES:
+        cells = numpy.where(nulls, b'0', _cells(buf, starts, sizes))
+        return Column(field.name, field.type, cells.astype(numpy.float64), nulls, float)
+    if field.type in _DATETIME_TYPES or field.type == query_pb2.DATE:
+        text = _cells(buf, starts, sizes).astype('U')
+        # MySQL's zero dates come back as None, like with mysqlclient.
+        missing = nulls | numpy.char.startswith(text, '0000-00-00')
+        unit = 'D' if field.type == query_pb2.DATE else 'us'
+        values = numpy.where(missing, 'NaT', text).astype('datetime64[%s]' % unit)
+        return Column(field.name, field.type, values, missing, _numpy_item)
+    if field.type in _TEXT_TYPES:
+        if _fixed_width(sizes):
+            values = numpy.char.decode(_cells(buf, starts, sizes), 'utf-8')
+        else:
+            values = numpy.array(_sliced(buf, starts, lengths, CONVERTERS[field.type]),
+                                 dtype=object)
+        return Column(field.name, field.type, values, nulls, str)
+    # Per-cell objects for the rest: slicing keeps binary values' trailing
+    # zero bytes, which an 'S' array would drop.
+    values = _sliced(buf, starts, lengths, CONVERTERS.get(field.type, _bytes))
+    return Column(field.name, field.type, values, nulls.tolist())
+
+
+def _python_columns(fields, rows):
+    converters = [CONVERTERS.get(field.type, _bytes) for field in fields]
+    columns = [[] for _ in fields]
+    for row in rows:
+        values = memoryview(row.values)
+        offset = 0
+        for column, length, convert in zip(columns, row.lengths, converters):
+            if length < 0:
+                column.append(None)
+            else:
+                column.append(convert(values[offset:offset + length].tobytes()))
+                offset += length
+    return [Column(field.name, field.type, values, [value is None for value in values])
+            for field, values in zip(fields, columns)]
+
+
+def decode_columns(fields, rows):
+    """Return the list of Columns of the query.proto `rows` of `fields`."""
+    if numpy is None:
+        return _python_columns(fields, rows)
+    buf, offsets, lengths = _layout(fields, rows)
+    return [_numpy_column(field, buf, offsets[:, i], lengths[:, i])
+            for i, field in enumerate(fields)]
+
+
+class LazyRows(object):
+    """A read-only sequence of row tuples built on demand from Columns."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._length = len(columns[0]) if columns else 0
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('row index out of range')
+        return self._row(index)
+
+    def _row(self, index):
+        return tuple(column.python(index) for column in self.columns)
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield self._row(index)
+
+
+def decode_lazy(fields, rows):
+    """A vtgate_grpc.Connection decoder returning LazyRows."""
+    return LazyRows(decode_columns(fields, rows))
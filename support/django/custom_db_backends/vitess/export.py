@@ -0,0 +1,398 @@
+"""
+Parallel export of a table, chunk by chunk, instead of one scatter.
+
+    from custom_db_backends.vitess.export import export_table
+
+    summary = export_table(Order, '/data/orders', output_format='parquet',
+                           chunks_per_shard=4, processes=8)
+
+splits the table into chunks, one per shard key range (`USE keyspace:shard`)
+or, with chunks_per_shard, per primary key range within each shard, and
+streams every chunk (workload='olap') into a file of its own from a process
+pool. Formats are 'csv', 'jsonl' and 'parquet' (which needs pyarrow).
+
+The directory holds a manifest.json of the chunks, updated as each one
+completes, so that running the same export again only exports the chunks
+that didn't complete. Chunk files are written under a temporary name and
+renamed once complete. Shards default to VITESS['SHARDS'] (or
+SRV_KEYSPACE), and processes, chunks per shard and batch size to
+VITESS['EXPORT'].
+"""
+import csv
+import datetime
+import decimal
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from django.db import connections
+
+from .keyrange import KeyRange
+from .streaming import StreamingCursor
+
+MANIFEST = 'manifest.json'
+
+
+def _quote(name):
+    return '`%s`' % name.replace('`', '``')
+
+
+def _bounds(low, high, count):
+    """Split [low, high] into at most `count` ranges; return their inner bounds."""
+    if count <= 1 or not isinstance(low, int) or not isinstance(high, int) or high <= low:
+        return []
+    step = max(1, (high - low + 1) // count)
+    return list(range(low + step, high + 1, step))[:count - 1]
+
+
+def plan_chunks(table, key, using='default', shards=None, chunks_per_shard=1):
+    """
+    Return the chunks of `table`: dicts of the shard, its key range and the
+    [lower, upper) range of the integer column `key` (None for unbounded).
+    Each shard is split in `chunks_per_shard` ranges of `key` from its
+    current minimum and maximum.
+    """
+    connection = connections[using]
+    if shards is None:
+        shards = connection.shard_resolver.shards
+    chunks = []
+    for shard in shards:
+        bounds = []
+        if chunks_per_shard > 1:
+            with connection.use_target(connection.get_target(shard)):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT MIN(%s), MAX(%s) FROM %s' %
+                                   (_quote(key), _quote(key), _quote(table)))
+                    low, high = cursor.fetchone()
+            bounds = _bounds(low, high, chunks_per_shard)
+        edges = [None] + bounds + [None]
+        for index in range(len(edges) - 1):
+            chunks.append({
+                'name': '%s.%s.%03d' % (table, shard, index),
+                'shard': shard,
+                'key_range': str(KeyRange.from_shard_name(shard)),
+                'lower': edges[index],
+                'upper': edges[index + 1],
+            })
+    return chunks
+
+
+def chunk_query(table, columns, key, chunk):
+    """Return the SELECT of the rows of `chunk` and its params."""
+    conditions, params = [], []
+    if chunk['lower'] is not None:
+        conditions.append('%s >= %%s' % _quote(key))
+        params.append(chunk['lower'])
+    if chunk['upper'] is not None:
+        conditions.append('%s < %%s' % _quote(key))
+        params.append(chunk['upper'])
+    sql = 'SELECT %s FROM %s' % (', '.join(_quote(column) for column in columns), _quote(table))
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return sql + ' ORDER BY %s' % _quote(key), params
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'backslashreplace')
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return _text(value)
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+class CSVWriter(object):
+    extension = 'csv'
+
+    def __init__(self, path, columns, description=None):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows([_text(value) for value in row] for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class JSONLinesWriter(object):
+    extension = 'jsonl'
+
+    def __init__(self, path, columns, description=None):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.columns = columns
+
+    def write(self, rows):
+        self.file.write(''.join(
+            json.dumps(dict(zip(self.columns, row)), default=_json_default) + '\n'
+            for row in rows))
+
+    def close(self):
+        self.file.close()
+
+
+# MySQL field type codes (MySQLdb.constants.FIELD_TYPE) of cursor.description
+# whose values have a single arrow type. Unsigned BIGINTs past the int64 range
+# don't fit.
+_ARROW_TYPES = {
+    1: 'int16', 2: 'int32', 9: 'int32', 3: 'int64', 8: 'int64', 13: 'int16',
+    4: 'float64', 5: 'float64',
+    7: 'timestamp', 12: 'timestamp', 10: 'date32', 14: 'date32', 11: 'time64',
+    6: 'null', 16: 'binary', 255: 'binary',
+    245: 'string', 247: 'string', 248: 'string',
+}
+_DECIMAL_TYPES = frozenset((0, 246))
+
+
+def _arrow_type(column):
+    """
+    Return the arrow type of the values of the cursor.description `column`,
+    or None if it depends on the values: text and binary strings share the
+    same type codes.
+    """
+    code, precision, scale = column[1], column[4], column[5]
+    if code in _DECIMAL_TYPES:
+        # The length of the column bounds its number of digits.
+        precision = min(precision or 76, 76)
+        scale = min(scale or 0, precision)
+        if precision <= 38:
+            return pyarrow.decimal128(precision, scale)
+        return pyarrow.decimal256(precision, scale)
+    name = _ARROW_TYPES.get(code)
+    if name == 'timestamp' or name == 'time64':
+        return getattr(pyarrow, name)('us')
+    if name is not None:
+        return getattr(pyarrow, name)()
+    return None
+
+
+class ParquetWriter(object):
+    """
+    Writes each batch as a row group. The schema comes from the
+    cursor.description of the rows, so that a column that is NULL in the
+    first batch keeps its type. String columns the description can't tell
+    apart are text or binary as their first value, and text without one.
+    """
+    extension = 'parquet'
+
+    def __init__(self, path, columns, description=None):
+        self.path = path
+        self.columns = columns
+        self.types = [_arrow_type(column) for column in description or ()]
+        if len(self.types) != len(columns):
+            self.types = [None] * len(columns)
+        self.schema = None
+        self.writer = None
+
+    def _schema(self, values):
+        fields = []
+        for name, arrow_type, column in zip(self.columns, self.types, values):
+            if arrow_type is None:
+                first = next((value for value in column if value is not None), None)
+                if first is None or isinstance(first, str):
+                    arrow_type = pyarrow.string()
+                elif isinstance(first, bytes):
+                    arrow_type = pyarrow.binary()
+                else:
+                    arrow_type = pyarrow.array([first]).type
+            fields.append((name, arrow_type))
+        return pyarrow.schema(fields)
+
+    def write(self, rows):
+        if not rows:
+            return
+        values = list(zip(*rows))
+        if self.writer is None:
+            self.schema = self._schema(values)
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+        arrays = []
+        for column, field in zip(values, self.schema):
+            if field.type == pyarrow.string():
+                column = [_text(value) for value in column]
+            arrays.append(pyarrow.array(column, type=field.type))
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is None:
+            # An empty chunk still gets its (empty) file.
+            self.writer = pyarrow.parquet.ParquetWriter(
+                self.path, self._schema([()] * len(self.columns)))
+        self.writer.close()
+
+
+WRITERS = {'csv': CSVWriter, 'jsonl': JSONLinesWriter, 'parquet': ParquetWriter}
+
+
+def export_chunk(using, table, columns, key, chunk, path, output_format, batch_size):
+    """
+    Stream the rows of `chunk` from its shard into the file `path`; return
+    the number of rows and the seconds it took.
+    """
+    connection = connections[using]
+    start = time.time()
+    sql, params = chunk_query(table, columns, key, chunk)
+    target = connection.get_target(chunk['shard'])
+    temporary = path + '.tmp'
+    writer = None
+    rows = 0
+    complete = False
+    try:
+        connection.ensure_connection()
+        if connection.transport == 'grpc':
+            with connection.use_target(target):
+                cursor = connection.connection.cursor(stream=True)
+                cursor.execute(sql, params)
+        else:
+            cursor = StreamingCursor(connection, target)
+            cursor.execute(sql, params)
+        try:
+            writer = WRITERS[output_format](temporary, columns, cursor.description)
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                writer.write(batch)
+                rows += len(batch)
+        finally:
+            cursor.close()
+        complete = True
+    finally:
+        if writer is not None:
+            writer.close()
+        connection.close()
+        if not complete and writer is not None:
+            os.remove(temporary)
+    os.replace(temporary, path)
+    return rows, time.time() - start
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        # Processes started with 'spawn' set Django up from
+        # DJANGO_SETTINGS_MODULE.
+        django.setup()
+
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _load_manifest(directory, export):
+    """Return the manifest of the same export in `directory`, or None."""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if any(manifest.get(name) != value for name, value in export.items()):
+        return None
+    return manifest
+
+
+def export_table(model_or_table, directory, using=None, columns=None, key=None,
+                 output_format='csv', shards=None, chunks_per_shard=None,
+                 processes=None, batch_size=None, resume=True):
+    """
+    Export the rows of a model or table to one file per chunk in
+    `directory`, and return a summary of the export. For a table name,
+    `columns` default to all of them and `key` to 'id'. With `resume`, the
+    chunks completed by a previous run of the same export are skipped.
+    """
+    if isinstance(model_or_table, str):
+        table = model_or_table
+        using = using or 'default'
+        key = key or 'id'
+    else:
+        opts = model_or_table._meta
+        table = opts.db_table
+        using = using or 'default'
+        key = key or opts.pk.column
+        columns = columns or [field.column for field in opts.concrete_fields]
+    if output_format not in WRITERS:
+        raise ValueError("Unknown export format '%s', use one of %s." %
+                         (output_format, ', '.join(sorted(WRITERS))))
+    if output_format == 'parquet' and pyarrow is None:
+        raise ImportError("The 'parquet' export format needs pyarrow.")
+    connection = connections[using]
+    if connection.in_atomic_block:
+        raise ValueError("Can't export a table inside a transaction.")
+    export_settings = connection.vitess_settings.get('EXPORT') or {}
+    if chunks_per_shard is None:
+        chunks_per_shard = export_settings.get('CHUNKS_PER_SHARD', 1)
+    if processes is None:
+        processes = export_settings.get('PROCESSES', os.cpu_count())
+    if batch_size is None:
+        batch_size = export_settings.get('BATCH_SIZE', 1000)
+    if columns is None:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT * FROM %s LIMIT 0' % _quote(table))
+            columns = [column[0] for column in cursor.description]
+
+    os.makedirs(directory, exist_ok=True)
+    export = {'table': table, 'columns': list(columns), 'key': key, 'format': output_format}
+    manifest = _load_manifest(directory, export) if resume else None
+    if manifest is None:
+        manifest = dict(export, chunks=plan_chunks(table, key, using, shards, chunks_per_shard))
+        _write_manifest(directory, manifest)
+    pending = []
+    for chunk in manifest['chunks']:
+        path = os.path.join(directory, '%s.%s' % (chunk['name'], WRITERS[output_format].extension))
+        if chunk.get('done') and os.path.exists(path):
+            continue
+        chunk.pop('done', None)
+        pending.append((chunk, path))
+
+    # The workers open connections of their own; the parent's must not be
+    # shared across the fork.
+    connection.close()
+    start = time.time()
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(processes, len(pending)),
+                                 initializer=_init_worker) as executor:
+            futures = {
+                executor.submit(export_chunk, using, table, columns, key, chunk, path,
+                                output_format, batch_size): chunk
+                for chunk, path in pending
+            }
+            error = None
+            for future in as_completed(futures):
+                # Record every chunk that completes, so that a failed export
+                # resumes from all of them.
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                chunk = futures[future]
+                chunk['rows'], chunk['seconds'] = future.result()
+                chunk['done'] = True
+                _write_manifest(directory, manifest)
+            if error is not None:
+                raise error
+    return {
+        'chunks': len(manifest['chunks']),
+        'exported': len(pending),
+        'skipped': len(manifest['chunks']) - len(pending),
+        'rows': sum(chunk.get('rows', 0) for chunk in manifest['chunks']),
+        'seconds': time.time() - start,
+    }
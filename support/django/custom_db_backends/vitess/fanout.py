@@ -0,0 +1,273 @@
+"""
+Run a query on every shard of a keyspace in parallel and merge the results
+client-side.
+
+vtgate merges scatter results itself, but serially for some ordered and
+aggregate plans. These helpers send the query to each shard directly
+(`USE keyspace:shard`) from a thread pool instead:
+
+    from django.db.models import Count, Max, Sum
+    from custom_db_backends.vitess import fanout
+
+    totals = fanout.aggregate(Order.objects.filter(status='paid'),
+                              revenue=Sum('price'), orders=Count('id'),
+                              latest=Max('created'))
+    newest = fanout.ordered(Order.objects.order_by('-created'), limit=20)
+
+Shards default to VITESS['SHARDS'] (or SRV_KEYSPACE) of the queryset's
+database, and concurrency and the per-shard timeout to VITESS['FANOUT'].
+"""
+import functools
+import heapq
+import operator
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import CharField, Count, Max, Min, Sum, TextField
+from django.db.models.query import ModelIterable, ValuesIterable
+
+from .sqlutil import add_directive
+
+
+def _query_timeout_wrapper(timeout_ms):
+    def add_query_timeout(execute, sql, params, many, context):
+        return execute(add_directive(sql, 'QUERY_TIMEOUT_MS=%d' % timeout_ms),
+                       params, many, context)
+    return add_query_timeout
+
+
+@contextmanager
+def _on_shard(connection, shard, timeout):
+    """Send the queries of the block to `shard`, each limited to `timeout`s."""
+    with connection.use_target(connection.get_target(shard)):
+        if timeout is None:
+            yield
+        else:
+            with connection.execute_wrapper(_query_timeout_wrapper(int(timeout * 1000))):
+                yield
+
+
+def map_shards(func, using='default', shards=None, concurrency=None, timeout=None):
+    """
+    Call `func()` once per shard with the connection of `using` targeting
+    that shard, and return an OrderedDict of shard name to result. Up to
+    `concurrency` shards are queried at once, and vtgate cancels queries
+    running longer than `timeout` seconds.
+    """
+    connection = connections[using]
+    fanout_settings = connection.vitess_settings.get('FANOUT') or {}
+    if shards is None:
+        shards = connection.shard_resolver.shards
+    if concurrency is None:
+        concurrency = fanout_settings.get('CONCURRENCY', len(shards))
+    if timeout is None:
+        timeout = fanout_settings.get('TIMEOUT')
+
+    if concurrency <= 1 or len(shards) <= 1:
+        results = OrderedDict()
+        for shard in shards:
+            with _on_shard(connection, shard, timeout):
+                results[shard] = func()
+        return results
+
+    def run_in_thread(shard):
+        thread_connection = connections[using]
+        try:
+            with _on_shard(thread_connection, shard, timeout):
+                return func()
+        finally:
+            # Hand the thread's connection back (to the pool, if enabled).
+            thread_connection.close()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [(shard, executor.submit(run_in_thread, shard)) for shard in shards]
+        try:
+            return OrderedDict((shard, future.result()) for shard, future in futures)
+        except BaseException:
+            for _, future in futures:
+                future.cancel()
+            raise
+
+
+def fetch(queryset, **options):
+    """Return an OrderedDict of shard name to the list of `queryset` rows."""
+    return map_shards(lambda: list(queryset.all()), using=queryset.db, **options)
+
+
+def _merge_aggregate(aggregate, values):
+    values = [value for value in values if value is not None]
+    if isinstance(aggregate, Count):
+        return sum(values)
+    if not values:
+        return None
+    if isinstance(aggregate, Sum):
+        return sum(values)
+    if isinstance(aggregate, Min):
+        return min(values)
+    return max(values)
+
+
+def aggregate(queryset, shards=None, concurrency=None, timeout=None, **aggregates):
+    """
+    Like queryset.aggregate(**aggregates), computed per shard and merged.
+    Only Sum, Count (without distinct), Min and Max can be merged; use Sum
+    and Count instead of Avg.
+    """
+    for name, aggregate in aggregates.items():
+        if not isinstance(aggregate, (Count, Sum, Min, Max)):
+            raise ValueError("Can't merge %s aggregate '%s' across shards." %
+                             (type(aggregate).__name__, name))
+        if getattr(aggregate, 'distinct', False):
+            raise ValueError("Can't merge distinct aggregate '%s' across shards." % name)
+    results = map_shards(lambda: queryset.aggregate(**aggregates), using=queryset.db,
+                         shards=shards, concurrency=concurrency, timeout=timeout)
+    return {name: _merge_aggregate(aggregate, [result[name] for result in results.values()])
+            for name, aggregate in aggregates.items()}
+
+
+def _values_getter(queryset, name):
+    """Return a function reading `name` from the values() dicts of `queryset`."""
+    query = queryset.query
+    opts = queryset.model._meta
+    keys = set(query.extra_select) | set(query.values_select) | set(query.annotation_select)
+    if name == 'pk':
+        name = opts.pk.attname if opts.pk.attname in keys else opts.pk.name
+    elif name not in keys and '__' not in name:
+        # values() without fields has the attname of foreign keys.
+        try:
+            name = opts.get_field(name).attname
+        except (FieldDoesNotExist, AttributeError):
+            pass
+    if name not in keys:
+        raise ValueError("ordered() can't merge by '%s', which isn't one of the "
+                         "values() of the queryset." % name)
+    return operator.itemgetter(name)
+
+
+def _instance_getter(queryset, name):
+    """
+    Return a function reading `name`, which may follow foreign keys with
+    '__', from the model instances of `queryset`, and the relation to
+    select_related() so that reading it takes no query.
+    """
+    if name == 'pk' or name in queryset.query.annotations:
+        return operator.attrgetter(name), None
+    parts = name.split('__')
+    model = queryset.model
+    attributes = []
+    for i, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            field = None
+        last = i == len(parts) - 1
+        if field is None or (field.is_relation and not (
+                field.concrete and (field.many_to_one or field.one_to_one))):
+            raise ValueError("ordered() can't merge by '%s'." % name)
+        if not last:
+            attributes.append(field.name)
+            model = field.related_model
+        elif field.is_relation and field.related_model._meta.ordering:
+            # The database orders by the ordering of the related model.
+            raise ValueError("ordered() can't merge by '%s', a relation to an "
+                             "ordered model." % name)
+        else:
+            attributes.append(field.attname)
+
+    def get(row):
+        for attribute in attributes:
+            if row is None:
+                # A null foreign key on the way, which MySQL sorts as NULL.
+                return None
+            row = getattr(row, attribute)
+        return row
+    return get, '__'.join(parts[:-1]) or None
+
+
+def _text_field(model, name):
+    """
+    Whether `name`, which may follow foreign keys with '__', is a text
+    column of `model` (or a foreign key to one).
+    """
+    field = None
+    for part in name.split('__'):
+        if model is None:
+            return False
+        try:
+            field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return False
+        model = field.related_model
+    if field.is_relation and field.concrete and (field.many_to_one or field.one_to_one):
+        field = field.target_field
+    return isinstance(field, (CharField, TextField))
+
+
+def _ordering_key(getters):
+    """
+    Return a sort key comparing rows by `getters`, a list of (function
+    reading a value from a row, descending) pairs, with NULLs first like
+    MySQL.
+    """
+    def compare(a, b):
+        for get, descending in getters:
+            x, y = get(a), get(b)
+            if x == y:
+                continue
+            if x is None:
+                result = -1
+            elif y is None:
+                result = 1
+            else:
+                result = -1 if x < y else 1
+            return -result if descending else result
+        return 0
+    return functools.cmp_to_key(compare)
+
+
+def ordered(queryset, limit=None, shards=None, concurrency=None, timeout=None):
+    """
+    Return the rows of an ordered `queryset` (model instances or values()
+    dicts) from all shards, merged in order and truncated to `limit`. Each
+    shard returns at most `limit` rows. The ordering may follow foreign
+    keys, which are then selected with the rows; orderings the rows can't
+    be compared by, including text fields (sorted by the shards' collation),
+    raise ValueError before any shard is queried. Text values of annotations
+    or extra() can't be told apart, and are merged in Python's order.
+    """
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+    if not ordering or not all(isinstance(name, str) and name not in ('?', '-?')
+                               for name in ordering):
+        raise ValueError('ordered() needs a queryset ordered by field names.')
+    for name in ordering:
+        # Each shard sorts text by its collation (case and accent
+        # insensitive by default), which Python comparison doesn't follow.
+        if _text_field(queryset.model, name.lstrip('-')):
+            raise ValueError("ordered() can't merge by '%s', a text column the shards "
+                             "sort by their collation." % name.lstrip('-'))
+    # Resolve the ordering before any shard is queried.
+    getters = []
+    if queryset._iterable_class is ValuesIterable:
+        for name in ordering:
+            getters.append((_values_getter(queryset, name.lstrip('-')), name.startswith('-')))
+    elif queryset._iterable_class is ModelIterable:
+        related = []
+        for name in ordering:
+            get, relation = _instance_getter(queryset, name.lstrip('-'))
+            getters.append((get, name.startswith('-')))
+            if relation is not None:
+                related.append(relation)
+        if related:
+            queryset = queryset.select_related(*related)
+    else:
+        raise ValueError('ordered() needs a queryset of model instances or values() dicts.')
+    if limit is not None:
+        queryset = queryset[:limit]
+    results = map_shards(lambda: list(queryset.all()), using=queryset.db, shards=shards,
+                         concurrency=concurrency, timeout=timeout)
+    merged = heapq.merge(*results.values(), key=_ordering_key(getters))
+    return list(islice(merged, limit))
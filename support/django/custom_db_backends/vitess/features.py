@@ -1,6 +1,8 @@
 from django.db.backends.mysql.features import DatabaseFeatures as MysqlBaseDatabaseFeatures
 
 class DatabaseFeatures(MysqlBaseDatabaseFeatures):
-    supports_transactions = False
+    # vtgate runs transactions in the transaction_mode of the session, see
+    # DatabaseWrapper.transaction_mode().
+    supports_transactions = True
     uses_savepoints = False
     supports_foreign_keys = False
\ No newline at end of file
@@ -0,0 +1,249 @@
+"""
+Opt-in per-query instrumentation for the vitess backend.
+
+Every statement executed through an instrumented connection is timed and
+aggregated by fingerprint (see sqlutil.fingerprint). The first time a SELECT,
+UPDATE or DELETE fingerprint is seen, its vtgate plan is looked up with
+EXPLAIN FORMAT=vitess and cached, which tells whether the statement is a
+scatter and how many shards it touches.
+"""
+import bisect
+import threading
+import time
+
+from .sqlutil import fingerprint, statement_type
+
+# Upper bounds, in milliseconds, of the latency histogram buckets; the last
+# bucket is unbounded.
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+EXPLAINED_STATEMENTS = frozenset(('SELECT', 'UPDATE', 'DELETE'))
+
+# Plan operators that send queries to tablets.
+ROUTE_OPERATORS = frozenset(('Route', 'Insert', 'Update', 'Delete'))
+
+# Route variants that always go to a single shard.
+SINGLE_SHARD_VARIANTS = frozenset((
+    'SelectUnsharded', 'SelectEqualUnique', 'SelectReference', 'SelectNext',
+    'SelectDBA', 'Unsharded', 'EqualUnique',
+))
+
+
+class Histogram(object):
+    """Fixed-bucket latency histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding quantile `q`."""
+        total = sum(self.counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def as_dict(self):
+        labels = ['<=%s' % bound for bound in self.buckets] + ['>%s' % self.buckets[-1]]
+        return dict(zip(labels, self.counts))
+
+
+class Plan(object):
+    """The routes of a vtgate plan, as returned by EXPLAIN FORMAT=vitess."""
+
+    def __init__(self, rows, shard_count=None):
+        # Rows are (operator, variant, keyspace, destination, tabletType, query).
+        # The operator is prefixed with the tree drawing of nested operators.
+        self.routes = [(row[1], row[2]) for row in rows
+                       if row[0].split()[-1] in ROUTE_OPERATORS]
+        self.variants = sorted(set(variant for variant, _ in self.routes))
+        self.scatter = any('Scatter' in variant for variant in self.variants)
+        self.shards = self._shards_touched(shard_count)
+
+    def _shards_touched(self, shard_count):
+        """Shards touched, or None when it depends on the bind variables."""
+        shards = 0
+        for variant, _ in self.routes:
+            if variant in SINGLE_SHARD_VARIANTS:
+                shards += 1
+            elif 'Scatter' in variant and shard_count:
+                shards += shard_count
+            else:
+                return None
+        return shards
+
+    def as_dict(self):
+        return {'variants': self.variants, 'scatter': self.scatter,
+                'shards': self.shards}
+
+
+class QueryStats(object):
+    """Aggregated stats of one fingerprint."""
+
+    def __init__(self, fingerprint, plan=None):
+        self.fingerprint = fingerprint
+        self.plan = plan
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = Histogram()
+
+    def add(self, duration, rows, failed):
+        self.count += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.histogram.add(duration * 1000)
+        if failed:
+            self.errors += 1
+        elif rows > 0:
+            self.rows += rows
+
+    def as_dict(self):
+        return {
+            'fingerprint': self.fingerprint,
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_time': self.total_time,
+            'mean_time': self.total_time / self.count if self.count else 0.0,
+            'max_time': self.max_time,
+            'p50_ms': self.histogram.quantile(0.5),
+            'p99_ms': self.histogram.quantile(0.99),
+            'histogram': self.histogram.as_dict(),
+            'plan': self.plan.as_dict() if self.plan else None,
+        }
+
+
+class Collector(object):
+    """Thread-safe aggregation of QueryStats by fingerprint."""
+
+    def __init__(self, explain=True, max_fingerprints=10000):
+        self.explain = explain
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._plans = {}
+        self.latency = Histogram()
+
+    def plan_for(self, normalized):
+        """Return the cached plan, or False if it still has to be explained."""
+        with self._lock:
+            if normalized in self._plans:
+                return self._plans[normalized]
+            if len(self._plans) >= self.max_fingerprints:
+                return None
+            return False
+
+    def set_plan(self, normalized, plan):
+        with self._lock:
+            self._plans[normalized] = plan
+            stats = self._stats.get(normalized)
+            if stats is not None:
+                stats.plan = plan
+
+    def record(self, normalized, duration, rows, failed):
+        with self._lock:
+            stats = self._stats.get(normalized)
+            if stats is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    normalized = '<other>'
+                    stats = self._stats.get(normalized)
+                if stats is None:
+                    stats = self._stats[normalized] = QueryStats(
+                        normalized, self._plans.get(normalized))
+            stats.add(duration, rows, failed)
+            self.latency.add(duration * 1000)
+
+    def queries(self):
+        with self._lock:
+            return [stats.as_dict() for stats in self._stats.values()]
+
+    def top_scatter_queries(self, n=10):
+        """The `n` scatter fingerprints that spent the most time in vtgate."""
+        scatter = [query for query in self.queries()
+                   if query['plan'] and query['plan']['scatter']]
+        scatter.sort(key=lambda query: query['total_time'], reverse=True)
+        return scatter[:n]
+
+    def report(self, n=10):
+        queries = self.queries()
+        return {
+            'queries': sum(query['count'] for query in queries),
+            'fingerprints': len(queries),
+            'latency_histogram': self.latency.as_dict(),
+            'slowest': sorted(queries, key=lambda query: query['total_time'],
+                              reverse=True)[:n],
+            'top_scatter': self.top_scatter_queries(n),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.latency = Histogram()
+
+
+class QueryInstrumentation(object):
+    """A Django execute wrapper feeding a Collector."""
+
+    def __init__(self, collector, shard_count=None):
+        self.collector = collector
+        self.shard_count = shard_count
+
+    def __call__(self, execute, sql, params, many, context):
+        normalized = fingerprint(sql)
+        if (self.collector.explain and
+                self.collector.plan_for(normalized) is False and
+                statement_type(sql) in EXPLAINED_STATEMENTS):
+            self.collector.set_plan(
+                normalized, self.explain(context['connection'], sql,
+                                         None if many else params))
+        started = time.monotonic()
+        failed = True
+        try:
+            result = execute(sql, params, many, context)
+            failed = False
+            return result
+        finally:
+            rows = getattr(context['cursor'], 'rowcount', -1) if not failed else 0
+            self.collector.record(normalized, time.monotonic() - started,
+                                  rows or 0, failed)
+
+    def explain(self, connection, sql, params):
+        """
+        Return the Plan of `sql`, or None if vtgate can't explain it. A raw
+        cursor is used so the EXPLAIN itself isn't instrumented.
+        """
+        if params is None and '%s' in sql:
+            return None
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute('EXPLAIN FORMAT=vitess ' + sql, params)
+            return Plan(cursor.fetchall(), self.shard_count)
+        except connection.Database.Error:
+            return None
+        finally:
+            cursor.close()
+
+
+_collectors = {}
+_collectors_lock = threading.Lock()
+
+
+def get_collector(alias, **options):
+    """Return the process-wide Collector of the database `alias`."""
+    with _collectors_lock:
+        collector = _collectors.get(alias)
+        if collector is None:
+            collector = _collectors[alias] = Collector(**options)
+        return collector
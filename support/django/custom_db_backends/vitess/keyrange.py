@@ -0,0 +1,117 @@
+"""
+Key ranges and shard resolution, following go/vt/key.
+
+A shard named '40-80' owns the keyspace ids k with 0x40 <= k < 0x80,
+compared as byte strings; an empty bound is unbounded and the shard '0' or
+'-' owns everything.
+"""
+import base64
+import binascii
+import bisect
+
+# topodata.TabletType values, for SrvKeyspace JSON that encodes enums as ints.
+TABLET_TYPE_NAMES = {1: 'MASTER', 2: 'REPLICA', 3: 'RDONLY'}
+
+
+class KeyRange(object):
+    """A [start, end) range of keyspace ids, as in topodata.proto KeyRange."""
+
+    def __init__(self, start=b'', end=b''):
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_shard_name(cls, shard):
+        """Parse a shard name like '-80', '40-80', '80-' or '0'."""
+        if shard in ('0', '-', ''):
+            return cls()
+        if '-' not in shard:
+            raise ValueError("Shard name '%s' is not a key range." % shard)
+        start, end = shard.split('-', 1)
+        try:
+            return cls(binascii.unhexlify(start), binascii.unhexlify(end))
+        except (TypeError, binascii.Error):
+            raise ValueError("Shard name '%s' is not a key range." % shard)
+
+    def contains(self, keyspace_id):
+        return (self.start <= keyspace_id and
+                (not self.end or keyspace_id < self.end))
+
+    def intersects(self, other):
+        return ((not self.end or not other.start or other.start < self.end) and
+                (not other.end or not self.start or self.start < other.end))
+
+    def __eq__(self, other):
+        return (isinstance(other, KeyRange) and
+                (self.start, self.end) == (other.start, other.end))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.start, self.end))
+
+    def __str__(self):
+        if not self.start and not self.end:
+            return '-'
+        return '%s-%s' % (binascii.hexlify(self.start).decode('ascii'),
+                          binascii.hexlify(self.end).decode('ascii'))
+
+    def __repr__(self):
+        return 'KeyRange(%s)' % self
+
+
+class ShardResolver(object):
+    """
+    Map keyspace ids to the shards of a keyspace. `shards` is a list of
+    shard names that together cover the whole keyspace id space.
+    """
+
+    def __init__(self, shards):
+        ranges = sorted(((KeyRange.from_shard_name(shard), shard)
+                         for shard in shards),
+                        key=lambda item: item[0].start)
+        self.shards = [shard for _, shard in ranges]
+        self.key_ranges = [key_range for key_range, _ in ranges]
+        self._starts = [key_range.start for key_range in self.key_ranges]
+
+    @classmethod
+    def from_srv_keyspace(cls, srv_keyspace, tablet_type='MASTER'):
+        """
+        Build a resolver from a SrvKeyspace, as printed by
+        `vtctlclient GetSrvKeyspace <cell> <keyspace>`, using the partition
+        serving `tablet_type`.
+        """
+        for partition in srv_keyspace.get('partitions', []):
+            served_type = partition.get('served_type', 'UNKNOWN')
+            served_type = TABLET_TYPE_NAMES.get(served_type, served_type)
+            if str(served_type).upper() == tablet_type.upper():
+                return cls([shard_reference_name(reference)
+                            for reference in partition.get('shard_references', [])])
+        raise ValueError(
+            'SrvKeyspace has no partition for tablet type %s.' % tablet_type)
+
+    def shard_for_keyspace_id(self, keyspace_id):
+        """Return the name of the shard owning `keyspace_id`."""
+        index = bisect.bisect_right(self._starts, keyspace_id) - 1
+        if index >= 0 and self.key_ranges[index].contains(keyspace_id):
+            return self.shards[index]
+        raise ValueError('No shard owns keyspace id %s.' %
+                         binascii.hexlify(keyspace_id).decode('ascii'))
+
+    def shards_for_key_range(self, key_range):
+        """Return the names of the shards intersecting `key_range`."""
+        return [shard for shard, shard_range in zip(self.shards, self.key_ranges)
+                if shard_range.intersects(key_range)]
+
+
+def shard_reference_name(reference):
+    """
+    Return the shard name of a SrvKeyspace shard reference, rebuilding it
+    from the key range (base64 encoded in JSON) when only that is present.
+    """
+    if reference.get('name'):
+        return reference['name']
+    key_range = reference.get('key_range') or {}
+    return str(KeyRange(base64.b64decode(key_range.get('start', '')),
+                        base64.b64decode(key_range.get('end', ''))))
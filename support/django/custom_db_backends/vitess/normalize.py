@@ -0,0 +1,242 @@
+"""
+Optional normalization of the SQL sent to vtgate.
+
+vtgate caches its plans by normalized statement, yet ORM queries still come
+in many shapes: a filter(pk__in=...) with 3 values and one with 4 values are
+different statements, and so are statements with literals the ORM inlines
+(e.g. LIMIT 21). The Normalizer rewrites outgoing statements so that
+
+  * integer and simple string literals become bind variables, and
+  * IN-lists of bind variables are padded to the next power of two by
+    repeating their last value,
+
+which collapses the query shapes of an application to a small set. Rewrites
+are compiled once per distinct SQL string into a Template and kept in a
+per-process LRU cache.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+from .sqlutil import statement_type, tokenize
+
+NORMALIZED_STATEMENTS = frozenset(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE'))
+
+# Words whose parenthesized numbers are part of a type, e.g. DECIMAL(10, 2).
+_TYPE_WORDS = frozenset((
+    'binary', 'char', 'decimal', 'dec', 'double', 'float', 'numeric',
+    'varbinary', 'varchar', 'datetime', 'time', 'timestamp', 'bit',
+))
+
+# Words ending an ORDER BY or GROUP BY list, where numbers are positions.
+_END_OF_POSITIONS = frozenset(('limit', 'having', 'union', 'for', 'window', 'lock'))
+
+# Words after which a string literal must stay inline, e.g. DATE '2020-01-01'.
+_STRING_PREFIXES = frozenset(('date', 'time', 'timestamp', 'collate', 'binary'))
+
+# Introducers of hexadecimal, bit and national character set literals, which
+# are written right before the quote, e.g. x'AB', b'01' or N'text'.
+_INTRODUCERS = frozenset(('x', 'b', 'n'))
+
+
+# `sql` is the statement to send and `ops` builds its parameters: each op is
+# (True, index of an original parameter) or (False, literal value).
+Template = namedtuple('Template', 'sql ops param_count')
+
+
+def _padded_size(n):
+    size = 1
+    while size < n:
+        size *= 2
+    return size
+
+
+def _in_list(tokens, start):
+    """
+    If tokens[start:] is "(%s, %s, ...)", return the number of placeholders
+    and the index of the closing parenthesis, else None.
+    """
+    i = start
+    while i < len(tokens) and tokens[i][0] == 'space':
+        i += 1
+    if i >= len(tokens) or tokens[i][1] != '(':
+        return None
+    count = 0
+    expect_placeholder = True
+    for i in range(i + 1, len(tokens)):
+        kind, text = tokens[i]
+        if kind == 'space':
+            continue
+        if expect_placeholder and kind == 'placeholder':
+            count += 1
+            expect_placeholder = False
+        elif not expect_placeholder and text == ',':
+            expect_placeholder = True
+        elif not expect_placeholder and text == ')':
+            return count, i
+        else:
+            return None
+    return None
+
+
+def _simple_string(text):
+    """
+    Return the value of a single-quoted literal without escapes, or None.
+    Statements are %-formatted, so a '%' in a literal is written '%%'.
+    """
+    if text[0] != "'" or '\\' in text or "''" in text[1:-1]:
+        return None
+    return text[1:-1].replace('%%', '%')
+
+
+def compile_template(sql, bind_literals=True, pad_in_lists=True):
+    """Return the Template normalizing `sql`, or None if it's left as is."""
+    if statement_type(sql) not in NORMALIZED_STATEMENTS:
+        return None
+    tokens = list(tokenize(sql))
+    out = []
+    ops = []
+    param_count = 0
+    changed = False
+    # The word before each open parenthesis, and the depth of the ORDER BY /
+    # GROUP BY list we're in, if any, where numbers are column positions.
+    parens = []
+    positions = None
+    previous = None
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        if kind == 'placeholder':
+            ops.append((True, param_count))
+            param_count += 1
+        elif kind == 'word':
+            word = text.lower()
+            if word == 'by' and previous and previous[1].lower() in ('order', 'group'):
+                positions = len(parens)
+            elif word in _END_OF_POSITIONS and positions == len(parens):
+                positions = None
+            elif word == 'in' and pad_in_lists:
+                in_list = _in_list(tokens, i + 1)
+                if in_list is not None:
+                    count, end = in_list
+                    size = _padded_size(count)
+                    out.append('%s (%s)' % (text, ', '.join(['%s'] * size)))
+                    ops.extend((True, param_count + j) for j in range(count))
+                    ops.extend([(True, param_count + count - 1)] * (size - count))
+                    param_count += count
+                    changed = changed or size != count
+                    previous = ('other', ')')
+                    i = end + 1
+                    continue
+        elif kind == 'number' and bind_literals and text.isdigit():
+            in_type = parens and parens[-1] in _TYPE_WORDS
+            # The block size of `select next N values from seq`.
+            after_next = previous and previous[1].lower() == 'next'
+            if positions is None and not in_type and not after_next:
+                out.append('%s')
+                ops.append((False, int(text)))
+                changed = True
+                previous = (kind, text)
+                i += 1
+                continue
+        elif kind == 'string' and bind_literals:
+            value = _simple_string(text)
+            prefix = previous and previous[0] == 'word' and (
+                previous[1].lower() in _STRING_PREFIXES or previous[1].startswith('_'))
+            introducer = (i > 0 and tokens[i - 1][0] == 'word' and
+                          tokens[i - 1][1].lower() in _INTRODUCERS)
+            if value is not None and not prefix and not introducer:
+                out.append('%s')
+                ops.append((False, value))
+                changed = True
+                previous = (kind, text)
+                i += 1
+                continue
+        elif text == '(':
+            parens.append(previous[1].lower() if previous and previous[0] == 'word' else None)
+        elif text == ')':
+            if parens:
+                parens.pop()
+            if positions is not None and positions > len(parens):
+                positions = None
+        out.append(text)
+        if kind not in ('space', 'comment'):
+            previous = (kind, text)
+        i += 1
+    if not changed:
+        return None
+    return Template(''.join(out), tuple(ops), param_count)
+
+
+class Normalizer(object):
+    """
+    A Django execute wrapper normalizing statements through an LRU cache of
+    at most `max_templates` compiled Templates.
+    """
+
+    def __init__(self, bind_literals=True, pad_in_lists=True, max_templates=1000):
+        self.bind_literals = bind_literals
+        self.pad_in_lists = pad_in_lists
+        self.max_templates = max_templates
+        self._lock = threading.Lock()
+        self._templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def template(self, sql):
+        with self._lock:
+            try:
+                template = self._templates[sql]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._templates.move_to_end(sql)
+                self.hits += 1
+                return template
+        template = compile_template(sql, self.bind_literals, self.pad_in_lists)
+        with self._lock:
+            self._templates[sql] = template
+            while len(self._templates) > self.max_templates:
+                self._templates.popitem(last=False)
+        return template
+
+    def normalize(self, sql, params):
+        """Return the normalized (sql, params) of a statement."""
+        if params is None:
+            # Statements without parameters aren't %-formatted, so a literal
+            # '%' in them would break once they get some.
+            if '%' in sql:
+                return sql, params
+        elif not isinstance(params, (list, tuple)):
+            return sql, params
+        template = self.template(sql)
+        if template is None or template.param_count != len(params or ()):
+            return sql, params
+        return template.sql, [params[op] if is_param else op
+                              for is_param, op in template.ops]
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many:
+            sql, params = self.normalize(sql, params)
+        return execute(sql, params, many, context)
+
+    def stats(self):
+        with self._lock:
+            return {'templates': len(self._templates), 'hits': self.hits,
+                    'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+
+_normalizers = {}
+_normalizers_lock = threading.Lock()
+
+
+def get_normalizer(alias, **options):
+    """Return the process-wide Normalizer of the database `alias`."""
+    with _normalizers_lock:
+        normalizer = _normalizers.get(alias)
+        if normalizer is None:
+            normalizer = _normalizers[alias] = Normalizer(**options)
+        return normalizer
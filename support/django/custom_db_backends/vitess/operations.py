@@ -0,0 +1,20 @@
+from django.db.backends.mysql.operations import DatabaseOperations as MysqlDatabaseOperations
+
+from .bulk import estimate_row_bytes
+
+
+class DatabaseOperations(MysqlDatabaseOperations):
+
+    def bulk_batch_size(self, fields, objs):
+        """
+        Cap INSERT batches by rows and by an estimate of their size, so that
+        bulk_create() neither sends vtgate one giant statement nor one
+        statement per row. bulk_update() and the deletion collector pass
+        field names rather than fields, and only get the row cap.
+        """
+        max_rows, max_bytes = self.connection.bulk_limits()
+        if not objs or not all(hasattr(field, 'attname') for field in fields):
+            return max_rows
+        sample = objs[:100]
+        row_bytes = sum(estimate_row_bytes(obj, fields) for obj in sample) // len(sample)
+        return max(1, min(len(objs), max_rows, max_bytes // max(row_bytes, 1)))
@@ -0,0 +1,107 @@
+"""
+Statement pipelining for bursts of independent writes.
+
+    with connection.pipeline(as_transaction=True) as pipe:
+        pipe.insert(order, *order_lines)
+        pipe.update(Customer.objects.filter(pk=customer_id), last_order=now)
+        pipe.delete(Cart.objects.filter(customer_id=customer_id))
+
+Statements added to a Pipeline are buffered and sent when the block exits:
+in a single ExecuteBatch round-trip with the gRPC transport (plus a COMMIT
+if as_transaction), or one by one (in a BEGIN/COMMIT if as_transaction)
+over the MySQL protocol. Since nothing
+runs until the flush, the statements must not depend on each other's
+results; inserted objects need their primary key set, and deletes don't
+cascade or send signals. If the block raises, the buffer is discarded.
+"""
+from django.db.models import sql
+
+
+class Pipeline(object):
+
+    def __init__(self, connection, as_transaction=False):
+        self.connection = connection
+        self.as_transaction = as_transaction
+        self.statements = []
+        self._inserted = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def execute(self, sql_text, params=None):
+        """Buffer a raw statement."""
+        self.statements.append((sql_text, params))
+
+    def insert(self, *objs):
+        """Buffer INSERTs of model instances, one per model."""
+        by_model = {}
+        for obj in objs:
+            if obj.pk is None:
+                raise ValueError("Can't pipeline the insert of %r without a primary key." % obj)
+            by_model.setdefault(type(obj), []).append(obj)
+        for model, model_objs in by_model.items():
+            query = sql.InsertQuery(model)
+            query.insert_values(model._meta.concrete_fields, model_objs, raw=False)
+            for sql_text, params in query.get_compiler(connection=self.connection).as_sql():
+                self.execute(sql_text, params)
+            self._inserted.extend(model_objs)
+
+    def update(self, queryset, **values):
+        """Buffer queryset.update(**values)."""
+        query = queryset.query.chain(sql.UpdateQuery)
+        query.add_update_values(values)
+        query.annotations = {}
+        self.execute(*query.get_compiler(connection=self.connection).as_sql())
+
+    def delete(self, queryset):
+        """Buffer a DELETE of the rows of `queryset`, without cascades or signals."""
+        query = queryset.query.clone()
+        query.__class__ = sql.DeleteQuery
+        self.execute(*query.get_compiler(connection=self.connection).as_sql())
+
+    def flush(self):
+        """Send the buffered statements and return their row counts."""
+        statements, self.statements = self.statements, []
+        inserted, self._inserted = self._inserted, []
+        if not statements:
+            return []
+        connection = self.connection
+        connection.ensure_connection()
+        try:
+            with connection.wrap_database_errors:
+                if connection.transport == 'grpc':
+                    results = connection.connection.execute_batch(
+                        statements, as_transaction=self.as_transaction)
+                    rowcounts = [result.rows_affected for result in results]
+                else:
+                    rowcounts = self._execute_sequentially(statements)
+        finally:
+            # After the writes, like CachingCursor: results read before
+            # they committed must not stay cached.
+            if connection.result_cache is not None:
+                for sql_text, _ in statements:
+                    connection.result_cache.invalidate_statement(sql_text, connection)
+        for obj in inserted:
+            obj._state.adding = False
+            obj._state.db = connection.alias
+        return rowcounts
+
+    def _execute_sequentially(self, statements):
+        cursor = self.connection.connection.cursor()
+        try:
+            if self.as_transaction:
+                cursor.execute('begin')
+            rowcounts = []
+            try:
+                for sql_text, params in statements:
+                    cursor.execute(sql_text, params)
+                    rowcounts.append(cursor.rowcount)
+            except Exception:
+                if self.as_transaction:
+                    cursor.execute('rollback')
+                raise
+            if self.as_transaction:
+                cursor.execute('commit')
+            return rowcounts
+        finally:
+            cursor.close()
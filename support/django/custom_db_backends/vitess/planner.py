@@ -0,0 +1,466 @@
+"""
+Predict how vtgate routes simple statements, from the vschema alone.
+
+Planner.route() looks at single-table SELECT, INSERT, UPDATE and DELETE
+statements and, from the column vindexes of the table and the equality and
+IN conditions ANDed together in their WHERE clause, predicts the route
+vtgate will pick (named after its route opcodes: Unsharded, Reference,
+EqualUnique, Equal, IN, Scatter, plus Insert) and, when the vindex can be
+computed client-side and the shards are known, which shards it touches.
+Joins, subqueries, unions and other statements are not predicted.
+
+It needs neither Django nor a running vtgate, so it can lint statements
+before deploying:
+
+    python -m custom_db_backends.vitess.planner \\
+        --vschema examples/local/vschema_customer_sharded.json \\
+        --keyspace customer --shards=-80,80- queries.sql
+
+prints the route of every statement of queries.sql (one per line, or
+separated by semicolons) and exits with status 1 if any is a scatter.
+"""
+import argparse
+import json
+import sys
+
+from .keyrange import KeyRange, ShardResolver
+from .sqlutil import tokenize
+from .vindexes import VindexError
+from .vschema import load_keyspace, load_vschema
+
+UNSHARDED = 'Unsharded'
+REFERENCE = 'Reference'
+EQUAL_UNIQUE = 'EqualUnique'
+EQUAL = 'Equal'
+IN = 'IN'
+SCATTER = 'Scatter'
+INSERT = 'Insert'
+
+
+class ScatterQueryError(Exception):
+    """Raised by DatabaseWrapper.forbid_scatter() for a predicted scatter."""
+
+
+_END_OF_TABLE = frozenset(('WHERE', 'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'FOR',
+                           'LOCK', 'SET', 'WINDOW', 'UNION', 'INTO'))
+_END_OF_WHERE = frozenset(('GROUP', 'ORDER', 'LIMIT', 'HAVING', 'FOR', 'LOCK',
+                           'WINDOW', 'UNION', 'INTO'))
+
+
+class Route(object):
+    """
+    The predicted route of a statement. `shards` is the list of shards it
+    touches, or None if that takes vtgate (e.g. a lookup vindex) or the
+    shards of the keyspace aren't known.
+    """
+
+    def __init__(self, opcode, keyspace, table, vindex=None, values=None, shards=None):
+        self.opcode = opcode
+        self.keyspace = keyspace
+        self.table = table
+        self.vindex = vindex
+        self.values = values
+        self.shards = shards
+
+    @property
+    def scatter(self):
+        return self.opcode == SCATTER
+
+    def __repr__(self):
+        return 'Route(%s, %s.%s%s%s)' % (
+            self.opcode, self.keyspace, self.table,
+            ', vindex=%s' % self.vindex if self.vindex else '',
+            ', shards=%s' % ','.join(self.shards) if self.shards is not None else '')
+
+
+class _Statement(object):
+    """The significant tokens of a statement, with its parameters bound."""
+
+    def __init__(self, sql, params):
+        params = list(params or ())
+        self.tokens = []
+        self.values = {}
+        for kind, text in tokenize(sql):
+            if kind in ('space', 'comment'):
+                continue
+            if kind == 'placeholder':
+                self.values[len(self.tokens)] = params.pop(0) if params else None
+            self.tokens.append((kind, text))
+        self.upper = [text.upper() if kind == 'word' else text for kind, text in self.tokens]
+
+    def value(self, index):
+        """
+        Return the literal or parameter at `index` and the index after it,
+        or raise ValueError if there is none.
+        """
+        kind, text = self.tokens[index]
+        if kind == 'placeholder':
+            return self.values[index], index + 1
+        if kind == 'number':
+            return (float(text) if '.' in text or 'e' in text.lower() else int(text, 0)), index + 1
+        if kind == 'string' and text[0] == "'":
+            return text[1:-1].replace("''", "'").replace("\\'", "'"), index + 1
+        if text == '-' and index + 1 < len(self.tokens) and self.tokens[index + 1][0] == 'number':
+            value, end = self.value(index + 1)
+            return -value, end
+        raise ValueError(text)
+
+    def has_subquery(self):
+        return any(text == 'SELECT' and i and self.tokens[i - 1][1] == '('
+                   for i, text in enumerate(self.upper))
+
+
+def _name(kind, text):
+    if kind == 'ident':
+        return text[1:-1].replace('``', '`')
+    return text
+
+
+class Planner(object):
+    """
+    Predict routes from `keyspaces`, a dict of vschema.Keyspace by name.
+    `shards` maps keyspace names to their ShardResolver, and unqualified
+    tables belong to `default_keyspace`.
+    """
+
+    def __init__(self, keyspaces, shards=None, default_keyspace=None):
+        self.keyspaces = keyspaces
+        self.shards = dict(shards or {})
+        if default_keyspace is None and len(keyspaces) == 1:
+            default_keyspace = next(iter(keyspaces))
+        self.default_keyspace = default_keyspace
+
+    def route(self, sql, params=None):
+        """Return the Route of `sql`, or None if it can't be predicted."""
+        statement = _Statement(sql, params)
+        if not statement.tokens or statement.has_subquery():
+            return None
+        keyword = statement.upper[0]
+        if keyword == 'SELECT':
+            return self._route_select(statement)
+        if keyword == 'UPDATE':
+            return self._route_where(statement, 1)
+        if keyword == 'DELETE' and statement.upper[1:2] == ['FROM']:
+            return self._route_where(statement, 2)
+        if keyword in ('INSERT', 'REPLACE'):
+            return self._route_insert(statement)
+        return None
+
+    def _table_at(self, statement, index):
+        """
+        Return the (keyspace name, vschema Table or None, table name) of the
+        table reference at `index`, and the index after it and its alias.
+        """
+        tokens = statement.tokens
+        keyspace, name = self.default_keyspace, _name(*tokens[index])
+        index += 1
+        if index + 1 < len(tokens) and tokens[index][1] == '.':
+            keyspace, name = name, _name(*tokens[index + 1])
+            index += 2
+        # Skip the alias.
+        if index < len(tokens) and statement.upper[index] == 'AS':
+            index += 2
+        elif (index < len(tokens) and tokens[index][0] in ('word', 'ident') and
+                statement.upper[index] not in _END_OF_TABLE):
+            index += 1
+        table = None
+        if keyspace in self.keyspaces:
+            table = self.keyspaces[keyspace].tables.get(name)
+        return (keyspace, table, name), index
+
+    def _route_select(self, statement):
+        try:
+            start = statement.upper.index('FROM') + 1
+        except ValueError:
+            return None
+        if 'UNION' in statement.upper or 'JOIN' in statement.upper:
+            return None
+        (keyspace, table, name), index = self._table_at(statement, start)
+        if index < len(statement.tokens) and statement.tokens[index][1] in (',', '('):
+            return None
+        if table is not None and table.type == 'reference':
+            return Route(REFERENCE, keyspace, name, shards=self._any_shard(keyspace))
+        return self._route_where(statement, start)
+
+    def _route_where(self, statement, start):
+        (keyspace, table, name), index = self._table_at(statement, start)
+        if statement.tokens[index:index + 1] == [('other', ',')]:
+            return None
+        ks = self.keyspaces.get(keyspace)
+        if ks is None:
+            return None
+        if not ks.sharded or (table is not None and table.type == 'sequence'):
+            return Route(UNSHARDED, keyspace, name, shards=self._any_shard(keyspace))
+        if table is not None and table.pinned:
+            keyspace_id = bytes.fromhex(table.pinned)
+            return Route(EQUAL_UNIQUE, keyspace, name,
+                         shards=self._shards_of(keyspace, [keyspace_id]))
+        conditions = self._conditions(statement)
+        if table is not None and conditions:
+            vindexes = sorted(table.column_vindexes,
+                              key=lambda column_vindex: (column_vindex.vindex.cost,
+                                                         not column_vindex.vindex.unique))
+            for column_vindex in vindexes:
+                values = conditions.get(column_vindex.column.lower())
+                if values is None:
+                    continue
+                vindex = column_vindex.vindex
+                if len(values) != 1:
+                    opcode = IN
+                else:
+                    opcode = EQUAL_UNIQUE if vindex.unique else EQUAL
+                shards = None
+                if vindex.client_side:
+                    try:
+                        shards = self._shards_of(keyspace, vindex.map(values))
+                    except VindexError:
+                        shards = None
+                return Route(opcode, keyspace, name, vindex.name, values, shards)
+        return Route(SCATTER, keyspace, name, shards=self._all_shards(keyspace))
+
+    def _conditions(self, statement):
+        """
+        Return {column: values} of the `column = value` and `column IN
+        (values)` conditions ANDed at the top level of the WHERE clause,
+        directly or inside parentheses that only AND conditions together.
+        Negated conditions, and conditions compared to NULL, match rows
+        anywhere and are left out.
+        """
+        upper = statement.upper
+        try:
+            index = upper.index('WHERE') + 1
+        except ValueError:
+            return {}
+        end = len(upper)
+        # The index of the '(' opening the group of each token inside one,
+        # and the groups with an OR (or XOR, or ||) of their own.
+        groups = {}
+        with_or = set()
+        opened = []
+        for i in range(index, len(upper)):
+            groups[i] = opened[-1] if opened else None
+            if upper[i] == '(':
+                opened.append(i)
+            elif upper[i] == ')':
+                if opened:
+                    opened.pop()
+            elif upper[i] in ('OR', 'XOR', '|'):
+                if not opened:
+                    return {}
+                with_or.add(opened[-1])
+            elif not opened and upper[i] in _END_OF_WHERE:
+                end = i
+                break
+        conditions = {}
+        i = index
+        while i < end:
+            if not self._anded(statement, i, groups, with_or):
+                i += 1
+                continue
+            start = i
+            column, i = self._column_at(statement, i)
+            if column is None:
+                i += 1
+                continue
+            try:
+                if upper[i] == '=':
+                    value, i = statement.value(i + 1)
+                    values = [value]
+                elif upper[i] == 'IN' and upper[i + 1] == '(':
+                    values = []
+                    i += 2
+                    while True:
+                        value, i = statement.value(i)
+                        values.append(value)
+                        if upper[i] == ')':
+                            i += 1
+                            break
+                        if upper[i] != ',':
+                            raise ValueError(upper[i])
+                        i += 1
+                else:
+                    continue
+            except (ValueError, IndexError):
+                continue
+            if i < end and upper[i] not in ('AND', ')'):
+                # e.g. `a = 1 + b`.
+                continue
+            if upper[start - 1] in ('NOT', '!'):
+                continue
+            # NULL equals nothing, not even NULL.
+            values = [value for value in values if value is not None]
+            if not values:
+                continue
+            # Rows must match every condition: keep the values of the
+            # narrowest one.
+            if column not in conditions or len(values) < len(conditions[column]):
+                conditions[column] = values
+        return conditions
+
+    def _anded(self, statement, index, groups, with_or):
+        """
+        Whether the token at `index` is ANDed with the top level of the
+        WHERE clause: every parenthesis around it opens a group of conditions
+        (not e.g. a function call or a NOT) without an OR of its own.
+        """
+        group = groups.get(index)
+        while group is not None:
+            if (group in with_or or
+                    statement.upper[group - 1] not in ('WHERE', 'AND', '(')):
+                return False
+            group = groups.get(group)
+        return True
+
+    def _column_at(self, statement, index):
+        """Return the column named at `index`, without qualifiers, and the index after it."""
+        tokens = statement.tokens
+        if tokens[index][0] not in ('word', 'ident'):
+            return None, index
+        if index > 0 and tokens[index - 1][1] == '.':
+            return None, index
+        name = _name(*tokens[index])
+        index += 1
+        while index + 1 < len(tokens) and tokens[index][1] == '.':
+            name = _name(*tokens[index + 1])
+            index += 2
+        if index >= len(tokens):
+            return None, index
+        return name.lower(), index
+
+    def _route_insert(self, statement):
+        upper = statement.upper
+        index = 1
+        while upper[index] in ('IGNORE', 'INTO', 'LOW_PRIORITY', 'DELAYED', 'HIGH_PRIORITY'):
+            index += 1
+        (keyspace, table, name), index = self._table_at(statement, index)
+        ks = self.keyspaces.get(keyspace)
+        if ks is None:
+            return None
+        if not ks.sharded:
+            return Route(UNSHARDED, keyspace, name, shards=self._any_shard(keyspace))
+        if table is None or table.primary_vindex is None or upper[index:index + 1] != ['(']:
+            return None
+        columns = []
+        index += 1
+        while upper[index] != ')':
+            if upper[index] != ',':
+                columns.append(_name(*statement.tokens[index]).lower())
+            index += 1
+        if upper[index + 1:index + 2] not in (['VALUES'], ['VALUE']):
+            return None
+        vindex = table.primary_vindex.vindex
+        try:
+            position = columns.index(table.primary_vindex.column.lower())
+        except ValueError:
+            # The value comes from the auto_increment sequence.
+            return Route(INSERT, keyspace, name, vindex.name)
+        values = []
+        index += 2
+        while index < len(upper) and upper[index] == '(':
+            row, depth, index = [[]], 0, index + 1
+            while depth or upper[index] != ')':
+                if upper[index] in ('(', ')'):
+                    depth += 1 if upper[index] == '(' else -1
+                if upper[index] == ',' and not depth:
+                    row.append([])
+                else:
+                    row[-1].append(index)
+                index += 1
+            try:
+                cell = row[position]
+                value, end = statement.value(cell[0])
+                if end != cell[-1] + 1:
+                    raise ValueError(cell)
+            except (ValueError, IndexError):
+                value = None
+            values.append(value)
+            index += 1
+            if index < len(upper) and upper[index] == ',':
+                index += 1
+        shards = None
+        if vindex.client_side and None not in values:
+            try:
+                shards = self._shards_of(keyspace, vindex.map(values))
+            except VindexError:
+                shards = None
+        return Route(INSERT, keyspace, name, vindex.name, values, shards)
+
+    def _all_shards(self, keyspace):
+        resolver = self.shards.get(keyspace)
+        return list(resolver.shards) if resolver is not None else None
+
+    def _any_shard(self, keyspace):
+        shards = self._all_shards(keyspace)
+        return shards[:1] if shards else None
+
+    def _shards_of(self, keyspace, keyspace_ids):
+        resolver = self.shards.get(keyspace)
+        if resolver is None:
+            return None
+        return sorted({resolver.shard_for_keyspace_id(keyspace_id)
+                       for keyspace_id in keyspace_ids if keyspace_id is not None},
+                      key=lambda shard: KeyRange.from_shard_name(shard).start)
+
+
+def route_queryset(queryset):
+    """Return the Route of the SELECT of a Django queryset, or None."""
+    from django.db import connections
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(connection=connection).as_sql()
+    return connection.planner.route(sql, params)
+
+
+def _statements(text):
+    statement = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('--') or line.startswith('#'):
+            continue
+        statement.append(line)
+        if line.endswith(';') or ';' not in text:
+            yield ' '.join(statement).rstrip(';')
+            statement = []
+    if statement:
+        yield ' '.join(statement).rstrip(';')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Predict the vtgate routes of SQL statements and flag scatters.')
+    parser.add_argument('--vschema', required=True,
+                        help='JSON file of a keyspace vschema, or of a SrvVSchema')
+    parser.add_argument('--keyspace',
+                        help='the keyspace of a keyspace vschema, and of unqualified tables')
+    parser.add_argument('--shards', help='comma separated shard names of the keyspace, '
+                                         'e.g. --shards=-80,80-')
+    parser.add_argument('files', nargs='*', help='SQL files (default: standard input)')
+    args = parser.parse_args(argv)
+    with open(args.vschema) as f:
+        vschema = json.load(f)
+    if 'keyspaces' in vschema:
+        keyspaces = load_vschema(vschema)
+    elif args.keyspace:
+        keyspaces = {args.keyspace: load_keyspace(args.keyspace, vschema)}
+    else:
+        parser.error('--keyspace is required with the vschema of a keyspace')
+    planner = Planner(keyspaces, default_keyspace=args.keyspace)
+    if args.shards:
+        if planner.default_keyspace is None:
+            parser.error('--shards needs --keyspace')
+        planner.shards[planner.default_keyspace] = ShardResolver(args.shards.split(','))
+    texts = [open(path).read() for path in args.files] or [sys.stdin.read()]
+    scatters = 0
+    for text in texts:
+        for sql in _statements(text):
+            route = planner.route(sql)
+            if route is None:
+                print('%-12s %-12s %s' % ('?', '', sql))
+                continue
+            scatters += route.scatter
+            shards = ','.join(route.shards) if route.shards is not None else '?'
+            print('%-12s %-12s %s' % (route.opcode, shards, sql))
+    return 1 if scatters else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+A bounded, thread-safe pool of raw MySQL protocol connections to vtgate.
+
+Django opens one connection per thread and closes it at the end of each
+request (unless CONN_MAX_AGE is set), which means a fresh TCP and MySQL
+handshake against vtgate for almost every request. The pool keeps those
+connections warm and shares them between the threads of a process.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+
+
+class PoolTimeout(OperationalError):
+    """Raised when no connection became available within the pool timeout."""
+
+
+class PooledConnection(object):
+    """A raw DB-API connection plus the bookkeeping the pool needs."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # The session.SessionState of the connection, set by the backend.
+        self.session = None
+
+
+class ConnectionPool(object):
+    """
+    Hand out connections created by `connect`, keeping at most `max_size`
+    of them open. Callers wait up to `timeout` seconds for a free connection.
+    Connections older than `max_lifetime` seconds are closed instead of being
+    reused, and connections idle for more than `health_check_interval`
+    seconds are pinged before being handed out.
+    """
+
+    def __init__(self, connect, max_size=10, timeout=30, max_lifetime=3600,
+                 health_check_interval=30):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()
+        # The connection parameters `connect` was built from, see get_pool().
+        self.params = None
+        self._idle = deque()
+        self._size = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._counters = {
+            'connects': 0,
+            'reuses': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'expired': 0,
+            'failed_health_checks': 0,
+            'discarded': 0,
+            'wait_time': 0.0,
+        }
+
+    def _expired(self, entry, now):
+        return (self.max_lifetime is not None and
+                now - entry.created_at >= self.max_lifetime)
+
+    def _needs_health_check(self, entry, now):
+        return (self.health_check_interval is not None and
+                now - entry.last_used >= self.health_check_interval)
+
+    def _checkout(self):
+        """
+        Return an idle entry, or None if the caller is allowed to open a new
+        connection. Entries that have to be closed are returned in the second
+        element so that closing happens outside the lock.
+        """
+        deadline = time.monotonic() + self.timeout
+        to_close = []
+        waited = False
+        timed_out = False
+        with self._cond:
+            while not timed_out:
+                now = time.monotonic()
+                while self._idle:
+                    entry = self._idle.pop()
+                    if self._expired(entry, now):
+                        self._counters['expired'] += 1
+                        self._size -= 1
+                        to_close.append(entry)
+                        continue
+                    self._counters['reuses'] += 1
+                    return entry, to_close
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, to_close
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    timed_out = True
+                    continue
+                if not waited:
+                    self._counters['waits'] += 1
+                    waited = True
+                self._waiting += 1
+                started = time.monotonic()
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                    self._counters['wait_time'] += time.monotonic() - started
+        self._close_entries(to_close)
+        raise PoolTimeout(
+            'Timed out after %ss waiting for a vtgate connection '
+            '(pool size %d).' % (self.timeout, self.max_size))
+
+    def acquire(self):
+        """Return a PooledConnection, opening a new one if needed."""
+        while True:
+            entry, to_close = self._checkout()
+            self._close_entries(to_close)
+            if entry is None:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._counters['connects'] += 1
+                return PooledConnection(connection)
+            if (self._needs_health_check(entry, time.monotonic()) and
+                    not self._is_healthy(entry)):
+                with self._cond:
+                    self._counters['failed_health_checks'] += 1
+                self.release(entry, discard=True)
+                continue
+            return entry
+
+    def release(self, entry, discard=False):
+        """Give `entry` back to the pool, closing it if it can't be reused."""
+        now = time.monotonic()
+        if not discard and self._expired(entry, now):
+            discard = True
+        with self._cond:
+            if discard:
+                self._size -= 1
+                self._counters['discarded'] += 1
+            else:
+                entry.last_used = now
+                self._idle.append(entry)
+            self._cond.notify()
+        if discard:
+            self._close_entries([entry])
+
+    def close_idle(self):
+        """Close every idle connection, e.g. before the process exits."""
+        with self._cond:
+            entries = list(self._idle)
+            self._idle.clear()
+            self._size -= len(entries)
+            self._cond.notify_all()
+        self._close_entries(entries)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting,
+            })
+        return stats
+
+    def _is_healthy(self, entry):
+        try:
+            entry.connection.ping()
+        except Exception:
+            return False
+        return True
+
+    def _close_entries(self, entries):
+        for entry in entries:
+            try:
+                entry.connection.close()
+            except Exception:
+                pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, connect, params=None, **options):
+    """
+    Return the process-wide pool for the database `alias`, creating it with
+    `connect` and `options` on first use. `params` are the connection
+    parameters `connect` uses: the pool keeps the `connect` of the caller that
+    created it, so a caller with different parameters (e.g. after the settings
+    of the alias were overridden) gets a new pool, and the idle connections of
+    the old one are closed. Pools inherited across a fork are dropped without
+    closing their sockets, which belong to the parent.
+    """
+    stale = None
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is not None and pool.pid == os.getpid() and pool.params != params:
+            stale, pool = pool, None
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[alias] = ConnectionPool(connect, **options)
+            pool.params = params
+    if stale is not None:
+        stale.close_idle()
+    return pool
+
+
+def all_stats():
+    """Return the stats of every pool in this process, keyed by alias."""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items()}
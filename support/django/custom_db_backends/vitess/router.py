@@ -0,0 +1,116 @@
+"""
+Route ORM reads to replica or rdonly tablets and everything else to the
+primary.
+
+A replica alias is an ordinary database entry pointing at the same vtgate as
+its primary, with the tablet type and the primary alias in its VITESS
+settings:
+
+    DATABASES = {
+        'default': {'ENGINE': 'custom_db_backends.vitess', 'NAME': 'commerce', ...},
+        'default_replica': {
+            'ENGINE': 'custom_db_backends.vitess', 'NAME': 'commerce', ...,
+            'VITESS': {'TABLET_TYPE': 'replica', 'PRIMARY': 'default'},
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+    DATABASE_ROUTERS = ['custom_db_backends.vitess.router.TabletTypeRouter']
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY_TABLET_TYPE = 'master'
+
+_local = threading.local()
+
+
+def _tablet_aliases():
+    """Map each primary alias to a {tablet_type: alias} dict of its replicas."""
+    aliases = {}
+    for alias, settings_dict in connections.databases.items():
+        vitess_settings = settings_dict.get('VITESS') or {}
+        tablet_type = vitess_settings.get('TABLET_TYPE')
+        if tablet_type:
+            primary = vitess_settings.get('PRIMARY', 'default')
+            aliases.setdefault(primary, {})[tablet_type.lower()] = alias
+    return aliases
+
+
+def _primary_alias(alias):
+    vitess_settings = connections.databases[alias].get('VITESS') or {}
+    if vitess_settings.get('TABLET_TYPE'):
+        return vitess_settings.get('PRIMARY', 'default')
+    return alias
+
+
+def tablet_alias(tablet_type, using='default'):
+    """
+    Return the alias serving `tablet_type` for the primary alias `using`, to
+    be passed to QuerySet.using(), e.g.
+    Customer.objects.using(tablet_alias('rdonly')).
+    """
+    primary = _primary_alias(using)
+    if tablet_type.lower() == PRIMARY_TABLET_TYPE:
+        return primary
+    try:
+        return _tablet_aliases()[primary][tablet_type.lower()]
+    except KeyError:
+        raise ValueError(
+            "No database alias serves tablet type '%s' for '%s'." %
+            (tablet_type, primary))
+
+
+@contextmanager
+def read_from(tablet_type):
+    """
+    Route the reads made by this thread inside the block to `tablet_type`,
+    e.g. `with read_from('master'):` for read-after-write consistency.
+    """
+    previous = getattr(_local, 'tablet_type', None)
+    _local.tablet_type = tablet_type.lower()
+    try:
+        yield
+    finally:
+        _local.tablet_type = previous
+
+
+class TabletTypeRouter(object):
+    """
+    Send reads to the alias serving VITESS_READ_TABLET_TYPE ('replica' by
+    default) and writes to the primary. Reads issued while the primary is
+    inside a transaction stay on the primary so they see its writes.
+    """
+
+    def __init__(self):
+        self.read_tablet_type = getattr(
+            settings, 'VITESS_READ_TABLET_TYPE', 'replica').lower()
+        self.default_alias = getattr(settings, 'VITESS_PRIMARY_ALIAS', 'default')
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        primary = self.default_alias
+        if instance is not None and instance._state.db:
+            primary = _primary_alias(instance._state.db)
+        if connections[primary].in_atomic_block:
+            return primary
+        tablet_type = getattr(_local, 'tablet_type', None) or self.read_tablet_type
+        if tablet_type == PRIMARY_TABLET_TYPE:
+            return primary
+        return _tablet_aliases().get(primary, {}).get(tablet_type, primary)
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return _primary_alias(instance._state.db)
+        return self.default_alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not obj1._state.db or not obj2._state.db:
+            return None
+        return _primary_alias(obj1._state.db) == _primary_alias(obj2._state.db)
+
+    def allow_migrate(self, db, app_label, **hints):
+        return _primary_alias(db) == db
@@ -0,0 +1,254 @@
+"""
+Tracking of the vtgate session state of connections.
+
+Besides autocommit, which Django manages itself, a vtgate session carries
+its target (changed by USE), vtgate's own variables (workload,
+transaction_mode) and the system and user variables changed by SET. The
+backend records the USE and SET statements run on each connection in its
+SessionState, so that when a pooled connection is handed to the next
+request only the statements needed to go back to the expected state are
+sent, usually none. A SET the state can't follow (e.g. of a computed
+value) makes the connection be discarded instead of reused.
+"""
+from .sqlutil import tokenize
+
+# Variables whose default value isn't restored by `= DEFAULT`; None means
+# the default is a vtgate flag, so it can't be restored at all.
+_DEFAULTS = {
+    'workload': "'oltp'",
+    'transaction_mode': None,
+}
+
+# Variables managed by Django itself.
+_IGNORED = frozenset(('autocommit',))
+
+_SCOPES = frozenset(('SESSION', 'LOCAL'))
+_OTHER_SCOPES = frozenset(('GLOBAL', 'PERSIST', 'PERSIST_ONLY'))
+
+
+class UnknownSessionState(Exception):
+    """Raised for a statement whose effect on the session can't be tracked."""
+
+
+def literal(value):
+    """Return `value` as a SQL literal."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'%s'" % str(value).replace('\\', '\\\\').replace("'", "''")
+
+
+def default_value(name):
+    """The literal `name` takes in a new session, or None if unknown."""
+    if name.startswith('@'):
+        return 'NULL'
+    return _DEFAULTS.get(name, 'DEFAULT')
+
+
+def _significant_tokens(sql):
+    return [(kind, text) for kind, text in tokenize(sql)
+            if kind not in ('space', 'comment')]
+
+
+def _split_statements(tokens):
+    statement = []
+    for kind, text in tokens:
+        if text == ';':
+            if statement:
+                yield statement
+            statement = []
+        else:
+            statement.append((kind, text))
+    if statement:
+        yield statement
+
+
+def _split_assignments(tokens):
+    assignment, depth = [], 0
+    for kind, text in tokens:
+        if text == '(':
+            depth += 1
+        elif text == ')':
+            depth -= 1
+        elif text == ',' and depth == 0:
+            yield assignment
+            assignment = []
+            continue
+        assignment.append((kind, text))
+    yield assignment
+
+
+def _unquote(kind, text):
+    if kind == 'ident':
+        return text[1:-1].replace('``', '`')
+    return text
+
+
+class SessionState(object):
+    """
+    The target and variables of one vtgate session, as far as the
+    statements run on it tell. `values` maps lower-cased variable names
+    (user variables with their '@') to SQL literals.
+    """
+
+    def __init__(self, target=None):
+        self.target = target
+        self.values = {}
+        # The values set when the connection was initialized, which every
+        # request expects.
+        self.baseline = {}
+        self.initialized = False
+        self.unknown = False
+
+    def mark_initialized(self, before):
+        """
+        Record the values the initialization of the connection changed
+        from `before` as what every request expects.
+        """
+        self.baseline = {name: value for name, value in self.values.items()
+                         if before.get(name) != value}
+        self.unknown = False
+        self.initialized = True
+
+    def observe(self, sql, params=None):
+        """Record the effect of `sql`, which ran successfully, on the session."""
+        head = sql.lstrip()[:3].upper()
+        if head not in ('SET', 'USE') and not head.startswith('/*'):
+            return
+        params = list(params) if params else []
+        try:
+            for statement in _split_statements(_significant_tokens(sql)):
+                self._observe_statement(statement, params)
+        except UnknownSessionState:
+            self.unknown = True
+
+    def _observe_statement(self, tokens, params):
+        keyword = tokens[0][1].upper()
+        if keyword == 'USE':
+            if len(tokens) < 2:
+                raise UnknownSessionState(tokens)
+            self.target = ''.join(_unquote(*token) for token in tokens[1:])
+        elif keyword == 'SET':
+            for assignment in _split_assignments(tokens[1:]):
+                self._observe_assignment(assignment, params)
+
+    def _observe_assignment(self, tokens, params):
+        texts = [text for _, text in tokens]
+        scope = texts[0].upper() if texts else ''
+        if scope in _OTHER_SCOPES:
+            return
+        if scope in _SCOPES:
+            tokens, texts = tokens[1:], texts[1:]
+        if texts and texts[0].upper() == 'TRANSACTION':
+            # Without a scope, SET TRANSACTION only applies to the next
+            # transaction.
+            if scope in _SCOPES:
+                self._observe_transaction(texts[1:])
+            return
+        if texts[:2] == ['@', '@']:
+            texts = texts[2:]
+            if len(texts) > 2 and texts[1] == '.':
+                if texts[0].upper() in _OTHER_SCOPES:
+                    return
+                texts = texts[2:]
+            name = texts[0].lower()
+        elif texts[:1] == ['@']:
+            name = '@' + _unquote(*tokens[1]).lower()
+            texts = texts[1:]
+        elif tokens and tokens[0][0] == 'word':
+            name = texts[0].lower()
+        else:
+            raise UnknownSessionState(texts)
+        if name in ('names', 'character', 'charset', 'password', 'role'):
+            raise UnknownSessionState(texts)
+        if len(texts) < 3 or texts[1] not in ('=', ':'):
+            raise UnknownSessionState(texts)
+        value = texts[3:] if texts[1] == ':' else texts[2:]
+        if name not in _IGNORED:
+            self.values[name] = self._value(tokens[len(tokens) - len(value):], params)
+
+    def _observe_transaction(self, texts):
+        words = [text.upper() for text in texts]
+        if words[:2] == ['ISOLATION', 'LEVEL'] and 3 <= len(words) <= 4:
+            self.values['transaction_isolation'] = "'%s'" % '-'.join(words[2:])
+        elif words in (['READ', 'ONLY'], ['READ', 'WRITE']):
+            self.values['transaction_read_only'] = '1' if words[1] == 'ONLY' else '0'
+        else:
+            raise UnknownSessionState(texts)
+
+    def _value(self, tokens, params):
+        if len(tokens) == 2 and tokens[0][1] == '-' and tokens[1][0] == 'number':
+            return '-' + tokens[1][1]
+        if len(tokens) != 1:
+            # An expression, which may not give the same value twice.
+            raise UnknownSessionState(tokens)
+        kind, text = tokens[0]
+        if kind == 'placeholder':
+            if not params:
+                raise UnknownSessionState(tokens)
+            return literal(params.pop(0))
+        if kind in ('string', 'number'):
+            return text
+        if kind == 'word':
+            return text.upper()
+        raise UnknownSessionState(tokens)
+
+    def delta(self, target, values):
+        """
+        Return the statements taking the session to `target` with the
+        variables in `values` (a dict of SQL literals) and every other
+        variable at its baseline value, or None if that takes a new
+        connection.
+        """
+        if self.unknown:
+            return None
+        statements = []
+        if target is not None and target != self.target:
+            statements.append('USE `%s`' % target.replace('`', '``'))
+        wanted = dict(self.baseline)
+        wanted.update(values)
+        assignments = []
+        for name in sorted(set(self.values) | set(wanted)):
+            current = self.values.get(name, default_value(name))
+            value = wanted.get(name, default_value(name))
+            if current == value:
+                continue
+            if value is None:
+                return None
+            assignments.append('%s = %s' % (name, value))
+        if assignments:
+            statements.append('SET ' + ', '.join(assignments))
+        return statements
+
+    def apply(self, execute, target, values):
+        """
+        Run the delta() to `target` and `values` with `execute`, a function
+        taking a statement; return False if it takes a new connection.
+        """
+        statements = self.delta(target, values)
+        if statements is None:
+            return False
+        for statement in statements:
+            execute(statement)
+            self.observe(statement)
+        return True
+
+
+class SessionTracker(object):
+    """
+    An execute wrapper recording the USE and SET statements of a
+    DatabaseWrapper in the SessionState of its current connection.
+    """
+
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        state = self.wrapper.session_state
+        if state is not None and not many:
+            state.observe(sql, params)
+        return result
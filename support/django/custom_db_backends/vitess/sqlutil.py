@@ -0,0 +1,127 @@
+"""
+Lightweight SQL tokenizing helpers, good enough for the statements the ORM
+generates. They never try to parse SQL, only to classify its tokens.
+"""
+import re
+
+_TOKEN_RE = re.compile(r"""
+    (?P<comment>/\*.*?\*/|--[^\n]*|\#[^\n]*)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<ident>`(?:[^`]|``)*`)
+  | (?P<placeholder>%s)
+  | (?P<percent>%%)
+  | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_$][\w$]*)
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+_TABLE_KEYWORDS = frozenset(('FROM', 'JOIN', 'INTO', 'UPDATE', 'TABLE'))
+# The ON and USING of a join don't end its FROM list: "FROM a JOIN b ON
+# (...), c" reads c too.
+_CLAUSE_KEYWORDS = frozenset(('WHERE', 'GROUP', 'ORDER', 'LIMIT', 'HAVING',
+                              'SET', 'VALUES', 'SELECT', 'UNION',
+                              'FOR', 'LOCK', 'WINDOW'))
+
+_VALUE_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)|(?<=\bin )\(\?\)')
+_VALUES_ROWS_RE = re.compile(r'values \(\?\+\)(?:\s*,\s*\(\?\+\))+')
+
+
+def tokenize(sql):
+    """Yield the (kind, text) tokens of `sql`; see _TOKEN_RE for the kinds."""
+    for match in _TOKEN_RE.finditer(sql):
+        yield match.lastgroup, match.group()
+
+
+def statement_type(sql):
+    """Return the leading keyword of `sql` in upper case, e.g. 'SELECT'."""
+    for kind, text in tokenize(sql):
+        if kind == 'word':
+            return text.upper()
+        if kind not in ('comment', 'space') and text != '(':
+            return ''
+    return ''
+
+
+def fingerprint(sql):
+    """
+    Normalize `sql` so that statements differing only in literal values,
+    placeholders, IN-list lengths, comments or whitespace compare equal.
+    """
+    out = []
+    for kind, text in tokenize(sql):
+        if kind == 'comment':
+            continue
+        if kind == 'space':
+            if out and out[-1] != ' ':
+                out.append(' ')
+            continue
+        if kind in ('string', 'number', 'placeholder'):
+            text = '?'
+        elif kind == 'word':
+            text = text.lower()
+        elif kind == 'percent':
+            text = '%'
+        out.append(text)
+    normalized = ''.join(out).strip()
+    # Collapse value lists such as "in (?, ?, ?)" and multi-row VALUES.
+    normalized = _VALUE_LIST_RE.sub('(?+)', normalized)
+    normalized = _VALUES_ROWS_RE.sub(r'values (?+)', normalized)
+    return normalized
+
+
+def add_directive(sql, directive):
+    """
+    Add a vtgate comment directive, e.g. 'QUERY_TIMEOUT_MS=500', to `sql`.
+    vtgate only reads directives right after the leading keyword.
+    """
+    for match in _TOKEN_RE.finditer(sql):
+        if match.lastgroup == 'word':
+            return '%s /*vt+ %s */%s' % (sql[:match.end()], directive, sql[match.end():])
+        if match.lastgroup not in ('comment', 'space'):
+            break
+    return sql
+
+
+def referenced_tables(sql):
+    """
+    Return the names of the tables following FROM, JOIN, INTO, UPDATE or
+    TABLE in `sql`, without quotes or keyspace qualifiers, in lower case.
+    """
+    tables = set()
+    expect_table = False
+    tokens = [(kind, text) for kind, text in tokenize(sql)
+              if kind not in ('space', 'comment')]
+    for i, (kind, text) in enumerate(tokens):
+        if expect_table:
+            if kind in ('word', 'ident'):
+                name = text.strip('`').replace('``', '`')
+                # Skip the keyspace of keyspace.table.
+                if i + 2 < len(tokens) and tokens[i + 1][1] == '.':
+                    name = tokens[i + 2][1].strip('`').replace('``', '`')
+                tables.add(name.lower())
+            expect_table = False
+        if kind == 'word' and text.upper() in _TABLE_KEYWORDS:
+            expect_table = True
+        elif kind == 'other' and text == ',' and _in_from_list(tokens, i):
+            expect_table = True
+    return tables
+
+
+def _in_from_list(tokens, index):
+    """Whether the comma at `index` separates tables of a FROM list."""
+    depth = 0
+    for kind, text in reversed(tokens[:index]):
+        if text == ')':
+            depth += 1
+        elif text == '(':
+            if depth == 0:
+                return False
+            depth -= 1
+        elif depth == 0 and kind == 'word':
+            upper = text.upper()
+            if upper == 'FROM':
+                return True
+            if upper in _CLAUSE_KEYWORDS:
+                return False
+    return False
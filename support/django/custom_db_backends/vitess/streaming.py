@@ -0,0 +1,110 @@
+"""
+Streaming reads for large ORM scans.
+
+QuerySet.iterator() asks the backend for a chunked cursor. The vitess backend
+answers with a StreamingCursor: an unbuffered (SSCursor) cursor on a
+dedicated connection whose session uses workload='olap', so vtgate streams
+the rows from the tablets instead of buffering the whole result, and isn't
+subject to the OLTP row limit. Rows are fetched in chunk_size batches, which
+keeps client memory flat regardless of the size of the result.
+
+The connection is dedicated so that the ORM can keep running queries on the
+regular connection while the stream is open (e.g. inside the loop over the
+iterator); MySQL doesn't allow another statement on a connection until an
+unbuffered result has been fully read.
+"""
+from django.db.backends.mysql.base import CursorWrapper
+from MySQLdb.cursors import SSCursor
+
+
+class StreamingCursor(object):
+    """
+    An SSCursor on its own connection with workload='olap', on `target`
+    (by default the wrapper's get_target()). On close() the connection is
+    returned to the pool, or discarded if the result wasn't fully read; the
+    next user of the connection switches it back to OLTP.
+    """
+
+    def __init__(self, wrapper, target=None):
+        self.wrapper = wrapper
+        self.pooled_connection = None
+        self.connection = None
+        self.cursor = None
+        self.exhausted = True
+        try:
+            values = dict(wrapper.session_values(), workload="'olap'")
+            if wrapper.pool is not None:
+                self.pooled_connection = wrapper.acquire_pooled(values)
+                self.connection = self.pooled_connection.connection
+                state = self.pooled_connection.session
+            else:
+                self.connection = wrapper.connect_unpooled()
+                state = wrapper.new_session_state()
+            self.connection.autocommit(True)
+            state.apply(self.connection.query, target or wrapper.get_target(), values)
+            self.cursor = CursorWrapper(self.connection.cursor(SSCursor))
+        except Exception:
+            self._release(discard=True)
+            raise
+
+    def execute(self, query, args=None):
+        self.exhausted = False
+        return self.cursor.execute(query, args)
+
+    def executemany(self, query, args):
+        self.exhausted = False
+        return self.cursor.executemany(query, args)
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is None:
+            self.exhausted = True
+        return row
+
+    def fetchmany(self, size=None):
+        size = size or self.cursor.arraysize
+        rows = self.cursor.fetchmany(size)
+        if len(rows) < size:
+            self.exhausted = True
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.exhausted = True
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.connection is None:
+            return
+        # Closing an SSCursor reads the rest of its result; dropping the
+        # connection is cheaper when an iteration stopped early.
+        discard = not self.exhausted
+        if not discard:
+            try:
+                self.cursor.close()
+            except self.wrapper.Database.Error:
+                discard = True
+        self._release(discard)
+
+    def _release(self, discard):
+        connection, self.connection = self.connection, None
+        if self.pooled_connection is not None:
+            entry, self.pooled_connection = self.pooled_connection, None
+            self.wrapper.pool.release(entry, discard=discard)
+        elif connection is not None:
+            try:
+                connection.close()
+            except self.wrapper.Database.Error:
+                pass
@@ -0,0 +1,50 @@
+"""
+atomic() with a vtgate transaction mode.
+
+    from custom_db_backends.vitess.transaction import atomic
+
+    @atomic(transaction_mode='TWOPC')
+    def transfer(source, destination, amount):
+        ...
+
+is django.db.transaction.atomic() run in the given transaction mode of
+the connection; see DatabaseWrapper.transaction_mode(). Nested blocks keep
+the mode of the outermost one and may only repeat it.
+"""
+import threading
+from contextlib import ContextDecorator, ExitStack
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+class atomic(ContextDecorator):
+
+    def __init__(self, transaction_mode=None, using=None, savepoint=True):
+        self.transaction_mode = transaction_mode
+        self.using = using or DEFAULT_DB_ALIAS
+        self.savepoint = savepoint
+        # Per thread stacks, since a decorated function may be re-entered.
+        self._local = threading.local()
+
+    @property
+    def _stacks(self):
+        try:
+            return self._local.stacks
+        except AttributeError:
+            stacks = self._local.stacks = []
+            return stacks
+
+    def __enter__(self):
+        stack = ExitStack()
+        try:
+            if self.transaction_mode is not None:
+                stack.enter_context(
+                    connections[self.using].transaction_mode(self.transaction_mode))
+            stack.enter_context(transaction.atomic(self.using, self.savepoint))
+        except BaseException:
+            stack.close()
+            raise
+        self._stacks.append(stack)
+
+    def __exit__(self, *exc_info):
+        return self._stacks.pop().__exit__(*exc_info)
@@ -0,0 +1,441 @@
+"""
+Client-side implementations of the functional vindexes of
+go/vt/vtgate/vindexes, so the backend can compute keyspace ids and target a
+single shard without asking vtgate.
+
+Every vindex maps a list of column values to a list of keyspace ids (bytes),
+with None where Go returns key.DestinationNone. Values are Python ints,
+str/bytes or None, standing in for the sqltypes.Value vtgate would see:
+ints behave like signed/unsigned integer values, str/bytes like VARCHAR /
+VARBINARY values.
+"""
+import hashlib
+import struct
+
+_UINT64_MASK = (1 << 64) - 1
+
+
+class VindexError(ValueError):
+    pass
+
+
+def _to_uint64(value, wrap_negative=False):
+    """
+    Mirror evalengine.ToUint64: integers must be in the int64/uint64 range
+    and non-negative, strings are parsed as base-10 integers. With
+    `wrap_negative`, negative integers are reinterpreted as uint64 like the
+    hash vindex does for signed values.
+    """
+    if isinstance(value, bool) or value is None:
+        raise VindexError('could not parse value: %r' % (value,))
+    if isinstance(value, int):
+        if value < -(1 << 63) or value > _UINT64_MASK:
+            raise VindexError('value out of range: %d' % value)
+        if value < 0:
+            if not wrap_negative:
+                raise VindexError(
+                    'negative number cannot be converted to unsigned: %d' % value)
+            return value & _UINT64_MASK
+        return value
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'replace')
+    try:
+        num = int(value, 10)
+    except (TypeError, ValueError):
+        raise VindexError('could not parse value: %r' % (value,))
+    if value.strip() != value or '_' in value:
+        raise VindexError('could not parse value: %r' % (value,))
+    if num < 0:
+        raise VindexError(
+            'negative number cannot be converted to unsigned: %d' % num)
+    if num > _UINT64_MASK:
+        raise VindexError('value out of range: %d' % num)
+    return num
+
+
+def _to_bytes(value):
+    """Mirror sqltypes.Value.ToBytes for the Python types we accept."""
+    if value is None:
+        return b''
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, bool):
+        return b'1' if value else b'0'
+    if isinstance(value, int):
+        return str(value).encode('ascii')
+    return str(value).encode('utf-8')
+
+
+class Vindex(object):
+    """Base class of the vindexes; `name` is the name used in the vschema."""
+    vindex_type = None
+    unique = True
+    cost = 1
+    # False for vindexes that can only be resolved by vtgate (lookups and the
+    # collation based ones); see DatabaseWrapper.keyspace_ids().
+    client_side = True
+    # The owner table of a lookup vindex, whose writes maintain the lookup.
+    owner = None
+
+    def __init__(self, name, params=None):
+        self.name = name
+        self.params = params or {}
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.name)
+
+    def map(self, values):
+        """Return the keyspace id of every value, or None if it has none."""
+        result = []
+        for value in values:
+            try:
+                result.append(self.keyspace_id(value))
+            except VindexError:
+                result.append(None)
+        return result
+
+    def keyspace_id(self, value):
+        raise NotImplementedError
+
+    def verify(self, values, keyspace_ids):
+        return [self.keyspace_id(value) == ksid
+                for value, ksid in zip(values, keyspace_ids)]
+
+
+class Binary(Vindex):
+    vindex_type = 'binary'
+
+    def keyspace_id(self, value):
+        return _to_bytes(value)
+
+    def reverse_map(self, keyspace_ids):
+        return list(keyspace_ids)
+
+
+class BinaryMD5(Vindex):
+    vindex_type = 'binary_md5'
+
+    def keyspace_id(self, value):
+        return hashlib.md5(_to_bytes(value)).digest()
+
+
+class Numeric(Vindex):
+    vindex_type = 'numeric'
+    cost = 0
+
+    def keyspace_id(self, value):
+        return struct.pack('>Q', _to_uint64(value))
+
+    def reverse_map(self, keyspace_ids):
+        return [struct.unpack('>Q', ksid)[0] for ksid in keyspace_ids]
+
+
+class ReverseBits(Vindex):
+    vindex_type = 'reverse_bits'
+
+    def keyspace_id(self, value):
+        return struct.pack('>Q', _reverse64(_to_uint64(value)))
+
+    def reverse_map(self, keyspace_ids):
+        return [_reverse64(struct.unpack('>Q', ksid)[0]) for ksid in keyspace_ids]
+
+
+def _reverse64(num):
+    return int('{:064b}'.format(num)[::-1], 2)
+
+
+class Hash(Vindex):
+    """DES encryption of the big-endian uint64 with an all-zero key."""
+    vindex_type = 'hash'
+
+    def keyspace_id(self, value):
+        return struct.pack('>Q', _des_encrypt(_to_uint64(value, wrap_negative=True)))
+
+    def verify(self, values, keyspace_ids):
+        # Unlike Map, Hash.Verify does not wrap negative values.
+        return [struct.pack('>Q', _des_encrypt(_to_uint64(value))) == ksid
+                for value, ksid in zip(values, keyspace_ids)]
+
+    def reverse_map(self, keyspace_ids):
+        result = []
+        for ksid in keyspace_ids:
+            if len(ksid) != 8:
+                raise VindexError('invalid keyspace id: %s' % ksid.hex())
+            result.append(_des_decrypt(struct.unpack('>Q', ksid)[0]))
+        return result
+
+
+class XXHash(Vindex):
+    """xxHash64 of the value's bytes, stored little-endian."""
+    vindex_type = 'xxhash'
+
+    def keyspace_id(self, value):
+        return struct.pack('<Q', xxhash64(_to_bytes(value)))
+
+
+class UnicodeLooseMD5(Vindex):
+    """
+    MD5 of the loose (primary strength) English collation key of the value.
+    The collation key depends on golang.org/x/text's collation tables, so
+    the keyspace id is asked from vtgate's vindex functions instead.
+    """
+    vindex_type = 'unicode_loose_md5'
+    client_side = False
+
+    def keyspace_id(self, value):
+        raise VindexError(
+            'unicode_loose_md5 keyspace ids are resolved through vtgate')
+
+
+class VtgateVindex(Vindex):
+    """Any other vindex type: lookups must be resolved through vtgate."""
+    client_side = False
+
+    def __init__(self, name, params=None, vindex_type=None):
+        super(VtgateVindex, self).__init__(name, params)
+        self.vindex_type = vindex_type
+        self.unique = bool(vindex_type) and vindex_type.endswith('_unique')
+        # vtgate's costs of the lookup vindexes, which take a query each.
+        self.cost = 10 if self.unique else 20
+
+    def keyspace_id(self, value):
+        raise VindexError(
+            '%s keyspace ids are resolved through vtgate' % self.vindex_type)
+
+
+VINDEX_TYPES = {
+    cls.vindex_type: cls
+    for cls in (Binary, BinaryMD5, Hash, Numeric, ReverseBits,
+                UnicodeLooseMD5, XXHash)
+}
+
+
+def create_vindex(vindex_type, name, params=None, owner=None):
+    """Instantiate the vindex registered under `vindex_type` in Go."""
+    cls = VINDEX_TYPES.get(vindex_type)
+    if cls is None:
+        vindex = VtgateVindex(name, params, vindex_type)
+    else:
+        vindex = cls(name, params)
+    vindex.owner = owner or None
+    return vindex
+
+
+# xxHash64, as implemented by github.com/cespare/xxhash with seed 0.
+
+_P1 = 11400714785074694791
+_P2 = 14029467366897019727
+_P3 = 1609587929392839161
+_P4 = 9650029242287828579
+_P5 = 2870177450012600261
+
+
+def _rotl(x, r):
+    return ((x << r) | (x >> (64 - r))) & _UINT64_MASK
+
+
+def _xxh_round(acc, lane):
+    acc = (acc + lane * _P2) & _UINT64_MASK
+    return (_rotl(acc, 31) * _P1) & _UINT64_MASK
+
+
+def _xxh_merge(acc, val):
+    acc ^= _xxh_round(0, val)
+    return (acc * _P1 + _P4) & _UINT64_MASK
+
+
+def xxhash64(data):
+    length = len(data)
+    i = 0
+    if length >= 32:
+        v1 = (_P1 + _P2) & _UINT64_MASK
+        v2 = _P2
+        v3 = 0
+        v4 = (-_P1) & _UINT64_MASK
+        while i <= length - 32:
+            l1, l2, l3, l4 = struct.unpack_from('<4Q', data, i)
+            v1 = _xxh_round(v1, l1)
+            v2 = _xxh_round(v2, l2)
+            v3 = _xxh_round(v3, l3)
+            v4 = _xxh_round(v4, l4)
+            i += 32
+        h = (_rotl(v1, 1) + _rotl(v2, 7) + _rotl(v3, 12) +
+             _rotl(v4, 18)) & _UINT64_MASK
+        h = _xxh_merge(h, v1)
+        h = _xxh_merge(h, v2)
+        h = _xxh_merge(h, v3)
+        h = _xxh_merge(h, v4)
+    else:
+        h = _P5
+    h = (h + length) & _UINT64_MASK
+    while i + 8 <= length:
+        h ^= _xxh_round(0, struct.unpack_from('<Q', data, i)[0])
+        h = (_rotl(h, 27) * _P1 + _P4) & _UINT64_MASK
+        i += 8
+    if i + 4 <= length:
+        h ^= (struct.unpack_from('<I', data, i)[0] * _P1) & _UINT64_MASK
+        h = (_rotl(h, 23) * _P2 + _P3) & _UINT64_MASK
+        i += 4
+    while i < length:
+        h ^= (data[i] * _P5) & _UINT64_MASK
+        h = (_rotl(h, 11) * _P1) & _UINT64_MASK
+        i += 1
+    h ^= h >> 33
+    h = (h * _P2) & _UINT64_MASK
+    h ^= h >> 29
+    h = (h * _P3) & _UINT64_MASK
+    h ^= h >> 32
+    return h
+
+
+# DES (FIPS 46-3) with the all-zero key used by the hash vindex.
+
+_IP = (
+    58, 50, 42, 34, 26, 18, 10, 2, 60, 52, 44, 36, 28, 20, 12, 4,
+    62, 54, 46, 38, 30, 22, 14, 6, 64, 56, 48, 40, 32, 24, 16, 8,
+    57, 49, 41, 33, 25, 17, 9, 1, 59, 51, 43, 35, 27, 19, 11, 3,
+    61, 53, 45, 37, 29, 21, 13, 5, 63, 55, 47, 39, 31, 23, 15, 7,
+)
+_FP = (
+    40, 8, 48, 16, 56, 24, 64, 32, 39, 7, 47, 15, 55, 23, 63, 31,
+    38, 6, 46, 14, 54, 22, 62, 30, 37, 5, 45, 13, 53, 21, 61, 29,
+    36, 4, 44, 12, 52, 20, 60, 28, 35, 3, 43, 11, 51, 19, 59, 27,
+    34, 2, 42, 10, 50, 18, 58, 26, 33, 1, 41, 9, 49, 17, 57, 25,
+)
+_E = (
+    32, 1, 2, 3, 4, 5, 4, 5, 6, 7, 8, 9,
+    8, 9, 10, 11, 12, 13, 12, 13, 14, 15, 16, 17,
+    16, 17, 18, 19, 20, 21, 20, 21, 22, 23, 24, 25,
+    24, 25, 26, 27, 28, 29, 28, 29, 30, 31, 32, 1,
+)
+_P = (
+    16, 7, 20, 21, 29, 12, 28, 17, 1, 15, 23, 26, 5, 18, 31, 10,
+    2, 8, 24, 14, 32, 27, 3, 9, 19, 13, 30, 6, 22, 11, 4, 25,
+)
+_PC1 = (
+    57, 49, 41, 33, 25, 17, 9, 1, 58, 50, 42, 34, 26, 18,
+    10, 2, 59, 51, 43, 35, 27, 19, 11, 3, 60, 52, 44, 36,
+    63, 55, 47, 39, 31, 23, 15, 7, 62, 54, 46, 38, 30, 22,
+    14, 6, 61, 53, 45, 37, 29, 21, 13, 5, 28, 20, 12, 4,
+)
+_PC2 = (
+    14, 17, 11, 24, 1, 5, 3, 28, 15, 6, 21, 10,
+    23, 19, 12, 4, 26, 8, 16, 7, 27, 20, 13, 2,
+    41, 52, 31, 37, 47, 55, 30, 40, 51, 45, 33, 48,
+    44, 49, 39, 56, 34, 53, 46, 42, 50, 36, 29, 32,
+)
+_SHIFTS = (1, 1, 2, 2, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2, 2, 1)
+_SBOXES = (
+    (14, 4, 13, 1, 2, 15, 11, 8, 3, 10, 6, 12, 5, 9, 0, 7,
+     0, 15, 7, 4, 14, 2, 13, 1, 10, 6, 12, 11, 9, 5, 3, 8,
+     4, 1, 14, 8, 13, 6, 2, 11, 15, 12, 9, 7, 3, 10, 5, 0,
+     15, 12, 8, 2, 4, 9, 1, 7, 5, 11, 3, 14, 10, 0, 6, 13),
+    (15, 1, 8, 14, 6, 11, 3, 4, 9, 7, 2, 13, 12, 0, 5, 10,
+     3, 13, 4, 7, 15, 2, 8, 14, 12, 0, 1, 10, 6, 9, 11, 5,
+     0, 14, 7, 11, 10, 4, 13, 1, 5, 8, 12, 6, 9, 3, 2, 15,
+     13, 8, 10, 1, 3, 15, 4, 2, 11, 6, 7, 12, 0, 5, 14, 9),
+    (10, 0, 9, 14, 6, 3, 15, 5, 1, 13, 12, 7, 11, 4, 2, 8,
+     13, 7, 0, 9, 3, 4, 6, 10, 2, 8, 5, 14, 12, 11, 15, 1,
+     13, 6, 4, 9, 8, 15, 3, 0, 11, 1, 2, 12, 5, 10, 14, 7,
+     1, 10, 13, 0, 6, 9, 8, 7, 4, 15, 14, 3, 11, 5, 2, 12),
+    (7, 13, 14, 3, 0, 6, 9, 10, 1, 2, 8, 5, 11, 12, 4, 15,
+     13, 8, 11, 5, 6, 15, 0, 3, 4, 7, 2, 12, 1, 10, 14, 9,
+     10, 6, 9, 0, 12, 11, 7, 13, 15, 1, 3, 14, 5, 2, 8, 4,
+     3, 15, 0, 6, 10, 1, 13, 8, 9, 4, 5, 11, 12, 7, 2, 14),
+    (2, 12, 4, 1, 7, 10, 11, 6, 8, 5, 3, 15, 13, 0, 14, 9,
+     14, 11, 2, 12, 4, 7, 13, 1, 5, 0, 15, 10, 3, 9, 8, 6,
+     4, 2, 1, 11, 10, 13, 7, 8, 15, 9, 12, 5, 6, 3, 0, 14,
+     11, 8, 12, 7, 1, 14, 2, 13, 6, 15, 0, 9, 10, 4, 5, 3),
+    (12, 1, 10, 15, 9, 2, 6, 8, 0, 13, 3, 4, 14, 7, 5, 11,
+     10, 15, 4, 2, 7, 12, 9, 5, 6, 1, 13, 14, 0, 11, 3, 8,
+     9, 14, 15, 5, 2, 8, 12, 3, 7, 0, 4, 10, 1, 13, 11, 6,
+     4, 3, 2, 12, 9, 5, 15, 10, 11, 14, 1, 7, 6, 0, 8, 13),
+    (4, 11, 2, 14, 15, 0, 8, 13, 3, 12, 9, 7, 5, 10, 6, 1,
+     13, 0, 11, 7, 4, 9, 1, 10, 14, 3, 5, 12, 2, 15, 8, 6,
+     1, 4, 11, 13, 12, 3, 7, 14, 10, 15, 6, 8, 0, 5, 9, 2,
+     6, 11, 13, 8, 1, 4, 10, 7, 9, 5, 0, 15, 14, 2, 3, 12),
+    (13, 2, 8, 4, 6, 15, 11, 1, 10, 9, 3, 14, 5, 0, 12, 7,
+     1, 15, 13, 8, 10, 3, 7, 4, 12, 5, 6, 11, 0, 14, 9, 2,
+     7, 11, 4, 1, 9, 12, 14, 2, 0, 6, 10, 13, 15, 3, 5, 8,
+     2, 1, 14, 7, 4, 10, 8, 13, 15, 12, 9, 0, 3, 5, 6, 11),
+)
+
+
+def _permute(value, table, width):
+    """Apply a DES permutation table (1-based, MSB first) to `value`."""
+    result = 0
+    for position in table:
+        result = (result << 1) | ((value >> (width - position)) & 1)
+    return result
+
+
+def _subkeys(key):
+    cd = _permute(key, _PC1, 64)
+    c, d = cd >> 28, cd & 0xfffffff
+    keys = []
+    for shift in _SHIFTS:
+        c = ((c << shift) | (c >> (28 - shift))) & 0xfffffff
+        d = ((d << shift) | (d >> (28 - shift))) & 0xfffffff
+        keys.append(_permute((c << 28) | d, _PC2, 56))
+    return tuple(keys)
+
+
+# Combined S-box and P permutation lookups: one table per S-box mapping the
+# 6-bit input to its permuted 32-bit contribution.
+_SP = tuple(
+    tuple(_permute(sbox[((six & 0x20) | ((six & 1) << 4) | ((six >> 1) & 0xf))]
+                   << (28 - 4 * i), _P, 32)
+          for six in range(64))
+    for i, sbox in enumerate(_SBOXES))
+
+
+def _byte_tables(table, width):
+    """
+    Precompute `table` applied to each byte of a `width`-bit input, so a
+    permutation becomes one lookup per input byte instead of one per bit.
+    """
+    return tuple(
+        tuple(_permute(byte << (width - 8 * (i + 1)), table, width)
+              for byte in range(256))
+        for i in range(width // 8))
+
+
+_IP_TABLES = _byte_tables(_IP, 64)
+_FP_TABLES = _byte_tables(_FP, 64)
+_E_TABLES = _byte_tables(_E, 32)
+
+
+def _fast_permute(value, tables, width):
+    result = 0
+    shift = width
+    for table in tables:
+        shift -= 8
+        result |= table[(value >> shift) & 0xff]
+    return result
+
+
+_ZERO_KEY_SUBKEYS = _subkeys(0)
+
+
+def _feistel(right, subkey):
+    expanded = _fast_permute(right, _E_TABLES, 32) ^ subkey
+    return (_SP[0][(expanded >> 42) & 0x3f] | _SP[1][(expanded >> 36) & 0x3f] |
+            _SP[2][(expanded >> 30) & 0x3f] | _SP[3][(expanded >> 24) & 0x3f] |
+            _SP[4][(expanded >> 18) & 0x3f] | _SP[5][(expanded >> 12) & 0x3f] |
+            _SP[6][(expanded >> 6) & 0x3f] | _SP[7][expanded & 0x3f])
+
+
+def _des(block, subkeys):
+    block = _fast_permute(block, _IP_TABLES, 64)
+    left, right = block >> 32, block & 0xffffffff
+    for subkey in subkeys:
+        left, right = right, left ^ _feistel(right, subkey)
+    return _fast_permute((right << 32) | left, _FP_TABLES, 64)
+
+
+def _des_encrypt(block):
+    return _des(block, _ZERO_KEY_SUBKEYS)
+
+
+def _des_decrypt(block):
+    return _des(block, _ZERO_KEY_SUBKEYS[::-1])
@@ -0,0 +1,108 @@
+"""
+Load a keyspace's VSchema, in the JSON form of vschema.proto Keyspace used by
+`vtctlclient ApplyVSchema` (see examples/local/vschema_*.json), or the
+keyspaces of a SrvVSchema, as printed by `vtctlclient GetSrvVSchema <cell>`.
+"""
+import json
+
+from .vindexes import create_vindex
+
+
+class ColumnVindex(object):
+    def __init__(self, columns, vindex):
+        self.columns = columns
+        self.vindex = vindex
+
+    @property
+    def column(self):
+        return self.columns[0]
+
+
+class Table(object):
+    def __init__(self, name, table_type='', column_vindexes=None,
+                 auto_increment=None, pinned=None):
+        self.name = name
+        self.type = table_type
+        self.column_vindexes = column_vindexes or []
+        self.auto_increment = auto_increment
+        self.pinned = pinned
+
+    @property
+    def primary_vindex(self):
+        """The first column vindex, which decides where rows live."""
+        if self.column_vindexes:
+            return self.column_vindexes[0]
+        return None
+
+    @property
+    def owned_vindexes(self):
+        """
+        The column vindexes this table owns, i.e. the lookups vtgate writes
+        to whenever rows are inserted into it.
+        """
+        return [column_vindex for column_vindex in self.column_vindexes
+                if column_vindex.vindex.owner == self.name]
+
+
+class Keyspace(object):
+    def __init__(self, name, sharded=False, vindexes=None, tables=None):
+        self.name = name
+        self.sharded = sharded
+        self.vindexes = vindexes or {}
+        self.tables = tables or {}
+
+    @classmethod
+    def from_dict(cls, name, data):
+        vindexes = {
+            vindex_name: create_vindex(vindex.get('type', ''), vindex_name,
+                                       vindex.get('params'), vindex.get('owner'))
+            for vindex_name, vindex in (data.get('vindexes') or {}).items()
+        }
+        tables = {}
+        for table_name, table in (data.get('tables') or {}).items():
+            table = table or {}
+            column_vindexes = []
+            for column_vindex in table.get('column_vindexes') or []:
+                columns = column_vindex.get('columns') or [column_vindex['column']]
+                try:
+                    vindex = vindexes[column_vindex['name']]
+                except KeyError:
+                    raise ValueError("Table '%s' uses undefined vindex '%s'." %
+                                     (table_name, column_vindex['name']))
+                column_vindexes.append(ColumnVindex(columns, vindex))
+            tables[table_name] = Table(
+                table_name, table.get('type', ''), column_vindexes,
+                table.get('auto_increment'), table.get('pinned'))
+        return cls(name, bool(data.get('sharded')), vindexes, tables)
+
+    def table(self, name):
+        try:
+            return self.tables[name]
+        except KeyError:
+            raise ValueError("Table '%s' is not in the vschema of keyspace '%s'." %
+                             (name, self.name))
+
+
+def load_keyspace(name, vschema):
+    """
+    Return the Keyspace `name` described by `vschema`: a dict or the path of
+    a JSON file.
+    """
+    if not isinstance(vschema, dict):
+        with open(vschema) as f:
+            vschema = json.load(f)
+    return Keyspace.from_dict(name, vschema)
+
+
+def load_vschema(vschema):
+    """
+    Return the dict of Keyspaces described by `vschema`: a SrvVSchema
+    (`{"keyspaces": {name: keyspace}}`) or a dict of keyspace names to
+    keyspace vschemas or JSON file paths, or the path of a JSON file of
+    either.
+    """
+    if not isinstance(vschema, dict):
+        with open(vschema) as f:
+            vschema = json.load(f)
+    keyspaces = vschema.get('keyspaces', vschema)
+    return {name: load_keyspace(name, keyspace) for name, keyspace in keyspaces.items()}
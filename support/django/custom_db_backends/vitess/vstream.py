@@ -0,0 +1,332 @@
+"""
+Cache invalidation from vtgate's VStream.
+
+Caches in front of the backend only learn about the writes of other
+processes when their entries expire. VStreamConsumer tails the row events
+of selected tables through vtgate's VStream RPC instead, and hands the rows
+changed by each batch of transactions to a handler, e.g. a CacheInvalidator
+dropping the cached entries of the changed primary keys:
+
+    from custom_db_backends.vitess.vstream import CacheInvalidator, VStreamConsumer
+
+    invalidator = CacheInvalidator(using='default', cache='default',
+                                   key=lambda table, pk: 'product:%s' % pk)
+    consumer = VStreamConsumer.for_database('default', ['product'], invalidator,
+                                            checkpoint='/var/lib/app/vstream.json')
+    consumer.run()
+
+A batch holds the transactions of a response of the stream, up to
+`batch_size` changed rows. Once the handler returns, the VGTID (the GTID
+position of every shard) after the batch is saved to the checkpoint file
+(and at most every `checkpoint_interval` seconds when the tables didn't
+change), and a restarted consumer resumes from there. The checkpoint
+follows the handler, so a crash may hand the last batch over again, but
+never skips one.
+"""
+import json
+import os
+import threading
+import time
+
+from django.db import connections
+
+from .vtgate_grpc import (
+    decode_rows, grpc, vtgate_pb2, vtgateservice_pb2_grpc, vtrpc_pb2,
+)
+
+import binlogdata_pb2
+import topodata_pb2
+
+# The events after which the stream is at a transaction boundary.
+_BOUNDARY_EVENTS = frozenset((binlogdata_pb2.COMMIT, binlogdata_pb2.DDL,
+                              binlogdata_pb2.OTHER))
+
+
+class Change(object):
+    """
+    A row of `table` (without its keyspace) inserted, updated or deleted:
+    `before` and `after` are dicts of its columns, None for an insert or a
+    delete, and `key` is its primary key value (a tuple for a composite
+    primary key).
+    """
+
+    __slots__ = ('keyspace', 'table', 'before', 'after', 'key')
+
+    def __init__(self, keyspace, table, before, after, key):
+        self.keyspace = keyspace
+        self.table = table
+        self.before = before
+        self.after = after
+        self.key = key
+
+    @property
+    def kind(self):
+        if self.before is None:
+            return 'insert'
+        return 'delete' if self.after is None else 'update'
+
+    def __repr__(self):
+        return 'Change(%s %s.%s %r)' % (self.kind, self.keyspace, self.table, self.key)
+
+
+class Batch(object):
+    """The changes of consecutive transactions, and the VGTID after them."""
+
+    def __init__(self, changes, vgtid):
+        self.changes = changes
+        self.vgtid = vgtid
+
+    def keys(self):
+        """Return {table: set of primary keys} of the changed rows."""
+        keys = {}
+        for change in self.changes:
+            keys.setdefault(change.table, set()).add(change.key)
+        return keys
+
+    def __len__(self):
+        return len(self.changes)
+
+
+class Checkpoint(object):
+    """A JSON file holding the shard positions of a VGTID."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Return the saved binlogdata.VGtid, or None."""
+        try:
+            with open(self.path) as f:
+                shard_gtids = json.load(f)
+        except (IOError, ValueError):
+            return None
+        return binlogdata_pb2.VGtid(shard_gtids=[
+            binlogdata_pb2.ShardGtid(keyspace=shard_gtid['keyspace'],
+                                     shard=shard_gtid['shard'], gtid=shard_gtid['gtid'])
+            for shard_gtid in shard_gtids])
+
+    def save(self, vgtid):
+        shard_gtids = [{'keyspace': shard_gtid.keyspace, 'shard': shard_gtid.shard,
+                        'gtid': shard_gtid.gtid}
+                       for shard_gtid in vgtid.shard_gtids]
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(shard_gtids, f, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class VStreamConsumer(object):
+    """
+    Tail the row events of `tables` of `keyspace` from the vtgate at
+    `address` and call `handler` with a Batch of changes at a time.
+    `primary_keys` maps table names to their primary key columns (by
+    default 'id'). Without a checkpoint, or one to resume from, the stream
+    starts at the current position of every shard.
+    """
+
+    def __init__(self, address, keyspace, tables, handler, primary_keys=None,
+                 checkpoint=None, tablet_type='MASTER', user='', credentials=None,
+                 options=None, batch_size=500, checkpoint_interval=10.0, retry_interval=5.0):
+        self.address = address
+        self.keyspace = keyspace
+        self.tables = frozenset(tables)
+        self.handler = handler
+        self.primary_keys = dict(primary_keys or {})
+        if isinstance(checkpoint, str):
+            checkpoint = Checkpoint(checkpoint)
+        self.checkpoint = checkpoint
+        self.tablet_type = topodata_pb2.TabletType.Value(tablet_type.upper())
+        self.caller_id = vtrpc_pb2.CallerID(principal=user)
+        self.credentials = credentials
+        self.options = options
+        self.batch_size = batch_size
+        self.checkpoint_interval = checkpoint_interval
+        self.retry_interval = retry_interval
+        self.vgtid = self.checkpoint.load() if self.checkpoint is not None else None
+        self._stopped = threading.Event()
+        self._call = None
+        self._counters = {'batches': 0, 'changes': 0, 'reconnects': 0}
+
+    @classmethod
+    def for_database(cls, using, tables, handler, **options):
+        """
+        Build a consumer of the keyspace of the database `using`, connecting
+        like its gRPC transport (see VITESS['GRPC']) and taking the primary
+        keys of the tables from their Django models.
+        """
+        from django.apps import apps
+        connection = connections[using]
+        grpc_settings = connection.vitess_settings.get('GRPC') or {}
+        address = grpc_settings.get('ADDRESS') or '%s:%s' % (
+            connection.settings_dict['HOST'] or 'localhost',
+            connection.settings_dict['PORT'] or 15991)
+        primary_keys = {model._meta.db_table: [model._meta.pk.column]
+                        for model in apps.get_models() if model._meta.db_table in tables}
+        primary_keys.update(options.pop('primary_keys', None) or {})
+        options.setdefault('user', connection.settings_dict['USER'])
+        options.setdefault('credentials', grpc_settings.get('CREDENTIALS'))
+        options.setdefault('options', grpc_settings.get('OPTIONS'))
+        return cls(address, connection.settings_dict['NAME'], tables, handler,
+                   primary_keys=primary_keys, **options)
+
+    def _request(self):
+        vgtid = self.vgtid
+        if vgtid is None:
+            vgtid = binlogdata_pb2.VGtid(shard_gtids=[
+                binlogdata_pb2.ShardGtid(keyspace=self.keyspace, gtid='current')])
+        rules = [binlogdata_pb2.Rule(match=table, filter='select * from `%s`' % table)
+                 for table in sorted(self.tables)]
+        return vtgate_pb2.VStreamRequest(caller_id=self.caller_id, tablet_type=self.tablet_type,
+                                         vgtid=vgtid, filter=binlogdata_pb2.Filter(rules=rules))
+
+    def run(self):
+        """
+        Consume the stream until stop() is called, reconnecting from the
+        last handled position when it breaks.
+        """
+        while not self._stopped.is_set():
+            try:
+                self._consume()
+            except grpc.RpcError:
+                if self._stopped.is_set():
+                    break
+                self._counters['reconnects'] += 1
+                self._stopped.wait(self.retry_interval)
+
+    def start(self):
+        """Run the consumer in a daemon thread, and return the thread."""
+        thread = threading.Thread(target=self.run, name='vstream-%s' % self.keyspace,
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stopped.set()
+        call = self._call
+        if call is not None:
+            call.cancel()
+
+    def _consume(self):
+        if self.credentials is not None:
+            channel = grpc.secure_channel(self.address, self.credentials, options=self.options)
+        else:
+            channel = grpc.insecure_channel(self.address, options=self.options)
+        try:
+            stub = vtgateservice_pb2_grpc.VitessStub(channel)
+            self._call = stub.VStream(self._request())
+            if self._stopped.is_set():
+                self._call.cancel()
+            # Changes are handed over by whole transactions: those after
+            # the last boundary are pending until the next one.
+            fields = {}
+            changes, pending, vgtid = [], [], None
+            saved_at = time.monotonic()
+            for response in self._call:
+                for event in response.events:
+                    if event.type == binlogdata_pb2.FIELD:
+                        fields[event.field_event.table_name] = list(event.field_event.fields)
+                    elif event.type == binlogdata_pb2.ROW:
+                        pending.extend(self._changes(event.row_event, fields))
+                    elif event.type == binlogdata_pb2.VGTID:
+                        vgtid = event.vgtid
+                    elif event.type in _BOUNDARY_EVENTS:
+                        changes.extend(pending)
+                        pending = []
+                        if len(changes) >= self.batch_size and vgtid is not None:
+                            self._flush(changes, vgtid)
+                            changes = []
+                if pending or vgtid is None:
+                    continue
+                # A busy stream sends many transactions per response, which
+                # makes the batches; an idle one doesn't delay its changes.
+                if changes or time.monotonic() - saved_at >= self.checkpoint_interval:
+                    self._flush(changes, vgtid)
+                    changes, saved_at = [], time.monotonic()
+        finally:
+            self._call = None
+            channel.close()
+
+    def _flush(self, changes, vgtid):
+        if changes:
+            self.handler(Batch(changes, vgtid))
+            self._counters['batches'] += 1
+            self._counters['changes'] += len(changes)
+        self.vgtid = vgtid
+        if self.checkpoint is not None:
+            self.checkpoint.save(vgtid)
+
+    def _changes(self, row_event, fields):
+        keyspace, _, table = row_event.table_name.rpartition('.')
+        if table not in self.tables:
+            return []
+        table_fields = fields.get(row_event.table_name)
+        if table_fields is None:
+            return []
+        names = [field.name for field in table_fields]
+        key_columns = self.primary_keys.get(table, ['id'])
+        if not set(key_columns) <= set(names):
+            # Without its primary key, the whole row identifies it.
+            key_columns = names
+        changes = []
+        for row_change in row_event.row_changes:
+            before = after = None
+            if row_change.HasField('before'):
+                before = dict(zip(names, decode_rows(table_fields, [row_change.before])[0]))
+            if row_change.HasField('after'):
+                after = dict(zip(names, decode_rows(table_fields, [row_change.after])[0]))
+            keys = [_key(row, key_columns) for row in (before, after) if row is not None]
+            # An update of the primary key changes two rows.
+            for key in sorted(set(keys), key=keys.index):
+                changes.append(Change(keyspace, table, before, after, key))
+        return changes
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats['position'] = [
+            '%s:%s@%s' % (shard_gtid.keyspace, shard_gtid.shard, shard_gtid.gtid)
+            for shard_gtid in self.vgtid.shard_gtids] if self.vgtid is not None else None
+        return stats
+
+
+def _key(row, columns):
+    if len(columns) == 1:
+        return row[columns[0]]
+    return tuple(row[column] for column in columns)
+
+
+class CacheInvalidator(object):
+    """
+    A VStreamConsumer handler dropping what the changed rows invalidate:
+    the results read from their tables in the backend's result cache of
+    `using` (see VITESS['CACHE'], keyed by statement rather than row), and
+    the entries `key(table, primary_key)` of the Django cache `cache`.
+    `refresh(table, primary_keys)`, if given, is called afterwards, e.g. to
+    warm the cache again.
+    """
+
+    def __init__(self, using=None, cache=None, key=None, refresh=None):
+        self.using = using
+        self.cache = cache
+        self.key = key
+        self.refresh = refresh
+
+    def __call__(self, batch):
+        keys = batch.keys()
+        if self.using is not None:
+            result_cache = connections[self.using].result_cache
+            if result_cache is not None:
+                result_cache.invalidate(set(keys) & result_cache.tables)
+        if self.cache is not None and self.key is not None:
+            from django.core.cache import caches
+            cache_keys = []
+            for table, primary_keys in keys.items():
+                for primary_key in primary_keys:
+                    cache_key = self.key(table, primary_key)
+                    if isinstance(cache_key, (list, tuple)):
+                        cache_keys.extend(cache_key)
+                    elif cache_key is not None:
+                        cache_keys.append(cache_key)
+            if cache_keys:
+                caches[self.cache].delete_many(cache_keys)
+        if self.refresh is not None:
+            for table, primary_keys in keys.items():
+                self.refresh(table, primary_keys)
@@ -0,0 +1,575 @@
+"""
+A DB-API connection to vtgate's Vitess gRPC service.
+
+It stands in for the mysqlclient connection when VITESS['TRANSPORT'] is
+'grpc': statements go through Execute, ExecuteBatch and StreamExecute with
+typed bind variables, and rows come back as binary-typed query.proto rows,
+decoded straight into the Python values mysqlclient would return. Errors are
+raised as mysqlclient exceptions, so the rest of the backend and Django's
+error handling don't change.
+
+The generated modules of the proto definitions are needed on the Python
+path: run `make py_proto` in the repository root and add
+support/django/vtproto to PYTHONPATH.
+"""
+import datetime
+import re
+import threading
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.mysql.base import Database
+
+try:
+    import grpc
+    import query_pb2
+    import vtgate_pb2
+    import vtgateservice_pb2_grpc
+    import vtrpc_pb2
+except ImportError as err:
+    raise ImproperlyConfigured(
+        'Error loading the vtgate gRPC modules.\n'
+        'Did you install grpcio and protobuf, run `make py_proto` and add '
+        'support/django/vtproto to PYTHONPATH?'
+    ) from err
+
+from .sqlutil import tokenize
+
+# MySQL field type codes (MySQLdb.constants.FIELD_TYPE) of query.proto types,
+# for cursor.description.
+FIELD_TYPES = {
+    query_pb2.NULL_TYPE: 6,
+    query_pb2.INT8: 1, query_pb2.UINT8: 1,
+    query_pb2.INT16: 2, query_pb2.UINT16: 2,
+    query_pb2.INT24: 9, query_pb2.UINT24: 9,
+    query_pb2.INT32: 3, query_pb2.UINT32: 3,
+    query_pb2.INT64: 8, query_pb2.UINT64: 8,
+    query_pb2.FLOAT32: 4, query_pb2.FLOAT64: 5,
+    query_pb2.TIMESTAMP: 7, query_pb2.DATE: 10, query_pb2.TIME: 11,
+    query_pb2.DATETIME: 12, query_pb2.YEAR: 13,
+    query_pb2.DECIMAL: 246,
+    query_pb2.TEXT: 252, query_pb2.BLOB: 252,
+    query_pb2.VARCHAR: 253, query_pb2.VARBINARY: 253,
+    query_pb2.CHAR: 254, query_pb2.BINARY: 254,
+    query_pb2.BIT: 16, query_pb2.ENUM: 247, query_pb2.SET: 248,
+    query_pb2.GEOMETRY: 255, query_pb2.JSON: 245,
+}
+
+_ERRNO_RE = re.compile(r'\(errno (\d+)\)')
+
+# Exceptions of vtrpc.Code values that aren't plain DatabaseErrors.
+_CODE_ERRORS = {
+    vtrpc_pb2.INVALID_ARGUMENT: Database.ProgrammingError,
+    vtrpc_pb2.NOT_FOUND: Database.ProgrammingError,
+    vtrpc_pb2.ALREADY_EXISTS: Database.IntegrityError,
+    vtrpc_pb2.FAILED_PRECONDITION: Database.OperationalError,
+    vtrpc_pb2.DEADLINE_EXCEEDED: Database.OperationalError,
+    vtrpc_pb2.CANCELED: Database.OperationalError,
+    vtrpc_pb2.RESOURCE_EXHAUSTED: Database.OperationalError,
+    vtrpc_pb2.ABORTED: Database.OperationalError,
+    vtrpc_pb2.UNAVAILABLE: Database.OperationalError,
+    vtrpc_pb2.UNAUTHENTICATED: Database.OperationalError,
+    vtrpc_pb2.PERMISSION_DENIED: Database.OperationalError,
+    vtrpc_pb2.INTERNAL: Database.InternalError,
+}
+
+# MySQL error numbers of errors raised as IntegrityError by mysqlclient.
+_INTEGRITY_ERRNOS = frozenset((1022, 1048, 1052, 1062, 1169, 1216, 1217,
+                               1451, 1452, 1557, 1586, 1761, 1762, 1859))
+
+
+def database_error(rpc_error):
+    """Return the mysqlclient exception of a vtrpc.RPCError."""
+    match = _ERRNO_RE.search(rpc_error.message)
+    errno = int(match.group(1)) if match else 0
+    if errno in _INTEGRITY_ERRNOS:
+        exc_type = Database.IntegrityError
+    else:
+        exc_type = _CODE_ERRORS.get(rpc_error.code, Database.DatabaseError)
+    return exc_type(errno, rpc_error.message)
+
+
+def _grpc_error(exc):
+    """Return the mysqlclient exception of a failed gRPC call."""
+    # 2013 is CR_SERVER_LOST.
+    return Database.OperationalError(2013, '%s: %s' % (exc.code().name, exc.details()))
+
+
+def bind_variable(value):
+    """Return the query.BindVariable of a Python value."""
+    if value is None:
+        return query_pb2.BindVariable(type=query_pb2.NULL_TYPE)
+    if isinstance(value, bool):
+        return query_pb2.BindVariable(type=query_pb2.INT64, value=b'1' if value else b'0')
+    if isinstance(value, int):
+        value_type = query_pb2.UINT64 if value > 0x7fffffffffffffff else query_pb2.INT64
+        return query_pb2.BindVariable(type=value_type, value=str(value).encode())
+    if isinstance(value, float):
+        return query_pb2.BindVariable(type=query_pb2.FLOAT64, value=repr(value).encode())
+    if isinstance(value, Decimal):
+        return query_pb2.BindVariable(type=query_pb2.DECIMAL, value=str(value).encode())
+    if isinstance(value, str):
+        return query_pb2.BindVariable(type=query_pb2.VARCHAR, value=value.encode('utf8'))
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return query_pb2.BindVariable(type=query_pb2.VARBINARY, value=bytes(value))
+    if isinstance(value, datetime.datetime):
+        return query_pb2.BindVariable(type=query_pb2.DATETIME,
+                                      value=value.isoformat(' ').encode())
+    if isinstance(value, datetime.date):
+        return query_pb2.BindVariable(type=query_pb2.DATE, value=value.isoformat().encode())
+    if isinstance(value, datetime.time):
+        return query_pb2.BindVariable(type=query_pb2.TIME, value=value.isoformat().encode())
+    if isinstance(value, datetime.timedelta):
+        return query_pb2.BindVariable(type=query_pb2.TIME,
+                                      value=_format_timedelta(value).encode())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        values = [bind_variable(item) for item in value]
+        return query_pb2.BindVariable(
+            type=query_pb2.TUPLE,
+            values=[query_pb2.Value(type=item.type, value=item.value) for item in values])
+    raise Database.ProgrammingError('Unsupported bind variable type %s.' % type(value).__name__)
+
+
+def _format_timedelta(value):
+    seconds = int(value.total_seconds())
+    sign = '-' if seconds < 0 else ''
+    hours, remainder = divmod(abs(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return '%s%02d:%02d:%02d.%06d' % (sign, hours, minutes, seconds, value.microseconds)
+
+
+def bound_query(sql, params=None):
+    """
+    Return the query.BoundQuery of a statement using the %s paramstyle, with
+    each %s replaced by a :vN bind variable.
+    """
+    if params is None:
+        return query_pb2.BoundQuery(sql=sql)
+    if isinstance(params, dict):
+        raise Database.NotSupportedError('Named parameters are not supported.')
+    out = []
+    index = 0
+    for kind, text in tokenize(sql):
+        if kind == 'placeholder':
+            index += 1
+            text = ':v%d' % index
+        elif kind == 'percent':
+            text = '%'
+        out.append(text)
+    if index != len(params):
+        raise Database.ProgrammingError('Statement has %d placeholders but %d parameters.' %
+                                        (index, len(params)))
+    return query_pb2.BoundQuery(
+        sql=''.join(out),
+        bind_variables={'v%d' % (i + 1): bind_variable(value)
+                        for i, value in enumerate(params)})
+
+
+def _decimal(value):
+    return Decimal(value.decode('ascii'))
+
+
+def _str(value):
+    return value.decode('utf8')
+
+
+def _bytes(value):
+    return value
+
+
+def _fraction_padded(text):
+    """
+    Pad the fractional seconds of `text` to 6 digits: MySQL sends 1 to 6,
+    and fromisoformat() only takes 3 or 6 before Python 3.11.
+    """
+    head, dot, fraction = text.partition('.')
+    if not dot:
+        return text
+    return '%s.%s' % (head, fraction.ljust(6, '0'))
+
+
+def _datetime(value):
+    text = value.decode('ascii')
+    if text.startswith('0000-00-00'):
+        return None
+    return datetime.datetime.fromisoformat(_fraction_padded(text))
+
+
+def _date(value):
+    text = value.decode('ascii')
+    if text.startswith('0000-00-00'):
+        return None
+    return datetime.date.fromisoformat(text)
+
+
+def _time(value):
+    text = value.decode('ascii')
+    try:
+        return datetime.time.fromisoformat(_fraction_padded(text))
+    except ValueError:
+        # Out of range, e.g. '-01:00:00' or '838:59:59'.
+        return None
+
+
+# Converters of query.proto types to the values mysqlclient returns with
+# Django's conversions.
+CONVERTERS = {
+    query_pb2.INT8: int, query_pb2.UINT8: int, query_pb2.INT16: int,
+    query_pb2.UINT16: int, query_pb2.INT24: int, query_pb2.UINT24: int,
+    query_pb2.INT32: int, query_pb2.UINT32: int, query_pb2.INT64: int,
+    query_pb2.UINT64: int, query_pb2.YEAR: int,
+    query_pb2.FLOAT32: float, query_pb2.FLOAT64: float,
+    query_pb2.DECIMAL: _decimal,
+    query_pb2.TIMESTAMP: _datetime, query_pb2.DATETIME: _datetime,
+    query_pb2.DATE: _date, query_pb2.TIME: _time,
+    query_pb2.TEXT: _str, query_pb2.VARCHAR: _str, query_pb2.CHAR: _str,
+    query_pb2.ENUM: _str, query_pb2.SET: _str, query_pb2.JSON: _str,
+}
+
+
+def decode_rows(fields, rows):
+    """Return the query.proto `rows` of `fields` as a list of tuples."""
+    converters = [CONVERTERS.get(field.type, _bytes) for field in fields]
+    decoded = []
+    for row in rows:
+        values = row.values
+        offset = 0
+        out = []
+        for length, convert in zip(row.lengths, converters):
+            if length < 0:
+                out.append(None)
+            else:
+                out.append(convert(values[offset:offset + length]))
+                offset += length
+        decoded.append(tuple(out))
+    return decoded
+
+
+def description(fields):
+    return tuple((field.name, FIELD_TYPES.get(field.type, 253), None,
+                  field.column_length, field.column_length, field.decimals,
+                  not field.flags & 1)
+                 for field in fields)
+
+
+class Connection(object):
+    """
+    A vtgate session over gRPC, with the parts of the mysqlclient connection
+    API the backend uses. vtgate keeps no state per client: the Session
+    returned by each call is sent back with the next one.
+    """
+
+    def __init__(self, address, target, user='', timeout=None, credentials=None,
+                 options=None, decoder=decode_rows):
+        if credentials is not None:
+            self.channel = grpc.secure_channel(address, credentials, options=options)
+        else:
+            self.channel = grpc.insecure_channel(address, options=options)
+        self.stub = vtgateservice_pb2_grpc.VitessStub(self.channel)
+        self.caller_id = vtrpc_pb2.CallerID(principal=user)
+        self.timeout = timeout
+        self.decoder = decoder
+        self.session = vtgate_pb2.Session(target_string=target, autocommit=True)
+        self._lock = threading.Lock()
+        self.open = True
+
+    def _check_open(self):
+        if not self.open:
+            raise Database.InterfaceError(0, 'Connection is closed.')
+
+    def execute(self, sql, params=None):
+        """Execute a statement and return its query.QueryResult."""
+        self._check_open()
+        with self._lock:
+            request = vtgate_pb2.ExecuteRequest(
+                caller_id=self.caller_id, session=self.session,
+                query=bound_query(sql, params))
+            try:
+                response = self.stub.Execute(request, timeout=self.timeout)
+            except grpc.RpcError as exc:
+                raise _grpc_error(exc)
+            self.session.CopyFrom(response.session)
+        if response.HasField('error'):
+            raise database_error(response.error)
+        return response.result
+
+    def execute_batch(self, statements, as_transaction=False):
+        """
+        Execute a list of (sql, params) in one ExecuteBatch round-trip and
+        return their query.QueryResults. vtgate runs each query on its own
+        and goes on after a failed one (it ignores the deprecated
+        ExecuteBatchRequest.as_transaction), so with `as_transaction` the
+        batch starts with a BEGIN, and is committed by a second call, or
+        rolled back if any query failed.
+        """
+        self._check_open()
+        queries = [bound_query(sql, params) for sql, params in statements]
+        begin = as_transaction and not self.session.in_transaction
+        if begin:
+            queries.insert(0, bound_query('begin'))
+        with self._lock:
+            request = vtgate_pb2.ExecuteBatchRequest(
+                caller_id=self.caller_id, session=self.session, queries=queries)
+            try:
+                response = self.stub.ExecuteBatch(request, timeout=self.timeout)
+            except grpc.RpcError as exc:
+                raise _grpc_error(exc)
+            self.session.CopyFrom(response.session)
+        error = response.error if response.HasField('error') else None
+        results = []
+        for result in response.results:
+            if error is None and result.HasField('error') and result.error.code != vtrpc_pb2.OK:
+                error = result.error
+            results.append(result.result)
+        if begin:
+            if error is not None:
+                self.rollback()
+            else:
+                self.commit()
+            results = results[1:]
+        if error is not None:
+            raise database_error(error)
+        return results
+
+    def stream_execute(self, sql, params=None):
+        """
+        Execute a statement with StreamExecute and yield its
+        query.QueryResults: the fields first, then chunks of rows.
+        """
+        self._check_open()
+        request = vtgate_pb2.StreamExecuteRequest(
+            caller_id=self.caller_id, session=self.session,
+            query=bound_query(sql, params))
+        responses = self.stub.StreamExecute(request, timeout=self.timeout)
+        try:
+            for response in responses:
+                yield response.result
+        except grpc.RpcError as exc:
+            raise _grpc_error(exc)
+        finally:
+            # Stop the stream if the caller gave up before its end.
+            responses.cancel()
+
+    def cursor(self, stream=False):
+        return StreamingCursor(self) if stream else Cursor(self)
+
+    def autocommit(self, on):
+        if on and self.session.in_transaction:
+            self.commit()
+        self.session.autocommit = bool(on)
+
+    def get_autocommit(self):
+        return self.session.autocommit
+
+    def commit(self):
+        if self.session.in_transaction:
+            self.execute('commit')
+
+    def rollback(self):
+        if self.session.in_transaction:
+            self.execute('rollback')
+
+    def ping(self):
+        self.execute('select 1')
+
+    def get_server_info(self):
+        return self.execute('select version()').rows[0].values.decode()
+
+    def close(self):
+        if self.open:
+            self.open = False
+            self.channel.close()
+
+
+class Cursor(object):
+    """A buffered DB-API cursor of a Connection."""
+
+    arraysize = 1
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+        self._executed = None
+        self._rows = []
+        self._result = None
+        self._position = 0
+
+    def execute(self, query, args=None):
+        self._executed = query.encode() if isinstance(query, str) else query
+        result = self.connection.execute(query, args)
+        self._set_result(result)
+        return self.rowcount
+
+    def executemany(self, query, args):
+        args = list(args)
+        if not args:
+            return 0
+        results = self.connection.execute_batch([(query, params) for params in args])
+        self.description = None
+        self._rows = []
+        self._result = None
+        self._position = 0
+        self.rowcount = sum(result.rows_affected for result in results)
+        self.lastrowid = results[-1].insert_id or None
+        return self.rowcount
+
+    def _set_result(self, result):
+        self._result = result
+        if result.fields:
+            self.description = description(result.fields)
+            self._rows = self.connection.decoder(result.fields, result.rows)
+            self.rowcount = len(self._rows)
+        else:
+            self.description = None
+            self._rows = []
+            self.rowcount = result.rows_affected
+        self.lastrowid = result.insert_id or None
+        self._position = 0
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return list(rows)
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return list(rows)
+
+    def fetch_columns(self):
+        """
+        Return the unread rows of the result as a list of columnar.Columns,
+        bypassing the per-row tuples, and mark them read.
+        """
+        from .columnar import LazyRows, decode_columns
+        if self._result is None or not self._result.fields:
+            return []
+        if isinstance(self._rows, LazyRows) and self._position == 0:
+            # Decoded by the columnar decoder already.
+            self._position = len(self._rows)
+            return self._rows.columns
+        columns = decode_columns(self._result.fields, self._result.rows[self._position:])
+        self._position = len(self._rows)
+        return columns
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def nextset(self):
+        return None
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def setoutputsize(self, size, column=None):
+        pass
+
+    def close(self):
+        self._rows = []
+        self._result = None
+
+
+class StreamingCursor(Cursor):
+    """A cursor reading the rows of StreamExecute as they arrive."""
+
+    _stream = None
+    _chunk = ()
+
+    def execute(self, query, args=None):
+        self.close()
+        self._executed = query.encode() if isinstance(query, str) else query
+        self._stream = self.connection.stream_execute(query, args)
+        self._fields = None
+        self._position = 0
+        self.rowcount = -1
+        self.lastrowid = None
+        # The first result holds the fields, and maybe some rows.
+        self._next_chunk()
+        self.description = description(self._fields) if self._fields else None
+        return self.rowcount
+
+    def _next_chunk(self):
+        """
+        Read results until some rows (or, at first, the fields) arrive;
+        return False at the end of the stream.
+        """
+        self._rows = []
+        self._position = 0
+        if self._stream is None:
+            return False
+        first = self._fields is None
+        for result in self._stream:
+            if result.fields:
+                self._fields = result.fields
+            if result.rows:
+                self._chunk = result.rows
+                self._rows = self.connection.decoder(self._fields, result.rows)
+                return True
+            if first and self._fields:
+                return True
+        self._stream = None
+        return False
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows = []
+        while len(rows) < size:
+            if self._position >= len(self._rows) and not self._next_chunk():
+                break
+            chunk = self._rows[self._position:self._position + size - len(rows)]
+            self._position += len(chunk)
+            rows.extend(chunk)
+        return rows
+
+    def fetchall(self):
+        rows = list(self._rows[self._position:])
+        while self._next_chunk():
+            rows.extend(self._rows)
+        self._position = len(self._rows)
+        return rows
+
+    def fetch_columns(self):
+        from .columnar import decode_columns
+        if not self._fields:
+            return []
+        rows = list(self._chunk[self._position:]) if self._rows else []
+        # Read the rest of the stream without decoding it chunk by chunk.
+        if self._stream is not None:
+            for result in self._stream:
+                rows.extend(result.rows)
+            self._stream = None
+        self._rows = []
+        self._position = 0
+        return decode_columns(self._fields, rows)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        self._rows = []
+
+
+def connect(address, target, user='', timeout=None, credentials=None, options=None,
+            decoder=decode_rows):
+    """
+    Open a Connection to the vtgate at `address` using `target`, e.g.
+    'commerce@replica'. `credentials` and `options` are passed to the gRPC
+    channel; `decoder` turns the fields and rows of a result into the rows
+    the cursors return.
+    """
+    return Connection(address, target, user=user, timeout=timeout,
+                      credentials=credentials, options=options, decoder=decoder)
@@ -0,0 +1,32 @@
+"""
+Models of the customer keyspace of examples/local, for the tests of the
+ORM helpers. Importing this module sets up Django with no database.
+"""
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(INSTALLED_APPS=[], USE_TZ=True)
+    django.setup()
+
+from django.db import models  # noqa: E402
+
+
+class Customer(models.Model):
+    customer_id = models.BigAutoField(primary_key=True)
+    email = models.CharField(max_length=128)
+
+    class Meta:
+        app_label = 'tests'
+        db_table = 'customer'
+
+
+class Order(models.Model):
+    order_id = models.BigAutoField(primary_key=True)
+    customer = models.ForeignKey(Customer, models.DO_NOTHING, null=True)
+    sku = models.CharField(max_length=128)
+    price = models.BigIntegerField()
+
+    class Meta:
+        app_label = 'tests'
+        db_table = 'corder'
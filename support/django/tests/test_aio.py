@@ -0,0 +1,65 @@
+"""
+The connection parameters and session setup of the asyncio pools.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import unittest
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from custom_db_backends.vitess import aio
+except ImproperlyConfigured:  # aiomysql isn't installed.
+    aio = None
+
+
+class FakeWrapper(object):
+
+    def __init__(self, options=None, isolation_level='read committed', variables=None,
+                 transaction_mode='SINGLE', target='commerce'):
+        self.settings_dict = {'NAME': 'commerce'}
+        self.options = options or {}
+        self.isolation_level = isolation_level
+        self.variables = variables or {}
+        self.transaction_mode = transaction_mode
+        self.target = target
+
+    def get_connection_params(self):
+        params = {'host': 'vtgate', 'port': 15306, 'user': 'app', 'charset': 'utf8'}
+        params.update(self.options)
+        return params
+
+    def get_target(self):
+        return self.target
+
+    def session_values(self):
+        values = {name: "'%s'" % value for name, value in self.variables.items()}
+        if self.transaction_mode:
+            values['transaction_mode'] = "'%s'" % self.transaction_mode
+        return values
+
+
+@unittest.skipIf(aio is None, 'aiomysql is not installed')
+class SessionSetupTest(unittest.TestCase):
+
+    def test_connect_kwargs_keep_init_command(self):
+        kwargs = aio.connect_kwargs(FakeWrapper({'init_command': 'SET @a = 1'}))
+        self.assertEqual(kwargs, {
+            'autocommit': True, 'host': 'vtgate', 'port': 15306, 'user': 'app',
+            'charset': 'utf8', 'init_command': 'SET @a = 1', 'db': 'commerce'})
+
+    def test_session_setup(self):
+        wrapper = FakeWrapper(variables={'time_zone': '+00:00'}, target='commerce@replica')
+        self.assertEqual(aio.session_setup(wrapper), [
+            'SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED',
+            'USE `commerce@replica`',
+            "SET time_zone = '+00:00', transaction_mode = 'SINGLE'",
+        ])
+
+    def test_session_setup_of_defaults(self):
+        wrapper = FakeWrapper(isolation_level=None, transaction_mode=None)
+        self.assertEqual(aio.session_setup(wrapper), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
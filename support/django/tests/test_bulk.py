@@ -0,0 +1,186 @@
+"""
+The batches of the shard-aware bulk_create() and the transaction mode they
+run in.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import threading
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+from django.db.models import QuerySet
+
+from custom_db_backends.vitess import bulk, sequences
+from custom_db_backends.vitess.keyrange import ShardResolver
+from custom_db_backends.vitess.vschema import Keyspace
+from tests.models import Customer
+
+# hash(1) and hash(2) are in -80, hash(4) in 80-.
+VSCHEMA = {
+    'sharded': True,
+    'vindexes': {
+        'hash': {'type': 'hash'},
+        'customer_email_idx': {
+            'type': 'consistent_lookup_unique', 'owner': 'customer',
+            'params': {'table': 'customer.customer_email_idx', 'from': 'email',
+                       'to': 'keyspace_id'},
+        },
+        'unicode_loose_md5': {'type': 'unicode_loose_md5'},
+    },
+    'tables': {
+        'customer': {'column_vindexes': [{'column': 'customer_id', 'name': 'hash'},
+                                         {'column': 'email', 'name': 'customer_email_idx'}]},
+        'customer_email_idx': {'column_vindexes': [{'column': 'email',
+                                                    'name': 'unicode_loose_md5'}]},
+    },
+}
+
+
+def vschema(lookup_type=None):
+    if lookup_type is None:
+        return {'sharded': True, 'vindexes': {'hash': {'type': 'hash'}},
+                'tables': {'customer': {'column_vindexes': [
+                    {'column': 'customer_id', 'name': 'hash'}]}}}
+    data = dict(VSCHEMA, vindexes=dict(VSCHEMA['vindexes']))
+    data['vindexes']['customer_email_idx'] = dict(data['vindexes']['customer_email_idx'],
+                                                  type=lookup_type)
+    return data
+
+
+class FakeWrapper(object):
+
+    def __init__(self, vschema_data, mode='SINGLE', in_atomic_block=False):
+        self.vitess_settings = {'VSCHEMA': vschema_data, 'SHARDS': ['-80', '80-']}
+        self.vschema = Keyspace.from_dict('customer', vschema_data)
+        self.shard_resolver = ShardResolver(['-80', '80-'])
+        self.current_transaction_mode = mode
+        self.in_atomic_block = in_atomic_block
+
+    def bulk_settings(self):
+        return {}
+
+    def bulk_limits(self):
+        return 500, 1024 * 1024
+
+    def keyspace_ids(self, table, values):
+        return self.vschema.table(table).primary_vindex.vindex.map(values)
+
+    @contextmanager
+    def transaction_mode(self, mode):
+        previous, self.current_transaction_mode = self.current_transaction_mode, mode
+        try:
+            yield
+        finally:
+            self.current_transaction_mode = previous
+
+
+def customers(*ids):
+    return [Customer(customer_id=customer_id, email='%s@x' % customer_id)
+            for customer_id in ids]
+
+
+class InterleaveTest(unittest.TestCase):
+
+    def test_round_robin(self):
+        self.assertEqual(bulk._interleave([[1, 2, 3], [], [4], [5, 6]]), [1, 4, 5, 2, 6, 3])
+
+
+class PlanBatchesTest(unittest.TestCase):
+
+    def test_by_shard(self):
+        connection = FakeWrapper(vschema())
+        batches = bulk.plan_batches(connection, Customer, customers(1, 4, 2), 500, 1 << 20)
+        self.assertEqual([[obj.customer_id for obj in batch] for batch in batches],
+                         [[1, 2], [4]])
+
+    def test_lookup_batches_span_shards(self):
+        connection = FakeWrapper(vschema('consistent_lookup_unique'))
+        objs = customers(1, 4, 2)
+        batches = bulk.plan_batches(connection, Customer, objs, 500, 1 << 20)
+        self.assertEqual(batches, [objs])
+
+    def test_no_spanning_in_single_transaction(self):
+        connection = FakeWrapper(vschema('consistent_lookup_unique'), in_atomic_block=True)
+        batches = bulk.plan_batches(connection, Customer, customers(1, 4, 2), 500, 1 << 20)
+        self.assertEqual(len(batches), 2)
+        connection.current_transaction_mode = 'MULTI'
+        batches = bulk.plan_batches(connection, Customer, customers(1, 4, 2), 500, 1 << 20)
+        self.assertEqual(len(batches), 1)
+
+
+class EstimateWritesTest(unittest.TestCase):
+
+    def estimate(self, connection, batches):
+        shards = bulk._plan(connection, Customer, [obj for batch in batches for obj in batch],
+                            500, 1 << 20)[1]
+        return bulk.estimate_writes(connection, Customer, batches, shards)
+
+    def test_per_shard(self):
+        estimate = self.estimate(FakeWrapper(vschema()), [customers(1, 2), customers(4)])
+        self.assertEqual(estimate['statements'], 2)
+        self.assertEqual(estimate['multi_shard_inserts'], 0)
+
+    def test_spanning(self):
+        estimate = self.estimate(FakeWrapper(vschema()), [customers(1, 2, 4)])
+        self.assertEqual(estimate['statements'], 2)
+        self.assertEqual(estimate['multi_shard_inserts'], 1)
+
+    def test_lookups(self):
+        # The lookup rows of a consistent lookup are written in transactions
+        # of their own, those of other lookups in the transaction of the INSERT.
+        estimate = self.estimate(FakeWrapper(vschema('consistent_lookup_unique')),
+                                 [customers(1, 2)])
+        self.assertEqual(estimate['lookup_statements'], 2)
+        self.assertEqual(estimate['multi_shard_inserts'], 0)
+        estimate = self.estimate(FakeWrapper(vschema('lookup_unique')), [customers(1, 2)])
+        self.assertEqual(estimate['multi_shard_inserts'], 1)
+
+    def test_unknown_shards(self):
+        estimate = bulk.estimate_writes(FakeWrapper(vschema()), Customer, [customers(1, 2)])
+        self.assertEqual(estimate['multi_shard_inserts'], 1)
+
+
+class BulkCreateTest(unittest.TestCase):
+
+    def bulk_create(self, connection, objs, concurrency=1):
+        inserted = []
+        self.threads = set()
+
+        def bulk_create(queryset, batch, batch_size=None):
+            inserted.append(([obj.customer_id for obj in batch],
+                             connection.current_transaction_mode))
+            self.threads.add(threading.current_thread())
+        databases = {'default': connection}
+        with mock.patch.object(bulk, 'connections', databases), \
+                mock.patch.object(sequences, 'connections', databases), \
+                mock.patch.object(QuerySet, 'bulk_create', bulk_create):
+            bulk.bulk_create(Customer, objs, using='default', concurrency=concurrency)
+        return inserted
+
+    def test_spanning_batches_run_in_multi_mode(self):
+        connection = FakeWrapper(vschema('consistent_lookup_unique'))
+        self.assertEqual(self.bulk_create(connection, customers(1, 4, 2)),
+                         [([1, 4, 2], 'MULTI')])
+        self.assertEqual(connection.current_transaction_mode, 'SINGLE')
+
+    def test_single_shard_batches_keep_the_mode(self):
+        connection = FakeWrapper(vschema())
+        self.assertEqual(self.bulk_create(connection, customers(1, 4, 2)),
+                         [([1, 2], 'SINGLE'), ([4], 'SINGLE')])
+
+    def test_lookup_writes_run_in_multi_mode(self):
+        connection = FakeWrapper(vschema('lookup_unique'))
+        self.assertEqual(self.bulk_create(connection, customers(1, 2)), [([1, 2], 'MULTI')])
+
+    def test_atomic_block_runs_on_the_callers_connection(self):
+        # The connections of worker threads wouldn't be in the caller's
+        # transaction.
+        connection = FakeWrapper(vschema(), in_atomic_block=True)
+        self.assertEqual(self.bulk_create(connection, customers(1, 4, 2), concurrency=4),
+                         [([1, 2], 'SINGLE'), ([4], 'SINGLE')])
+        self.assertEqual(self.threads, {threading.current_thread()})
+
+
+if __name__ == '__main__':
+    unittest.main()
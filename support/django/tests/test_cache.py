@@ -0,0 +1,155 @@
+"""
+The result cache: TTL, LRU, invalidation, and the keys of CachingCursor.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import unittest
+
+from custom_db_backends.vitess.cache import CachingCursor, ResultCache
+from custom_db_backends.vitess.session import SessionState
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResultCache(tables=['Product', 'customer'], ttl=60, max_entries=2)
+
+    def put(self, key, tables=frozenset(['product'])):
+        generation = self.cache.generation(tables)
+        return self.cache.set(key, tables, generation, None, ((1,),), 1)
+
+    def test_cacheable_tables(self):
+        self.assertEqual(self.cache.cacheable_tables('SELECT * FROM product'),
+                         frozenset(['product']))
+        self.assertIsNone(self.cache.cacheable_tables('SELECT * FROM product, corder'))
+        self.assertIsNone(self.cache.cacheable_tables('SELECT * FROM product FOR UPDATE'))
+        self.assertIsNone(self.cache.cacheable_tables('DELETE FROM product'))
+        self.assertIsNone(self.cache.cacheable_tables('SELECT 1'))
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.put('a')
+        self.assertEqual(self.cache.get('a').rows, ((1,),))
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'invalidations': 0,
+                                              'entries': 1})
+
+    def test_ttl(self):
+        self.put('a').expires_at -= 61
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_lru(self):
+        self.put('a')
+        self.put('b')
+        self.cache.get('a')
+        self.put('c')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+
+    def test_invalidate_statement(self):
+        self.put('a')
+        self.put('b', frozenset(['customer']))
+        self.cache.invalidate_statement('UPDATE product SET price = 2')
+        self.cache.invalidate_statement('SELECT * FROM customer')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('b'))
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    def test_stale_result_is_not_cached(self):
+        tables = frozenset(['product'])
+        generation = self.cache.generation(tables)
+        self.cache.invalidate(tables)
+        result = self.cache.set('a', tables, generation, None, ((1,),), 1)
+        self.assertEqual(result.rows, ((1,),))
+        self.assertIsNone(self.cache.get('a'))
+
+
+class FakeWrapper(object):
+
+    in_atomic_block = False
+
+    def __init__(self, target):
+        self.session_state = SessionState(target)
+        self.on_commit_callbacks = []
+
+    def on_commit(self, func):
+        self.on_commit_callbacks.append(func)
+
+    def commit(self):
+        self.in_atomic_block = False
+        callbacks, self.on_commit_callbacks = self.on_commit_callbacks, []
+        for func in callbacks:
+            func()
+
+
+class FakeCursor(object):
+
+    arraysize = 1
+    description = (('sku',),)
+
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.executed = []
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.executed.append(query)
+        self.rows = [(self.wrapper.session_state.target,)]
+        self.rowcount = 1
+        return 1
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+
+class CachingCursorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wrapper = FakeWrapper('commerce')
+        self.raw = FakeCursor(self.wrapper)
+        self.cursor = CachingCursor(self.wrapper, self.raw, ResultCache(['product']))
+
+    def fetch(self, sql='SELECT sku FROM product WHERE sku = %s', args=('a',)):
+        self.cursor.execute(sql, args)
+        return self.cursor.fetchall()
+
+    def test_cached(self):
+        self.assertEqual(self.fetch(), [('commerce',)])
+        self.assertEqual(self.fetch(), [('commerce',)])
+        self.assertEqual(len(self.raw.executed), 1)
+        self.fetch(args=('b',))
+        self.assertEqual(len(self.raw.executed), 2)
+
+    def test_keyed_by_target(self):
+        self.fetch()
+        self.wrapper.session_state.target = 'commerce@replica'
+        self.assertEqual(self.fetch(), [('commerce@replica',)])
+        self.assertEqual(len(self.raw.executed), 2)
+
+    def test_write_invalidates(self):
+        self.fetch()
+        self.cursor.execute('UPDATE product SET price = 1')
+        self.fetch()
+        self.assertEqual(len(self.raw.executed), 3)
+
+    def test_write_invalidates_again_on_commit(self):
+        self.wrapper.in_atomic_block = True
+        self.cursor.execute('UPDATE product SET price = 1')
+        # Another connection reads the rows the transaction replaces.
+        other = CachingCursor(FakeWrapper('commerce'), FakeCursor(self.wrapper),
+                              self.cursor.cache)
+        other.execute('SELECT sku FROM product WHERE sku = %s', ('a',))
+        self.assertEqual(self.cursor.cache.stats()['entries'], 1)
+        self.wrapper.commit()
+        self.assertEqual(self.cursor.cache.stats()['entries'], 0)
+
+    def test_not_cached_in_transactions(self):
+        self.wrapper.in_atomic_block = True
+        self.fetch()
+        self.fetch()
+        self.assertEqual(len(self.raw.executed), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Columnar decoding of query.proto rows, with and without NumPy.
+
+Needs mysqlclient and the generated proto modules (see vtgate_grpc.py).
+Run from support/django with: python -m unittest discover tests
+"""
+import datetime
+import unittest
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from custom_db_backends.vitess import columnar
+    from custom_db_backends.vitess.vtgate_grpc import decode_rows, query_pb2
+except ImproperlyConfigured:
+    columnar = None
+
+numpy = getattr(columnar, 'numpy', None)
+
+
+def result(fields, rows):
+    fields = [query_pb2.Field(name=name, type=field_type) for name, field_type in fields]
+    encoded = []
+    for row in rows:
+        encoded.append(query_pb2.Row(
+            lengths=[-1 if value is None else len(value) for value in row],
+            values=b''.join(value for value in row if value is not None)))
+    return fields, encoded
+
+
+@unittest.skipIf(columnar is None, 'mysqlclient or the vtgate gRPC modules are missing')
+class DecodeColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fields, self.rows = result(
+            [('id', query_pb2.INT64), ('price', query_pb2.FLOAT64),
+             ('created', query_pb2.DATETIME), ('email', query_pb2.VARCHAR),
+             ('data', query_pb2.VARBINARY)],
+            [[b'1', b'1.5', b'2020-01-02 03:04:05', 'é@x'.encode('utf-8'), b'\x00\x01\x00'],
+             [None, b'-2', b'0000-00-00 00:00:00', None, None],
+             [b'-9223372036854775808', None, None, b'', b'']])
+
+    def test_rows(self):
+        self.assertEqual(list(columnar.decode_lazy(self.fields, self.rows)),
+                         decode_rows(self.fields, self.rows))
+        self.assertEqual(decode_rows(self.fields, self.rows)[0][2],
+                         datetime.datetime(2020, 1, 2, 3, 4, 5))
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_arrays(self):
+        ids, prices, created, emails, data = columnar.decode_columns(self.fields, self.rows)
+        self.assertEqual(ids.values.dtype, numpy.int64)
+        self.assertEqual(ids.nulls.tolist(), [False, True, False])
+        self.assertEqual(prices.values.dtype, numpy.float64)
+        self.assertEqual(created.nulls.tolist(), [False, True, True])
+        self.assertEqual(emails.values.dtype.kind, 'U')
+        self.assertEqual(data.values, [b'\x00\x01\x00', None, b''])
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_wide_or_ragged_text(self):
+        for values in ([b'x' * 1000, b'y'], [b'x' * 100] + [b''] * 100):
+            fields, rows = result([('notes', query_pb2.TEXT)], [[value] for value in values])
+            column, = columnar.decode_columns(fields, rows)
+            self.assertEqual(column.values.dtype, object)
+            self.assertEqual(list(column.values), [value.decode() for value in values])
+            self.assertEqual(list(columnar.decode_lazy(fields, rows)),
+                             decode_rows(fields, rows))
+
+    def test_without_numpy(self):
+        columnar.numpy = None
+        try:
+            self.assertEqual(list(columnar.decode_lazy(self.fields, self.rows)),
+                             decode_rows(self.fields, self.rows))
+        finally:
+            columnar.numpy = numpy
+
+
+if __name__ == '__main__':
+    unittest.main()
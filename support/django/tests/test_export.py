@@ -0,0 +1,91 @@
+"""
+Chunk planning helpers and the file writers of the parallel export.
+
+Needs mysqlclient, and pyarrow for the parquet writer.
+Run from support/django with: python -m unittest discover tests
+"""
+import datetime
+import decimal
+import os
+import shutil
+import tempfile
+import unittest
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from custom_db_backends.vitess import export
+except ImproperlyConfigured:
+    export = None
+
+pyarrow = getattr(export, 'pyarrow', None)
+
+# cursor.description of (id BIGINT, price DECIMAL(10,2), name VARCHAR,
+# created DATETIME, data VARBINARY).
+DESCRIPTION = (
+    ('id', 8, None, 20, 20, 0, False),
+    ('price', 246, None, 12, 12, 2, True),
+    ('name', 253, None, 255, 255, 0, True),
+    ('created', 12, None, 19, 19, 0, True),
+    ('data', 253, None, 255, 255, 0, True),
+)
+COLUMNS = [column[0] for column in DESCRIPTION]
+
+
+@unittest.skipIf(export is None, 'mysqlclient is not installed')
+class ChunkTest(unittest.TestCase):
+
+    def test_bounds(self):
+        self.assertEqual(export._bounds(1, 100, 4), [26, 51, 76])
+        self.assertEqual(export._bounds(1, 2, 4), [2])
+        self.assertEqual(export._bounds(None, None, 4), [])
+        self.assertEqual(export._bounds(1, 100, 1), [])
+
+    def test_chunk_query(self):
+        chunk = {'lower': 26, 'upper': None}
+        self.assertEqual(export.chunk_query('corder', ['order_id', 'sku'], 'order_id', chunk),
+                         ('SELECT `order_id`, `sku` FROM `corder` WHERE `order_id` >= %s '
+                          'ORDER BY `order_id`', [26]))
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class ParquetWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'chunk.parquet')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, *batches):
+        writer = export.ParquetWriter(self.path, COLUMNS, DESCRIPTION)
+        for batch in batches:
+            writer.write(batch)
+        writer.close()
+        return pyarrow.parquet.read_table(self.path)
+
+    def test_null_first_batch(self):
+        created = datetime.datetime(2024, 1, 2, 3, 4, 5)
+        table = self.write([(1, None, None, None, None)],
+                           [(2, decimal.Decimal('1.50'), 'a', created, b'\xff')])
+        self.assertEqual(table.schema.types, [
+            pyarrow.int64(), pyarrow.decimal128(12, 2), pyarrow.string(),
+            pyarrow.timestamp('us'), pyarrow.string()])
+        self.assertEqual(table.to_pylist()[1], {
+            'id': 2, 'price': decimal.Decimal('1.50'), 'name': 'a', 'created': created,
+            'data': '\\xff'})
+
+    def test_binary_strings(self):
+        table = self.write([(1, None, 'a', None, b'\xff')], [(2, None, None, None, b'\x00')])
+        self.assertEqual(table.schema.field('data').type, pyarrow.binary())
+        self.assertEqual(table.column('data').to_pylist(), [b'\xff', b'\x00'])
+
+    def test_empty_chunk(self):
+        table = self.write()
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.schema.field('price').type, pyarrow.decimal128(12, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Resolution and merging of the orderings of fanout.ordered().
+
+Run from support/django with: python -m unittest discover tests
+"""
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+from custom_db_backends.vitess import fanout
+from tests.models import Customer, Order
+
+
+def order(order_id, price, customer=None):
+    return Order(order_id=order_id, price=price, sku='sku', customer=customer)
+
+
+class OrderedTest(unittest.TestCase):
+
+    def ordered(self, queryset, shards, **options):
+        with mock.patch.object(fanout, 'map_shards', return_value=OrderedDict(shards)):
+            return fanout.ordered(queryset, **options)
+
+    def test_instances(self):
+        shards = [('-80', [order(1, 5), order(3, 2)]), ('80-', [order(2, 4), order(4, None)])]
+        rows = self.ordered(Order.objects.order_by('-price'), shards, limit=3)
+        self.assertEqual([row.order_id for row in rows], [1, 2, 3])
+
+    def test_nulls_first(self):
+        shards = [('-80', [order(4, None), order(3, 2)]), ('80-', [order(2, 4)])]
+        rows = self.ordered(Order.objects.order_by('price'), shards)
+        self.assertEqual([row.order_id for row in rows], [4, 3, 2])
+
+    def test_related_path(self):
+        a, b = Customer(customer_id=1, email='a@x'), Customer(customer_id=2, email='b@x')
+        shards = [('-80', [order(1, 1, b)]), ('80-', [order(3, 1), order(2, 1, a)])]
+        rows = self.ordered(Order.objects.order_by('customer__customer_id', 'pk'), shards)
+        self.assertEqual([row.order_id for row in rows], [3, 2, 1])
+        _, relation = fanout._instance_getter(Order.objects.all(), 'customer__customer_id')
+        self.assertEqual(relation, 'customer')
+
+    def test_foreign_key(self):
+        shards = [('-80', [order(1, 1, Customer(customer_id=2))]),
+                  ('80-', [order(2, 1, Customer(customer_id=1))])]
+        rows = self.ordered(Order.objects.order_by('customer'), shards)
+        self.assertEqual([row.order_id for row in rows], [2, 1])
+
+    def test_values(self):
+        shards = [('-80', [{'customer_id': 1, 'price': 5}]),
+                  ('80-', [{'customer_id': 2, 'price': 7}])]
+        rows = self.ordered(Order.objects.values().order_by('-price'), shards)
+        self.assertEqual([row['customer_id'] for row in rows], [2, 1])
+        rows = self.ordered(Order.objects.values().order_by('customer'), shards)
+        self.assertEqual([row['customer_id'] for row in rows], [1, 2])
+
+    def test_values_of_related_path(self):
+        shards = [('-80', [{'customer__customer_id': 2}]), ('80-', [{'customer__customer_id': 1}])]
+        rows = self.ordered(Order.objects.values('customer__customer_id')
+                            .order_by('customer__customer_id'), shards)
+        self.assertEqual(rows, [{'customer__customer_id': 1}, {'customer__customer_id': 2}])
+
+    def test_unmergeable_orderings(self):
+        querysets = [
+            Order.objects.all(),
+            Order.objects.order_by('?'),
+            Order.objects.order_by(F('price').desc()),
+            Order.objects.order_by(RawSQL('price', ())),
+            Order.objects.extra(select={'total': 'price * 2'}).order_by('total'),
+            Order.objects.order_by('sku'),
+            Order.objects.order_by('customer__email'),
+            Order.objects.values('sku').order_by('-sku'),
+            Order.objects.values('sku').order_by('price'),
+            Order.objects.values_list('price').order_by('price'),
+        ]
+        for queryset in querysets:
+            with mock.patch.object(fanout, 'map_shards') as map_shards:
+                with self.assertRaises(ValueError):
+                    fanout.ordered(queryset)
+            self.assertFalse(map_shards.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Key range parsing and shard resolution.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import unittest
+
+from custom_db_backends.vitess.keyrange import (
+    KeyRange, ShardResolver, shard_reference_name,
+)
+
+
+class KeyRangeTest(unittest.TestCase):
+
+    def test_from_shard_name(self):
+        self.assertEqual(KeyRange.from_shard_name('-80'), KeyRange(b'', b'\x80'))
+        self.assertEqual(KeyRange.from_shard_name('40-80'), KeyRange(b'\x40', b'\x80'))
+        self.assertEqual(KeyRange.from_shard_name('80-'), KeyRange(b'\x80', b''))
+        for name in ('0', '-', ''):
+            self.assertEqual(KeyRange.from_shard_name(name), KeyRange())
+
+    def test_invalid_shard_name(self):
+        for name in ('shard1', 'zz-80', '8-'):
+            with self.assertRaises(ValueError):
+                KeyRange.from_shard_name(name)
+
+    def test_contains(self):
+        key_range = KeyRange.from_shard_name('40-80')
+        self.assertFalse(key_range.contains(b'\x3f\xff'))
+        self.assertTrue(key_range.contains(b'\x40'))
+        self.assertTrue(key_range.contains(b'\x7f\xff\xff'))
+        self.assertFalse(key_range.contains(b'\x80'))
+        self.assertTrue(KeyRange().contains(b'\xff\xff'))
+
+    def test_intersects(self):
+        lower = KeyRange.from_shard_name('-80')
+        self.assertTrue(lower.intersects(KeyRange.from_shard_name('40-c0')))
+        self.assertFalse(lower.intersects(KeyRange.from_shard_name('80-')))
+        self.assertTrue(lower.intersects(KeyRange()))
+        self.assertTrue(KeyRange().intersects(KeyRange.from_shard_name('80-')))
+
+    def test_str(self):
+        self.assertEqual(str(KeyRange.from_shard_name('40-80')), '40-80')
+        self.assertEqual(str(KeyRange.from_shard_name('80-')), '80-')
+        self.assertEqual(str(KeyRange()), '-')
+
+
+class ShardResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resolver = ShardResolver(['80-c0', '-40', 'c0-', '40-80'])
+
+    def test_shards_are_sorted(self):
+        self.assertEqual(self.resolver.shards, ['-40', '40-80', '80-c0', 'c0-'])
+
+    def test_shard_for_keyspace_id(self):
+        self.assertEqual(self.resolver.shard_for_keyspace_id(b'\x00'), '-40')
+        self.assertEqual(self.resolver.shard_for_keyspace_id(b'\x40'), '40-80')
+        self.assertEqual(self.resolver.shard_for_keyspace_id(b'\xbf\xff'), '80-c0')
+        self.assertEqual(self.resolver.shard_for_keyspace_id(b'\xff' * 8), 'c0-')
+
+    def test_gap(self):
+        resolver = ShardResolver(['-40', '80-'])
+        with self.assertRaises(ValueError):
+            resolver.shard_for_keyspace_id(b'\x50')
+
+    def test_shards_for_key_range(self):
+        self.assertEqual(
+            self.resolver.shards_for_key_range(KeyRange.from_shard_name('30-90')),
+            ['-40', '40-80', '80-c0'])
+        self.assertEqual(self.resolver.shards_for_key_range(KeyRange()),
+                         self.resolver.shards)
+
+    def test_unsharded(self):
+        resolver = ShardResolver(['0'])
+        self.assertEqual(resolver.shard_for_keyspace_id(b'\x12\x34'), '0')
+
+    def test_from_srv_keyspace(self):
+        srv_keyspace = {'partitions': [
+            {'served_type': 'REPLICA', 'shard_references': [{'name': '0'}]},
+            {'served_type': 1, 'shard_references': [
+                {'name': '-80'},
+                # JSON encodes the bytes of a key range in base64.
+                {'key_range': {'start': 'gA=='}},
+            ]},
+        ]}
+        resolver = ShardResolver.from_srv_keyspace(srv_keyspace)
+        self.assertEqual(resolver.shards, ['-80', '80-'])
+        resolver = ShardResolver.from_srv_keyspace(srv_keyspace, 'replica')
+        self.assertEqual(resolver.shards, ['0'])
+        with self.assertRaises(ValueError):
+            ShardResolver.from_srv_keyspace(srv_keyspace, 'rdonly')
+
+    def test_shard_reference_name(self):
+        self.assertEqual(shard_reference_name({'name': '40-80'}), '40-80')
+        self.assertEqual(
+            shard_reference_name({'key_range': {'start': 'QA==', 'end': 'gA=='}}), '40-80')
+        self.assertEqual(shard_reference_name({}), '-')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+Statement normalization: bound literals, padded IN-lists and the literals
+that must stay inline.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import unittest
+
+from custom_db_backends.vitess.normalize import Normalizer, compile_template
+
+
+class CompileTemplateTest(unittest.TestCase):
+
+    def assertNormalized(self, sql, params, expected_sql, expected_params):
+        normalized = Normalizer().normalize(sql, params)
+        self.assertEqual(normalized, (expected_sql, expected_params))
+
+    def test_literals(self):
+        self.assertNormalized(
+            "SELECT * FROM t WHERE a = 1 AND b = 'x' LIMIT 21", None,
+            'SELECT * FROM t WHERE a = %s AND b = %s LIMIT %s', [1, 'x', 21])
+
+    def test_literals_between_params(self):
+        self.assertNormalized(
+            'SELECT * FROM t WHERE a = %s AND b = 2 AND c = %s', ['x', 'y'],
+            'SELECT * FROM t WHERE a = %s AND b = %s AND c = %s', ['x', 2, 'y'])
+
+    def test_in_list_padding(self):
+        self.assertNormalized(
+            'SELECT * FROM t WHERE id IN (%s, %s, %s)', [1, 2, 3],
+            'SELECT * FROM t WHERE id IN (%s, %s, %s, %s)', [1, 2, 3, 3])
+        self.assertIsNone(compile_template('SELECT * FROM t WHERE id IN (%s, %s)'))
+
+    def test_percent_in_literal(self):
+        # With parameters the statement is %-formatted, so '%%' is one '%'.
+        self.assertNormalized(
+            "SELECT * FROM t WHERE a LIKE '100%%' AND b = %s", [1],
+            'SELECT * FROM t WHERE a LIKE %s AND b = %s', ['100%', 1])
+
+    def test_percent_without_params(self):
+        sql = "SELECT * FROM t WHERE a LIKE '100%' AND b = 1"
+        self.assertEqual(Normalizer().normalize(sql, None), (sql, None))
+
+    def test_introducers(self):
+        for literal in ("x'AB'", "X'AB'", "b'01'", "B'01'", "N'text'", "n'text'",
+                        "_utf8mb4'text'"):
+            sql = 'SELECT * FROM t WHERE a = %s' % literal
+            self.assertIsNone(compile_template(sql), literal)
+
+    def test_typed_strings(self):
+        self.assertIsNone(compile_template("SELECT * FROM t WHERE d = DATE '2020-01-01'"))
+        template = compile_template("SELECT * FROM t WHERE a = 'x' COLLATE 'utf8_bin'")
+        self.assertEqual(template.sql, "SELECT * FROM t WHERE a = %s COLLATE 'utf8_bin'")
+
+    def test_escaped_strings_stay_inline(self):
+        self.assertIsNone(compile_template(r"SELECT * FROM t WHERE a = 'it\'s'"))
+        self.assertIsNone(compile_template("SELECT * FROM t WHERE a = 'it''s'"))
+
+    def test_positions_and_types_stay_inline(self):
+        self.assertIsNone(compile_template('SELECT a, b FROM t ORDER BY 2'))
+        self.assertIsNone(compile_template('SELECT CAST(a AS DECIMAL(10, 2)) FROM t'))
+        self.assertIsNone(compile_template('select next 1000 values from seq'))
+        template = compile_template('SELECT a FROM t GROUP BY 1 LIMIT 5')
+        self.assertEqual(template.sql, 'SELECT a FROM t GROUP BY 1 LIMIT %s')
+
+    def test_other_statements(self):
+        self.assertIsNone(compile_template('SET autocommit = 1'))
+
+    def test_param_count_mismatch(self):
+        sql = 'SELECT * FROM t WHERE a = %s AND b = 2'
+        self.assertEqual(Normalizer().normalize(sql, [1, 2]), (sql, [1, 2]))
+
+
+class NormalizerTest(unittest.TestCase):
+
+    def test_lru(self):
+        normalizer = Normalizer(max_templates=2)
+        for sql in ('SELECT 1', 'SELECT 2', 'SELECT 1', 'SELECT 3'):
+            normalizer.normalize(sql, None)
+        self.assertEqual(normalizer.stats(), {'templates': 2, 'hits': 1, 'misses': 3})
+        normalizer.normalize('SELECT 2', None)
+        self.assertEqual(normalizer.stats()['misses'], 4)
+
+    def test_executemany_is_left_alone(self):
+        calls = []
+        normalizer = Normalizer()
+        normalizer(lambda *args: calls.append(args),
+                   'INSERT INTO t VALUES (1, %s)', [[1], [2]], True, {})
+        self.assertEqual(calls, [('INSERT INTO t VALUES (1, %s)', [[1], [2]], True, {})])
+
+
+if __name__ == '__main__':
+    unittest.main()
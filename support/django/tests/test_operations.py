@@ -0,0 +1,75 @@
+"""
+Batch sizing of DatabaseOperations, with the arguments bulk_create(),
+bulk_update() and the deletion collector of a cascading delete pass.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import unittest
+
+from django.db import models
+
+from custom_db_backends.vitess.operations import DatabaseOperations
+
+
+class FakeWrapper(object):
+
+    def __init__(self, max_rows, max_bytes):
+        self.limits = (max_rows, max_bytes)
+
+    def bulk_limits(self):
+        return self.limits
+
+
+class Row(object):
+
+    def __init__(self, pk, name):
+        self.pk = self.id = pk
+        self.name = name
+
+
+def field(field_class, name, **kwargs):
+    field = field_class(**kwargs)
+    field.set_attributes_from_name(name)
+    return field
+
+
+class BulkBatchSizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fields = [field(models.AutoField, 'id', primary_key=True),
+                       field(models.CharField, 'name', max_length=100)]
+
+    def ops(self, max_rows=500, max_bytes=1024 * 1024):
+        return DatabaseOperations(FakeWrapper(max_rows, max_bytes))
+
+    def test_bulk_create_row_cap(self):
+        objs = [Row(i, 'x') for i in range(1000)]
+        self.assertEqual(self.ops(max_rows=100).bulk_batch_size(self.fields, objs), 100)
+        self.assertEqual(self.ops().bulk_batch_size(self.fields, objs[:10]), 10)
+
+    def test_bulk_create_byte_cap(self):
+        objs = [Row(i, 'x' * 1000) for i in range(1000)]
+        size = self.ops(max_bytes=10000).bulk_batch_size(self.fields, objs)
+        self.assertTrue(1 <= size < 10, size)
+
+    def test_bulk_create_oversized_row(self):
+        objs = [Row(1, 'x' * 100000)]
+        self.assertEqual(self.ops(max_bytes=1000).bulk_batch_size(self.fields, objs), 1)
+
+    def test_no_objs(self):
+        self.assertEqual(self.ops(max_rows=100).bulk_batch_size(self.fields, []), 100)
+
+    def test_bulk_update(self):
+        # QuerySet.bulk_update() passes ['pk', 'pk'] + fields.
+        objs = [Row(i, 'x') for i in range(1000)]
+        self.assertEqual(
+            self.ops(max_rows=100).bulk_batch_size(['pk', 'pk'] + self.fields[1:], objs), 100)
+
+    def test_cascading_delete(self):
+        # Collector.get_del_batches() passes the names of the related fields.
+        objs = [Row(i, 'x') for i in range(1000)]
+        self.assertEqual(self.ops(max_rows=100).bulk_batch_size(['customer'], objs), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Routes predicted by the planner for the customer keyspace of examples/local.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import unittest
+
+from custom_db_backends.vitess.keyrange import ShardResolver
+from custom_db_backends.vitess.planner import Planner
+from custom_db_backends.vitess.vschema import Keyspace
+
+VSCHEMA = {
+    'sharded': True,
+    'vindexes': {
+        'hash': {'type': 'hash'},
+        'corder_sku': {'type': 'consistent_lookup', 'owner': 'corder'},
+    },
+    'tables': {
+        'customer': {'column_vindexes': [{'column': 'customer_id', 'name': 'hash'}]},
+        'corder': {'column_vindexes': [{'column': 'customer_id', 'name': 'hash'},
+                                       {'column': 'sku', 'name': 'corder_sku'}]},
+    },
+}
+
+
+class PlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.planner = Planner({'customer': Keyspace.from_dict('customer', VSCHEMA)},
+                               {'customer': ShardResolver(['-80', '80-'])})
+
+    def assertRoute(self, sql, params, opcode, shards, vindex=None):
+        route = self.planner.route(sql, params)
+        self.assertEqual((route.opcode, route.shards, route.vindex), (opcode, shards, vindex))
+
+    def test_equal_unique(self):
+        # hash(1) = 166b40b44aba4bd6, hash(4) = d2fd8867d50d2dfe.
+        self.assertRoute('SELECT * FROM customer WHERE customer_id = 1', None,
+                         'EqualUnique', ['-80'], 'hash')
+        self.assertRoute('SELECT * FROM `customer` AS c WHERE c.`customer_id` = %s LIMIT 1',
+                         [4], 'EqualUnique', ['80-'], 'hash')
+        self.assertRoute('UPDATE corder SET price = 3 WHERE customer_id = %s AND sku = %s',
+                         [4, 'a'], 'EqualUnique', ['80-'], 'hash')
+
+    def test_in(self):
+        self.assertRoute('DELETE FROM customer WHERE customer_id IN (%s, %s)', [1, 4],
+                         'IN', ['-80', '80-'], 'hash')
+
+    def test_lookup(self):
+        self.assertRoute("SELECT * FROM corder WHERE sku = 'a'", None, 'Equal', None,
+                         'corder_sku')
+
+    def test_scatter(self):
+        self.assertRoute('SELECT * FROM customer', None, 'Scatter', ['-80', '80-'])
+        self.assertRoute('SELECT * FROM customer WHERE customer_id = 1 OR customer_id = 4',
+                         None, 'Scatter', ['-80', '80-'])
+        self.assertRoute('SELECT * FROM customer WHERE customer_id + 0 = 1', None,
+                         'Scatter', ['-80', '80-'])
+
+    def test_grouped_conditions(self):
+        self.assertRoute('SELECT * FROM customer WHERE (customer_id = %s AND email = %s)',
+                         [4, 'a'], 'EqualUnique', ['80-'], 'hash')
+        self.assertRoute('SELECT * FROM corder WHERE sku = %s AND (customer_id = %s OR price > 3)',
+                         ['a', 4], 'Equal', None, 'corder_sku')
+        self.assertRoute('SELECT * FROM customer WHERE (email = %s OR customer_id = %s)',
+                         ['a', 4], 'Scatter', ['-80', '80-'])
+        self.assertRoute('SELECT * FROM customer WHERE email = %s AND '
+                         '(email = %s OR (customer_id = %s AND email = %s))',
+                         ['a', 'b', 4, 'c'], 'Scatter', ['-80', '80-'])
+
+    def test_negated_conditions(self):
+        # What QuerySet.exclude(customer_id=4) runs.
+        self.assertRoute('SELECT `customer`.`customer_id`, `customer`.`email` FROM `customer` '
+                         'WHERE NOT (`customer`.`customer_id` = %s)',
+                         [4], 'Scatter', ['-80', '80-'])
+        self.assertRoute('SELECT * FROM customer WHERE email = %s AND NOT customer_id = %s',
+                         ['a', 4], 'Scatter', ['-80', '80-'])
+        self.assertRoute('SELECT * FROM customer WHERE customer_id NOT IN (%s, %s)', [1, 4],
+                         'Scatter', ['-80', '80-'])
+
+    def test_null_values(self):
+        self.assertRoute('SELECT * FROM customer WHERE customer_id = %s', [None],
+                         'Scatter', ['-80', '80-'])
+        self.assertRoute('SELECT * FROM customer WHERE customer_id IN (%s, %s)', [None, 4],
+                         'EqualUnique', ['80-'], 'hash')
+
+    def test_insert(self):
+        self.assertRoute('INSERT INTO customer (customer_id, email) VALUES (1, %s), (4, %s)',
+                         ['a', 'b'], 'Insert', ['-80', '80-'], 'hash')
+        self.assertRoute('INSERT INTO customer (email) VALUES (%s)', ['a'],
+                         'Insert', None, 'hash')
+
+    def test_unpredicted(self):
+        self.assertIsNone(self.planner.route(
+            'SELECT * FROM customer JOIN corder USING (customer_id)'))
+        self.assertIsNone(self.planner.route(
+            'SELECT * FROM customer WHERE customer_id IN (SELECT customer_id FROM corder)'))
@@ -0,0 +1,168 @@
+"""
+Checkout, timeout and expiry of the connection pool, with fake connections
+instead of vtgate.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import threading
+import time
+import unittest
+
+from custom_db_backends.vitess import pool as pool_module
+from custom_db_backends.vitess.pool import ConnectionPool, PoolTimeout, get_pool
+
+
+class FakeConnection(object):
+
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.closed = False
+        self.pings = 0
+
+    def ping(self):
+        self.pings += 1
+        if not self.healthy:
+            raise Exception('gone away')
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+    def test_reuse(self):
+        pool = ConnectionPool(self.connect, max_size=2)
+        entry = pool.acquire()
+        pool.release(entry)
+        self.assertIs(pool.acquire(), entry)
+        stats = pool.stats()
+        self.assertEqual(stats['connects'], 1)
+        self.assertEqual(stats['reuses'], 1)
+        self.assertEqual(stats['in_use'], 1)
+
+    def test_checkout_is_lifo(self):
+        pool = ConnectionPool(self.connect, max_size=2)
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        self.assertIs(pool.acquire(), second)
+
+    def test_timeout(self):
+        pool = ConnectionPool(self.connect, max_size=1, timeout=0.05)
+        pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        stats = pool.stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['size'], 1)
+
+    def test_waiter_gets_released_connection(self):
+        pool = ConnectionPool(self.connect, max_size=1, timeout=5)
+        entry = pool.acquire()
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        waiter.start()
+        while pool.stats()['waiting'] == 0:
+            time.sleep(0.001)
+        pool.release(entry)
+        waiter.join()
+        self.assertEqual(acquired, [entry])
+        self.assertEqual(len(self.connections), 1)
+
+    def test_expired_connections_are_closed(self):
+        pool = ConnectionPool(self.connect, max_size=1, max_lifetime=60)
+        entry = pool.acquire()
+        pool.release(entry)
+        entry.created_at -= 61
+        fresh = pool.acquire()
+        self.assertIsNot(fresh, entry)
+        self.assertTrue(entry.connection.closed)
+        self.assertEqual(pool.stats()['expired'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_expired_on_release(self):
+        pool = ConnectionPool(self.connect, max_size=1, max_lifetime=60)
+        entry = pool.acquire()
+        entry.created_at -= 61
+        pool.release(entry)
+        self.assertTrue(entry.connection.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+
+    def test_timeout_closes_expired_outside_the_lock(self):
+        pool = ConnectionPool(self.connect, max_size=2, timeout=0.05, max_lifetime=60)
+        busy, idle = pool.acquire(), pool.acquire()
+        pool.release(idle)
+        idle.created_at -= 61
+        # Make the checkout find no room after dropping the expired entry.
+        pool.max_size = 1
+
+        def close():
+            # The pool lock must be free while connections are closed.
+            self.assertTrue(pool._cond.acquire(blocking=False))
+            pool._cond.release()
+            FakeConnection.close(idle.connection)
+        idle.connection.close = close
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertTrue(idle.connection.closed)
+        self.assertFalse(busy.connection.closed)
+
+    def test_failed_health_check(self):
+        pool = ConnectionPool(self.connect, max_size=1, health_check_interval=10)
+        entry = pool.acquire()
+        pool.release(entry)
+        entry.last_used -= 11
+        entry.connection.healthy = False
+        fresh = pool.acquire()
+        self.assertIsNot(fresh, entry)
+        self.assertTrue(entry.connection.closed)
+        self.assertEqual(pool.stats()['failed_health_checks'], 1)
+
+    def test_failed_connect_frees_the_slot(self):
+        def connect():
+            raise IOError('refused')
+        pool = ConnectionPool(connect, max_size=1, timeout=0.05)
+        with self.assertRaises(IOError):
+            pool.acquire()
+        self.assertEqual(pool.stats()['size'], 0)
+
+    def test_close_idle(self):
+        pool = ConnectionPool(self.connect, max_size=2)
+        busy, idle = pool.acquire(), pool.acquire()
+        pool.release(idle)
+        pool.close_idle()
+        self.assertTrue(idle.connection.closed)
+        self.assertFalse(busy.connection.closed)
+        self.assertEqual(pool.stats()['size'], 1)
+
+
+class GetPoolTest(unittest.TestCase):
+
+    def tearDown(self):
+        pool_module._pools.pop('test_get_pool', None)
+
+    def test_shared_per_alias(self):
+        pool = get_pool('test_get_pool', FakeConnection, params={'port': 15306})
+        self.assertIs(get_pool('test_get_pool', FakeConnection, params={'port': 15306}), pool)
+
+    def test_new_params_replace_the_pool(self):
+        pool = get_pool('test_get_pool', FakeConnection, params={'port': 15306})
+        entry = pool.acquire()
+        pool.release(entry)
+        other = get_pool('test_get_pool', FakeConnection, params={'port': 15307})
+        self.assertIsNot(other, pool)
+        self.assertEqual(other.params, {'port': 15307})
+        self.assertTrue(entry.connection.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Sequence blocks reserved client-side, and the keyspace of their sequence.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import threading
+import unittest
+
+from custom_db_backends.vitess.sequences import SequenceCache, qualified_sequence
+from custom_db_backends.vitess.vschema import Keyspace
+
+
+class FakeWrapper(object):
+
+    def __init__(self, name, sharded):
+        self.vschema = Keyspace(name, sharded)
+
+
+class FakeSequenceCache(SequenceCache):
+
+    def __init__(self, *args, **kwargs):
+        super(FakeSequenceCache, self).__init__(*args, **kwargs)
+        self.reserved = []
+        self.next_block = 1
+
+    def _reserve(self, connection, size):
+        self.reserved.append(size)
+        start, self.next_block = self.next_block, self.next_block + size
+        return start
+
+
+class SequenceCacheTest(unittest.TestCase):
+
+    def test_blocks(self):
+        cache = FakeSequenceCache('commerce.customer_seq', block_size=10)
+        self.assertEqual(cache.next_values(None, 3), [1, 2, 3])
+        self.assertEqual(cache.next_values(None, 8), list(range(4, 12)))
+        self.assertEqual(cache.reserved, [10, 10])
+        self.assertEqual(cache.stats(), {'reservations': 2, 'values': 11, 'remaining': 9})
+
+    def test_large_request(self):
+        cache = FakeSequenceCache('commerce.customer_seq', block_size=10)
+        self.assertEqual(len(cache.next_values(None, 25)), 25)
+        self.assertEqual(cache.reserved, [25])
+
+    def test_threads(self):
+        cache = FakeSequenceCache('commerce.customer_seq', block_size=10)
+        values = []
+        threads = [threading.Thread(target=lambda: values.extend(cache.next_values(None, 7)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(values), list(range(1, 57)))
+
+
+class QualifiedSequenceTest(unittest.TestCase):
+
+    def test_qualified_in_vschema(self):
+        connection = FakeWrapper('customer', True)
+        self.assertEqual(qualified_sequence(connection, 'commerce.customer_seq', 'other'),
+                         'commerce.customer_seq')
+
+    def test_keyspace_setting(self):
+        connection = FakeWrapper('customer', True)
+        self.assertEqual(qualified_sequence(connection, 'customer_seq', 'commerce'),
+                         'commerce.customer_seq')
+
+    def test_unsharded_keyspace(self):
+        connection = FakeWrapper('commerce', False)
+        self.assertEqual(qualified_sequence(connection, 'customer_seq'), 'commerce.customer_seq')
+
+    def test_unknown_keyspace(self):
+        self.assertIsNone(qualified_sequence(FakeWrapper('customer', True), 'customer_seq'))
+
+
+if __name__ == '__main__':
+    unittest.main()
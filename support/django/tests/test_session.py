@@ -0,0 +1,104 @@
+"""
+Tracking of the USE and SET statements run on a session, and the statements
+restoring it.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import unittest
+
+from custom_db_backends.vitess.session import SessionState, literal
+
+
+class LiteralTest(unittest.TestCase):
+
+    def test_literal(self):
+        self.assertEqual(literal(None), 'NULL')
+        self.assertEqual(literal(True), '1')
+        self.assertEqual(literal(5), '5')
+        self.assertEqual(literal("it's \\"), "'it''s \\\\'")
+
+
+class ObserveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state = SessionState('commerce')
+
+    def test_use(self):
+        self.state.observe('USE `customer:-80`')
+        self.assertEqual(self.state.target, 'customer:-80')
+        self.state.observe('use customer@replica')
+        self.assertEqual(self.state.target, 'customer@replica')
+
+    def test_set(self):
+        self.state.observe("SET time_zone = '+00:00', @@session.sql_mode = %s, @x := 5",
+                           ['TRADITIONAL'])
+        self.assertEqual(self.state.values, {
+            'time_zone': "'+00:00'", 'sql_mode': "'TRADITIONAL'", '@x': '5'})
+
+    def test_scopes(self):
+        self.state.observe('SET GLOBAL max_connections = 10, SESSION workload = olap')
+        self.state.observe('SET @@global.wait_timeout = 10')
+        self.assertEqual(self.state.values, {'workload': 'OLAP'})
+
+    def test_transaction(self):
+        self.state.observe('SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED')
+        self.state.observe('SET TRANSACTION READ ONLY')
+        self.assertEqual(self.state.values, {'transaction_isolation': "'READ-COMMITTED'"})
+
+    def test_autocommit_is_ignored(self):
+        self.state.observe('SET autocommit = 0')
+        self.assertEqual(self.state.values, {})
+
+    def test_other_statements(self):
+        self.state.observe('SELECT @x := 1')
+        self.assertEqual(self.state.values, {})
+        self.assertFalse(self.state.unknown)
+
+    def test_untrackable(self):
+        for sql in ('SET @x = NOW()', 'SET NAMES utf8mb4', 'SET @x = %s'):
+            state = SessionState('commerce')
+            state.observe(sql)
+            self.assertTrue(state.unknown, sql)
+            self.assertIsNone(state.delta('commerce', {}))
+
+
+class DeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state = SessionState('commerce')
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.state.delta('commerce', {}), [])
+
+    def test_restore(self):
+        self.state.observe('USE customer')
+        self.state.observe("SET time_zone = '+01:00', workload = 'olap', @x = 1")
+        self.assertEqual(self.state.delta('commerce', {'time_zone': "'+00:00'"}), [
+            'USE `commerce`',
+            "SET @x = NULL, time_zone = '+00:00', workload = 'oltp'",
+        ])
+
+    def test_baseline(self):
+        before = dict(self.state.values)
+        self.state.observe("SET sql_mode = 'TRADITIONAL'")
+        self.state.mark_initialized(before)
+        self.assertEqual(self.state.delta(None, {}), [])
+        self.state.observe("SET sql_mode = ''")
+        self.assertEqual(self.state.delta(None, {}), ["SET sql_mode = 'TRADITIONAL'"])
+
+    def test_variables_without_default(self):
+        self.state.observe("SET transaction_mode = 'multi'")
+        self.assertIsNone(self.state.delta(None, {}))
+        self.assertEqual(self.state.delta(None, {'transaction_mode': "'single'"}),
+                         ["SET transaction_mode = 'single'"])
+
+    def test_apply(self):
+        executed = []
+        self.state.observe('SET @x = 1')
+        self.assertTrue(self.state.apply(executed.append, 'customer', {}))
+        self.assertEqual(executed, ['USE `customer`', 'SET @x = NULL'])
+        self.assertEqual(self.state.delta('customer', {}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+The SQL tokenizing helpers.
+
+Run from support/django with: python -m unittest discover tests
+"""
+import unittest
+
+from custom_db_backends.vitess.sqlutil import (
+    add_directive, fingerprint, referenced_tables, statement_type, tokenize,
+)
+
+
+class TokenizeTest(unittest.TestCase):
+
+    def test_kinds(self):
+        tokens = [token for token in tokenize(
+            "SELECT `a``b`, 'it''s', 0x1F, 1.5e3 FROM t /* c */ WHERE x = %s AND y LIKE '%%'")
+            if token[0] != 'space']
+        self.assertEqual(tokens, [
+            ('word', 'SELECT'), ('ident', '`a``b`'), ('other', ','),
+            ('string', "'it''s'"), ('other', ','), ('number', '0x1F'), ('other', ','),
+            ('number', '1.5e3'), ('word', 'FROM'), ('word', 't'), ('comment', '/* c */'),
+            ('word', 'WHERE'), ('word', 'x'), ('other', '='), ('placeholder', '%s'),
+            ('word', 'AND'), ('word', 'y'), ('word', 'LIKE'), ('string', "'%%'"),
+        ])
+
+    def test_percent(self):
+        self.assertEqual([kind for kind, _ in tokenize('a %% b')],
+                         ['word', 'space', 'percent', 'space', 'word'])
+
+    def test_escaped_quote(self):
+        self.assertEqual(list(tokenize(r"'a\'b'")), [('string', r"'a\'b'")])
+
+
+class StatementTypeTest(unittest.TestCase):
+
+    def test_statement_type(self):
+        self.assertEqual(statement_type('select 1'), 'SELECT')
+        self.assertEqual(statement_type('/* comment */ INSERT INTO t VALUES (1)'), 'INSERT')
+        self.assertEqual(statement_type('  (SELECT 1) UNION (SELECT 2)'), 'SELECT')
+        self.assertEqual(statement_type('-- only a comment'), '')
+        self.assertEqual(statement_type("'x'"), '')
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_literals_and_whitespace(self):
+        self.assertEqual(
+            fingerprint("SELECT  *\nFROM t WHERE a = 1 AND b = 'x' /* c */"),
+            fingerprint('select * from t where a = %s and b = %s'))
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE a = 1'),
+                         'select * from t where a = ?')
+
+    def test_in_lists(self):
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE a IN (1, 2, 3)'),
+                         fingerprint('SELECT * FROM t WHERE a IN (%s)'))
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE a IN (%s, %s)'),
+                         'select * from t where a in (?+)')
+
+    def test_values_rows(self):
+        self.assertEqual(fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)'),
+                         fingerprint('INSERT INTO t (a, b) VALUES (1, 2), (3, 4), (5, 6)'))
+        self.assertEqual(fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)'),
+                         'insert into t (a, b) values (?+)')
+
+    def test_identifiers_keep_their_case(self):
+        self.assertNotEqual(fingerprint('SELECT `A` FROM t'), fingerprint('SELECT `a` FROM t'))
+
+    def test_percent(self):
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE a LIKE %s ESCAPE '%%'"),
+                         'select * from t where a like ? escape ?')
+        self.assertEqual(fingerprint('SELECT a %% 2 FROM t'), 'select a % ? from t')
+
+
+class AddDirectiveTest(unittest.TestCase):
+
+    def test_after_leading_keyword(self):
+        self.assertEqual(add_directive('SELECT * FROM t', 'QUERY_TIMEOUT_MS=500'),
+                         'SELECT /*vt+ QUERY_TIMEOUT_MS=500 */ * FROM t')
+        self.assertEqual(add_directive('/* c */ select 1', 'SCATTER_ERRORS_AS_WARNINGS'),
+                         '/* c */ select /*vt+ SCATTER_ERRORS_AS_WARNINGS */ 1')
+
+    def test_no_keyword(self):
+        self.assertEqual(add_directive('(SELECT 1)', 'QUERY_TIMEOUT_MS=500'), '(SELECT 1)')
+
+
+class ReferencedTablesTest(unittest.TestCase):
+
+    def test_tables(self):
+        self.assertEqual(referenced_tables(
+            'SELECT * FROM `product` p JOIN commerce.`customer` c ON (c.id = p.id), corder'),
+            {'product', 'customer', 'corder'})
+        self.assertEqual(referenced_tables('UPDATE product SET price = 1'), {'product'})
+        self.assertEqual(referenced_tables('INSERT INTO product (sku) VALUES (%s)'), {'product'})
+        self.assertEqual(referenced_tables('SELECT COUNT(a, b) FROM t WHERE x IN (1, 2)'), {'t'})
+        self.assertEqual(referenced_tables('SELECT * FROM a JOIN b USING (id), c'),
+                         {'a', 'b', 'c'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+"""
+Golden vectors for the client-side vindexes. The expected keyspace ids come
+from go/vt/vtgate/vindexes/*_test.go, and for the values those tests don't
+cover, from the Go implementations (crypto/des, crypto/md5, math/bits).
+
+Run from support/django with: python -m unittest discover tests
+"""
+import binascii
+import unittest
+
+from custom_db_backends.vitess.keyrange import KeyRange, ShardResolver
+from custom_db_backends.vitess.vindexes import (
+    BinaryMD5, Binary, Hash, Numeric, ReverseBits, UnicodeLooseMD5, XXHash,
+    VtgateVindex, create_vindex,
+)
+
+
+def unhex(value):
+    return binascii.unhexlify(value)
+
+
+# (uint64, hash keyspace id, reverse_bits keyspace id)
+UINT64_VECTORS = [
+    (0, '8ca64de9c1b123a7', '0000000000000000'),
+    (1, '166b40b44aba4bd6', '8000000000000000'),
+    (2, '06e7ea22ce92708f', '4000000000000000'),
+    (3, '4eb190c9a2fa169c', 'c000000000000000'),
+    (4, 'd2fd8867d50d2dfe', '2000000000000000'),
+    (5, '70bb023c810ca87a', 'a000000000000000'),
+    (6, 'f098480ac4c4be71', '6000000000000000'),
+    (7, 'fb8baaad918119b8', 'e000000000000000'),
+    (8, 'cc083f1e6d9e85f6', '1000000000000000'),
+    (100, '83aab1569cbe1b08', '2600000000000000'),
+    (1000, '1f7db68037e0ff5a', '17c0000000000000'),
+    (12345, '2eb77c1f70087d3d', '9c0c000000000000'),
+    (4294967296, 'aeb5f5ede22d1a36', '0000000080000000'),
+    (3735928559, 'b88450c7e55e2364', 'f77db57b00000000'),
+    (9223372036854775807, 'f77d48aadda1f1bb', 'fffffffffffffffe'),
+    (9223372036854775808, '95f8a5e5dd31d900', '0000000000000001'),
+    (18446744073709551615, '355550b2150e2451', 'ffffffffffffffff'),
+]
+
+XXHASH_VECTORS = [
+    ('test1', 'd01ab7e4d6978f0b'),
+    ('test2', '87eb11714c0a0e89'),
+    (1, 'd46405367612b4b7'),
+    (None, '99e9d85137db46ef'),
+    (-1, 'd8e2a6a7c8c7623d'),
+    (18446744073709551615, '477cfa8d6d8f1f8d'),
+    (9223372036854775807, 'b37eb01f7bffafd8'),
+    (-9223372036854775808, '102c27ddb26a609e'),
+]
+
+BINARY_MD5_VECTORS = [
+    ('Test', '0cbc6611f5540bd0809a388dc95a615b'),
+    ('TEST', '033bd94b1168d7e4f0d644c3c95e35bf'),
+]
+
+
+class HashTest(unittest.TestCase):
+
+    def test_map(self):
+        vindex = Hash('hash')
+        for value, keyspace_id, _ in UINT64_VECTORS:
+            self.assertEqual(vindex.keyspace_id(value), unhex(keyspace_id), value)
+            self.assertEqual(vindex.keyspace_id(str(value)), unhex(keyspace_id), value)
+
+    def test_map_signed(self):
+        # Signed values are reinterpreted as uint64, like in hash_test.go.
+        vindex = Hash('hash')
+        self.assertEqual(vindex.keyspace_id(-1), unhex('355550b2150e2451'))
+        self.assertEqual(vindex.keyspace_id(-(1 << 63)), unhex('95f8a5e5dd31d900'))
+        # Negative strings and non-numbers have no keyspace id.
+        self.assertEqual(vindex.map(['-1', 'aa', None]), [None, None, None])
+
+    def test_reverse_map(self):
+        vindex = Hash('hash')
+        values = [value for value, _, _ in UINT64_VECTORS]
+        keyspace_ids = [unhex(keyspace_id) for _, keyspace_id, _ in UINT64_VECTORS]
+        self.assertEqual(vindex.reverse_map(keyspace_ids), values)
+
+    def test_verify(self):
+        vindex = Hash('hash')
+        self.assertEqual(vindex.verify([1, 2], [unhex('166b40b44aba4bd6')] * 2),
+                         [True, False])
+
+
+class ReverseBitsTest(unittest.TestCase):
+
+    def test_map(self):
+        vindex = ReverseBits('reverse_bits')
+        for value, _, keyspace_id in UINT64_VECTORS:
+            self.assertEqual(vindex.keyspace_id(value), unhex(keyspace_id), value)
+        self.assertEqual(vindex.map([-1]), [None])
+
+    def test_reverse_map(self):
+        vindex = ReverseBits('reverse_bits')
+        self.assertEqual(vindex.reverse_map([unhex('9c0c000000000000')]), [12345])
+
+
+class NumericTest(unittest.TestCase):
+
+    def test_map(self):
+        vindex = Numeric('numeric')
+        self.assertEqual(vindex.map([1, '8', -1, 'aa']),
+                         [unhex('0000000000000001'), unhex('0000000000000008'),
+                          None, None])
+        self.assertEqual(vindex.reverse_map([unhex('0000000000000001')]), [1])
+
+
+class XXHashTest(unittest.TestCase):
+
+    def test_map(self):
+        vindex = XXHash('xxhash')
+        for value, keyspace_id in XXHASH_VECTORS:
+            self.assertEqual(vindex.keyspace_id(value), unhex(keyspace_id), value)
+
+    def test_long_input(self):
+        # Exercise the 32-byte stripe loop and every tail length.
+        vindex = XXHash('xxhash')
+        keyspace_ids = set(vindex.keyspace_id(b'a' * n) for n in range(70))
+        self.assertEqual(len(keyspace_ids), 70)
+
+
+class BinaryTest(unittest.TestCase):
+
+    def test_binary(self):
+        self.assertEqual(Binary('binary').keyspace_id('test1'), b'test1')
+
+    def test_binary_md5(self):
+        vindex = BinaryMD5('binary_md5')
+        for value, keyspace_id in BINARY_MD5_VECTORS:
+            self.assertEqual(vindex.keyspace_id(value), unhex(keyspace_id))
+
+
+class CreateVindexTest(unittest.TestCase):
+
+    def test_types(self):
+        self.assertIsInstance(create_vindex('hash', 'h'), Hash)
+        self.assertIsInstance(create_vindex('unicode_loose_md5', 'u'), UnicodeLooseMD5)
+        lookup = create_vindex('lookup_hash_unique', 'l', {'table': 't'}, 'user')
+        self.assertIsInstance(lookup, VtgateVindex)
+        self.assertTrue(lookup.unique)
+        self.assertFalse(lookup.client_side)
+        self.assertEqual(lookup.owner, 'user')
+
+
+class ShardResolverTest(unittest.TestCase):
+
+    def test_shard_for_keyspace_id(self):
+        resolver = ShardResolver(['80-c0', '-40', 'c0-', '40-80'])
+        self.assertEqual(resolver.shards, ['-40', '40-80', '80-c0', 'c0-'])
+        self.assertEqual(resolver.shard_for_keyspace_id(b''), '-40')
+        self.assertEqual(resolver.shard_for_keyspace_id(unhex('166b40b44aba4bd6')), '-40')
+        self.assertEqual(resolver.shard_for_keyspace_id(b'\x40'), '40-80')
+        self.assertEqual(resolver.shard_for_keyspace_id(unhex('8ca64de9c1b123a7')), '80-c0')
+        self.assertEqual(resolver.shard_for_keyspace_id(b'\xff' * 8), 'c0-')
+
+    def test_unsharded(self):
+        resolver = ShardResolver(['0'])
+        self.assertEqual(resolver.shard_for_keyspace_id(b'\x99'), '0')
+
+    def test_key_range_intersection(self):
+        resolver = ShardResolver(['-80', '80-'])
+        self.assertEqual(resolver.shards_for_key_range(KeyRange.from_shard_name('40-c0')),
+                         ['-80', '80-'])
+        self.assertEqual(resolver.shards_for_key_range(KeyRange.from_shard_name('80-90')),
+                         ['80-'])
+
+    def test_from_srv_keyspace(self):
+        srv_keyspace = {'partitions': [
+            {'served_type': 'MASTER',
+             'shard_references': [{'name': '-80'}, {'name': '80-'}]},
+            {'served_type': 3,
+             'shard_references': [{'key_range': {'end': 'gA=='}},
+                                  {'key_range': {'start': 'gA=='}}]},
+        ]}
+        self.assertEqual(ShardResolver.from_srv_keyspace(srv_keyspace).shards,
+                         ['-80', '80-'])
+        self.assertEqual(ShardResolver.from_srv_keyspace(srv_keyspace, 'rdonly').shards,
+                         ['-80', '80-'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Row changes, batching and checkpoints of the VStream consumer, with a fake
+stream instead of vtgate.
+
+Needs mysqlclient and the generated proto modules (see vtgate_grpc.py).
+Run from support/django with: python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from custom_db_backends.vitess import vstream
+    from custom_db_backends.vitess.vtgate_grpc import query_pb2
+except ImproperlyConfigured:
+    vstream = None
+
+binlogdata_pb2 = getattr(vstream, 'binlogdata_pb2', None)
+
+
+def row(*values):
+    return query_pb2.Row(lengths=[len(value) for value in values], values=b''.join(values))
+
+
+def vgtid(gtid):
+    return binlogdata_pb2.VGtid(shard_gtids=[
+        binlogdata_pb2.ShardGtid(keyspace='customer', shard='-80', gtid=gtid)])
+
+
+def field_event():
+    return binlogdata_pb2.VEvent(
+        type=binlogdata_pb2.FIELD,
+        field_event=binlogdata_pb2.FieldEvent(table_name='customer.product', fields=[
+            query_pb2.Field(name='id', type=query_pb2.INT64),
+            query_pb2.Field(name='name', type=query_pb2.VARCHAR)]))
+
+
+def row_event(before=None, after=None, table='customer.product'):
+    row_change = binlogdata_pb2.RowChange()
+    if before is not None:
+        row_change.before.CopyFrom(row(*before))
+    if after is not None:
+        row_change.after.CopyFrom(row(*after))
+    return binlogdata_pb2.VEvent(
+        type=binlogdata_pb2.ROW,
+        row_event=binlogdata_pb2.RowEvent(table_name=table, row_changes=[row_change]))
+
+
+def transaction(gtid, *events):
+    return [binlogdata_pb2.VEvent(type=binlogdata_pb2.BEGIN)] + list(events) + [
+        binlogdata_pb2.VEvent(type=binlogdata_pb2.VGTID, vgtid=vgtid(gtid)),
+        binlogdata_pb2.VEvent(type=binlogdata_pb2.COMMIT)]
+
+
+class FakeCall(object):
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.cancelled = False
+
+    def __iter__(self):
+        return iter(self.responses)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@unittest.skipIf(vstream is None, 'mysqlclient or the vtgate protos are not installed')
+class VStreamConsumerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, 'vstream.json')
+        self.batches = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def consume(self, responses, **options):
+        consumer = vstream.VStreamConsumer('localhost:15991', 'customer', ['product'],
+                                           self.batches.append, checkpoint=self.checkpoint,
+                                           **options)
+        stub = mock.Mock()
+        stub.VStream.return_value = FakeCall(
+            [vstream.vtgate_pb2.VStreamResponse(events=events) for events in responses])
+        with mock.patch.object(vstream.grpc, 'insecure_channel'), \
+                mock.patch.object(vstream.vtgateservice_pb2_grpc, 'VitessStub',
+                                  return_value=stub):
+            consumer._consume()
+        return consumer
+
+    def test_changes(self):
+        self.consume([[field_event()] + transaction(
+            'MySQL56/1-1',
+            row_event(after=(b'1', b'a')),
+            row_event(before=(b'1', b'a'), after=(b'2', b'a')),
+            row_event(before=(b'2', b'a')),
+            row_event(after=(b'3', b'b'), table='customer.other'))])
+        self.assertEqual(len(self.batches), 1)
+        changes = self.batches[0].changes
+        self.assertEqual([(change.kind, change.key) for change in changes], [
+            ('insert', 1), ('update', 1), ('update', 2), ('delete', 2)])
+        self.assertEqual(changes[0].after, {'id': 1, 'name': 'a'})
+        self.assertEqual(self.batches[0].keys(), {'product': {1, 2}})
+
+    def test_waits_for_the_end_of_a_transaction(self):
+        events = [field_event()] + transaction('MySQL56/1-1', row_event(after=(b'1', b'a')))
+        # The second transaction ends in the next response: its VGTID may
+        # come before its COMMIT, so nothing is handed over until then.
+        second = transaction('MySQL56/1-2', row_event(after=(b'2', b'b')))
+        consumer = self.consume([events + second[:3], second[3:]])
+        self.assertEqual([[change.key for change in batch.changes] for batch in self.batches],
+                         [[1, 2]])
+        self.assertEqual(consumer.stats()['position'], ['customer:-80@MySQL56/1-2'])
+
+    def test_checkpoint(self):
+        self.consume([[field_event()] + transaction('MySQL56/1-5', row_event(after=(b'1', b'a')))])
+        resumed = vstream.VStreamConsumer('localhost:15991', 'customer', ['product'],
+                                          self.batches.append, checkpoint=self.checkpoint)
+        self.assertEqual(resumed.vgtid, vgtid('MySQL56/1-5'))
+        self.assertEqual(resumed._request().vgtid, vgtid('MySQL56/1-5'))
+
+    def test_composite_primary_key(self):
+        self.consume([[field_event()] + transaction('MySQL56/1-1', row_event(after=(b'1', b'a')))],
+                     primary_keys={'product': ['id', 'name']})
+        self.assertEqual(self.batches[0].changes[0].key, (1, 'a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
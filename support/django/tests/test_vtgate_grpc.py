@@ -0,0 +1,121 @@
+"""
+Decoding of query.proto values into the values mysqlclient returns, and
+batches of a Connection against a fake vtgate.
+
+Needs mysqlclient and the generated proto modules (see vtgate_grpc.py).
+Run from support/django with: python -m unittest discover tests
+"""
+import datetime
+import unittest
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from custom_db_backends.vitess import vtgate_grpc
+except ImproperlyConfigured:
+    vtgate_grpc = None
+
+
+@unittest.skipIf(vtgate_grpc is None, 'mysqlclient or the vtgate gRPC modules are missing')
+class ConvertersTest(unittest.TestCase):
+
+    def test_datetime(self):
+        convert = vtgate_grpc._datetime
+        self.assertEqual(convert(b'2020-01-02 03:04:05'),
+                         datetime.datetime(2020, 1, 2, 3, 4, 5))
+        self.assertEqual(convert(b'2020-01-02 03:04:05.1'),
+                         datetime.datetime(2020, 1, 2, 3, 4, 5, 100000))
+        self.assertEqual(convert(b'2020-01-02 03:04:05.12345'),
+                         datetime.datetime(2020, 1, 2, 3, 4, 5, 123450))
+        self.assertEqual(convert(b'2020-01-02 03:04:05.123456'),
+                         datetime.datetime(2020, 1, 2, 3, 4, 5, 123456))
+        self.assertIsNone(convert(b'0000-00-00 00:00:00'))
+
+    def test_time(self):
+        convert = vtgate_grpc._time
+        self.assertEqual(convert(b'03:04:05'), datetime.time(3, 4, 5))
+        self.assertEqual(convert(b'03:04:05.12'), datetime.time(3, 4, 5, 120000))
+        self.assertIsNone(convert(b'838:59:59'))
+
+    def test_date(self):
+        self.assertEqual(vtgate_grpc._date(b'2020-01-02'), datetime.date(2020, 1, 2))
+        self.assertIsNone(vtgate_grpc._date(b'0000-00-00'))
+
+    def test_decimal(self):
+        self.assertEqual(vtgate_grpc.CONVERTERS[vtgate_grpc.query_pb2.DECIMAL](b'1.50'),
+                         Decimal('1.50'))
+
+
+class FakeVitessStub(object):
+    """
+    Runs ExecuteBatch like vtgate: query by query, going on after a failed
+    one. Queries containing 'fail' fail; the others are recorded, and
+    dropped again by a rollback.
+    """
+
+    def __init__(self):
+        self.committed = []
+        self.pending = []
+
+    def ExecuteBatch(self, request, timeout=None):
+        session = vtgate_grpc.vtgate_pb2.Session()
+        session.CopyFrom(request.session)
+        results = []
+        for query in request.queries:
+            result = vtgate_grpc.query_pb2.ResultWithError()
+            if 'fail' in query.sql:
+                result.error.code = vtgate_grpc.vtrpc_pb2.INVALID_ARGUMENT
+                result.error.message = 'syntax error (errno 1064)'
+            elif query.sql == 'begin':
+                session.in_transaction = True
+            elif session.in_transaction:
+                self.pending.append(query.sql)
+            else:
+                self.committed.append(query.sql)
+            results.append(result)
+        return vtgate_grpc.vtgate_pb2.ExecuteBatchResponse(session=session, results=results)
+
+    def Execute(self, request, timeout=None):
+        session = vtgate_grpc.vtgate_pb2.Session()
+        session.CopyFrom(request.session)
+        if request.query.sql == 'commit':
+            self.committed.extend(self.pending)
+        self.pending = []
+        session.in_transaction = False
+        return vtgate_grpc.vtgate_pb2.ExecuteResponse(session=session)
+
+
+@unittest.skipIf(vtgate_grpc is None, 'mysqlclient or the vtgate gRPC modules are missing')
+class ExecuteBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = vtgate_grpc.Connection('localhost:15991', 'customer')
+        self.stub = self.connection.stub = FakeVitessStub()
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_transaction_commits(self):
+        results = self.connection.execute_batch([('insert 1', None), ('insert 2', None)],
+                                                as_transaction=True)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.stub.committed, ['insert 1', 'insert 2'])
+        self.assertFalse(self.connection.session.in_transaction)
+
+    def test_failed_statement_rolls_back_the_rest(self):
+        with self.assertRaises(vtgate_grpc.Database.ProgrammingError):
+            self.connection.execute_batch(
+                [('insert 1', None), ('fail', None), ('insert 3', None)],
+                as_transaction=True)
+        self.assertEqual(self.stub.committed, [])
+        self.assertFalse(self.connection.session.in_transaction)
+
+    def test_without_transaction(self):
+        with self.assertRaises(vtgate_grpc.Database.ProgrammingError):
+            self.connection.execute_batch([('insert 1', None), ('fail', None)])
+        self.assertEqual(self.stub.committed, ['insert 1'])
+
+
+if __name__ == '__main__':
+    unittest.main()